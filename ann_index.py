@@ -0,0 +1,160 @@
+import json
+import math
+import os
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+DEFAULT_INDEX_TYPE = os.environ.get("INDEX_TYPE", "flat")
+PARAMS_FILE = "index_params.json"
+
+# How each vector is stored: 4, 2 or 1 byte(s) per dimension, or pq_m bytes of PQ codes
+VECTOR_CODECS = ("float32", "float16", "int8", "pq")
+DEFAULT_VECTOR_CODEC = os.environ.get("VECTOR_CODEC", "float32")
+SCALAR_QUANTIZERS = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+# Open saved indexes memory-mapped: vectors are paged in from the file as searches touch
+# them and the pages are shared by every worker process that maps the same file
+INDEX_MMAP = os.environ.get("INDEX_MMAP", "0").lower() in ("1", "true", "yes")
+
+# Query-time defaults; each index stores its own and these env vars override them
+SEARCH_NPROBE = int(os.environ["SEARCH_NPROBE"]) if os.environ.get("SEARCH_NPROBE") else None
+SEARCH_EF_SEARCH = int(os.environ["SEARCH_EF_SEARCH"]) if os.environ.get("SEARCH_EF_SEARCH") else None
+
+# k-means wants roughly this many training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def _pq_subquantizers(dim: int, requested: int) -> int:
+    # PQ needs the vector dimension to be a multiple of the number of sub-quantizers
+    for m in range(min(requested, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def build_faiss_index(vectors, index_type: str = None, nlist: int = None, nprobe: int = None,
+                      hnsw_m: int = 32, ef_construction: int = 80, ef_search: int = 64,
+                      pq_m: int = 64, pq_nbits: int = 8, codec: str = None):
+    """Build a FAISS index of ``index_type`` over ``vectors`` and return ``(index, params)``.
+
+    IVF variants are trained on the vectors themselves. When there are too few vectors
+    to train them well, the index falls back to the next simpler type (ivf_pq -> ivf_flat
+    -> flat); ``params["index_type"]`` records what was actually built. ``params`` also
+    holds the default query-time settings (nprobe / ef_search) saved with the index.
+
+    ``codec`` (see VECTOR_CODECS) compresses the stored vectors of flat, ivf_flat and hnsw
+    indexes; ivf_pq always stores PQ codes. PQ needs as many vectors to train as ivf_pq
+    does and falls back to int8 with fewer; ``params["codec"]`` records what was used.
+    """
+    index_type = index_type or DEFAULT_INDEX_TYPE
+    codec = codec or DEFAULT_VECTOR_CODEC
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'; expected one of {', '.join(INDEX_TYPES)}.")
+    if codec not in VECTOR_CODECS:
+        raise ValueError(f"Unknown vector codec '{codec}'; expected one of {', '.join(VECTOR_CODECS)}.")
+
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    count, dim = vectors.shape
+    params = {"index_type": index_type, "dim": dim, "count": count, "requested_index_type": index_type,
+              "requested_codec": codec}
+
+    if index_type == "ivf_pq" or (index_type == "ivf_flat" and codec == "pq"):
+        index_type, codec = "ivf_pq", "pq"
+    if codec == "pq" and count < MIN_POINTS_PER_CENTROID * (2 ** pq_nbits):
+        codec = "int8"
+        if index_type == "ivf_pq":
+            index_type = "ivf_flat"
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = nlist or max(1, int(math.sqrt(count)))
+        nlist = min(nlist, count // MIN_POINTS_PER_CENTROID)
+        if nlist < 4:
+            index_type = "flat"
+    params.update({"index_type": index_type, "codec": codec})
+    if codec == "pq":
+        pq_m = _pq_subquantizers(dim, pq_m)
+        params.update({"pq_m": pq_m, "pq_nbits": pq_nbits})
+
+    if index_type == "flat":
+        if codec == "float32":
+            index = faiss.IndexFlatL2(dim)
+        elif codec == "pq":
+            index = faiss.IndexPQ(dim, pq_m, pq_nbits)
+        else:
+            index = faiss.IndexScalarQuantizer(dim, SCALAR_QUANTIZERS[codec], faiss.METRIC_L2)
+    elif index_type == "hnsw":
+        if codec == "float32":
+            index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        elif codec == "pq":
+            index = faiss.IndexHNSWPQ(dim, pq_m, hnsw_m, pq_nbits)
+        else:
+            index = faiss.IndexHNSWSQ(dim, SCALAR_QUANTIZERS[codec], hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+        index.hnsw.efSearch = ef_search
+        params.update({"hnsw_m": hnsw_m, "ef_construction": ef_construction, "ef_search": ef_search})
+    else:
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits)
+        elif codec == "float32":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_L2)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, SCALAR_QUANTIZERS[codec], faiss.METRIC_L2)
+        index.nprobe = nprobe or max(1, nlist // 8)
+        params.update({"nlist": nlist, "nprobe": index.nprobe})
+
+    # IVF centroids, scalar-quantizer ranges and PQ codebooks are all learned from the vectors
+    if not index.is_trained:
+        index.train(vectors)
+    if count:
+        index.add(vectors)
+    return index, params
+
+
+def read_index(path: str, params=None, mmap: bool = INDEX_MMAP):
+    """Read a saved FAISS index, memory-mapped if ``mmap``.
+
+    IVF indexes map their inverted lists; the others map their stored vectors. Mapped
+    files must never be rewritten in place, which is why ``write_index`` replaces them.
+    """
+    if not mmap:
+        return faiss.read_index(path)
+    index_type = (params or {}).get("index_type", "flat")
+    flags = faiss.IO_FLAG_MMAP if index_type in ("ivf_flat", "ivf_pq") else faiss.IO_FLAG_MMAP_IFC
+    return faiss.read_index(path, flags | faiss.IO_FLAG_READ_ONLY)
+
+
+def write_index(index, path: str):
+    # A new file swapped into place leaves processes that still map the old one unaffected
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def search_parameters(params, nprobe: int = None, ef_search: int = None):
+    """Return FAISS per-query search parameters for an index, or None for exact search.
+
+    Passing them to ``index.search`` (rather than setting ``index.nprobe``) keeps a shared
+    index safe to query from many threads with different settings.
+    """
+    index_type = (params or {}).get("index_type", "flat")
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nprobe = nprobe or SEARCH_NPROBE or params.get("nprobe", 1)
+        return faiss.SearchParametersIVF(nprobe=min(nprobe, params.get("nlist", nprobe)))
+    if index_type == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=ef_search or SEARCH_EF_SEARCH or params.get("ef_search", 64))
+    return None
+
+
+def save_index_params(persist_dir: str, params):
+    with open(os.path.join(persist_dir, PARAMS_FILE), "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=2)
+
+
+def load_index_params(persist_dir: str):
+    """Return the saved index parameters; stores written before they existed are flat."""
+    try:
+        with open(os.path.join(persist_dir, PARAMS_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"index_type": "flat"}
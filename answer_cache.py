@@ -0,0 +1,192 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+
+import numpy as np
+
+import tracing
+from config import get_embeddings
+from embedding_pipeline import count_tokens
+from rate_governor import get_governor
+
+DEFAULT_CACHE_PATH = os.environ.get("ANSWER_CACHE_PATH", "rag_answer_cache.sqlite")
+DEFAULT_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+# Answers older than this are recomputed; 0 keeps them until evicted or invalidated
+DEFAULT_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Cosine similarity above which a differently worded query reuses an answer; 0 = exact match only
+DEFAULT_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0"))
+
+
+def normalize_query(query: str) -> str:
+    """Case, whitespace and trailing punctuation don't change the question."""
+    return re.sub(r"\s+", " ", query).strip().rstrip("?.!").strip().lower()
+
+
+class AnswerCache:
+    """Persistent cache of final agent answers keyed by the index fingerprint and the query.
+
+    A lookup first tries the normalized query exactly; if ``similarity_threshold`` is set
+    and an ``embeddings`` backend is given, it then falls back to the most similar cached
+    query for the same index. Entries expire after ``ttl_seconds``, the least recently
+    used are evicted beyond ``max_entries``. Adding, replacing or removing a document changes
+    the fingerprint, so answers computed against an older index are never returned again;
+    they simply age out.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        embeddings=None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        similarity_threshold: float = DEFAULT_SIMILARITY,
+    ):
+        self.path = path
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, query TEXT NOT NULL, answer TEXT NOT NULL,"
+            " embedding BLOB, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_fingerprint ON answers (fingerprint)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(query: str, fingerprint: str) -> str:
+        return hashlib.sha256(f"{fingerprint}\n{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    @property
+    def semantic(self):
+        return bool(self.similarity_threshold) and self.embeddings is not None
+
+    def get(self, query: str, fingerprint: str, embedding=None):
+        """Return the cached answer for ``query`` against the index ``fingerprint``, or None.
+
+        ``embedding`` (the query's vector) is computed on demand when similarity matching is on.
+        """
+        with tracing.span("answer_cache.lookup") as lookup_span:
+            answer, match = self._lookup(query, fingerprint, embedding)
+            lookup_span.set(hit=answer is not None, match=match)
+        tracing.count("answer_cache.hits" if answer is not None else "answer_cache.misses")
+        return answer
+
+    def _lookup(self, query, fingerprint, embedding):
+        now = time.time()
+        oldest = now - self.ttl_seconds if self.ttl_seconds else 0
+        key = self.key(query, fingerprint)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer FROM answers WHERE key = ? AND created >= ?", (key, oldest)
+            ).fetchone()
+            if row is not None:
+                self._touch(key, now)
+                self.hits += 1
+                return row[0], "exact"
+
+        if self.semantic:
+            if embedding is None:
+                embedding = self._embed(query)
+            query_vector = np.asarray(embedding, dtype="float32")
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT key, answer, embedding FROM answers"
+                    " WHERE fingerprint = ? AND created >= ? AND embedding IS NOT NULL",
+                    (fingerprint, oldest),
+                ).fetchall()
+                best_key, best_answer, best_score = None, None, self.similarity_threshold
+                for row_key, answer, blob in rows:
+                    vector = np.frombuffer(blob, dtype="float32")
+                    if vector.shape != query_vector.shape:
+                        continue
+                    denominator = float(np.linalg.norm(vector) * np.linalg.norm(query_vector)) or 1.0
+                    score = float(vector @ query_vector) / denominator
+                    if score >= best_score:
+                        best_key, best_answer, best_score = row_key, answer, score
+                if best_key is not None:
+                    self._touch(best_key, now)
+                    self.hits += 1
+                    return best_answer, "similar"
+
+        with self._lock:
+            self.misses += 1
+        return None, None
+
+    def _embed(self, query):
+        # Counted against the shared embeddings budget like the retriever's query embeddings
+        get_governor("embeddings").acquire(count_tokens(query))
+        return self.embeddings.embed_query(query)
+
+    def _touch(self, key, now):
+        self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+        self._conn.commit()
+
+    def put(self, query: str, fingerprint: str, answer: str, embedding=None):
+        if self.semantic and embedding is None:
+            embedding = self._embed(query)
+        blob = array("f", embedding).tobytes() if embedding is not None else None
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, fingerprint, query, answer, embedding, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.key(query, fingerprint), fingerprint, query, answer, blob, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl_seconds:
+            self._conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl_seconds,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_used LIMIT ?)",
+                (overflow,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self), "max_entries": self.max_entries}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """Return the process-wide answer cache, opening it on first use."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            # Similarity matching needs query vectors; without it no embedding calls are made
+            _shared_cache = AnswerCache(embeddings=get_embeddings() if DEFAULT_SIMILARITY else None)
+        return _shared_cache
@@ -1,14 +1,16 @@
 import streamlit as st
-import os
-import tempfile
-import time
+import importlib
+import threading
+import uuid
 import json
-import fitz  # PyMuPDF for metadata
 from datetime import datetime
 from dotenv import load_dotenv
-from rag_index_builder import build_index_from_pdf
-from tools import retrieve_legal_context
-from autogen import AssistantAgent, UserProxyAgent
+from config import STREAM_ANSWERS
+from matters import matter_dir, matter_id_for, use_matter
+import rate_governor
+import tracing
+# PyMuPDF, FAISS/LangChain (index_manager, retriever) and AutoGen (legal_agent) take
+# seconds to import, so they are imported where first needed, not before the first paint
 
 # --- CONFIGURATION & SETUP ---
 load_dotenv()
@@ -333,87 +335,25 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- BACKEND LOGIC ---
-
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
-AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
-
-llm_config = {
-    "config_list": [
-        {
-            "api_key": AZURE_OPENAI_API_KEY,
-            "base_url": AZURE_OPENAI_ENDPOINT,
-            "api_type": "azure",
-            "api_version": AZURE_OPENAI_API_VERSION,
-            "model": "gpt-4o", 
-        }
-    ],
-    "temperature": 0
-}
-
-def is_termination_msg(msg):
-    return msg.get("content") and "TERMINATE" in msg["content"]
-
-def run_agent(query):
-    legal_assistant = AssistantAgent(
-        name="LegalAssistant",
-        system_message=(
-            "You are a highly capable legal research assistant. Answer user queries strictly by utilizing the 'retrieve_legal_context' tool to find evidence in the provided documents. "
-            "Maintain a professional, objective, and precise tone. "
-            "After answering, always respond with 'TERMINATE'."
-        ),
-        llm_config=llm_config,
-    )
-
-    user = UserProxyAgent(
-        name="User",
-        llm_config=False,
-        human_input_mode="NEVER",
-        is_termination_msg=is_termination_msg,
-        code_execution_config={"use_docker": False}
-    )
-
-    legal_assistant.register_for_llm(name="retrieve_legal_context", description="Retrieve context from legal documents.")(retrieve_legal_context)
-    user.register_for_execution(name="retrieve_legal_context")(retrieve_legal_context)
-
-    chat_result = user.initiate_chat(
-        legal_assistant,
-        message=query,
-        summary_method="reflection_with_llm"
-    )
-
-    history = getattr(chat_result, "chat_history", None)
-    if history is None:
-        return "No chat history found.", []
-
-    for msg in reversed(history):
-        if msg.get("role") == "user" and msg.get("name") == "LegalAssistant":
-            final_content = msg.get("content", "").replace("TERMINATE", "").strip()
-            return final_content, history
-
-    return "Unable to generate a valid response based on the provided context.", history
-
-# --- Helper: Retry with exponential backoff for rate limits ---
-def run_agent_with_retry(query, max_retries: int = 5, initial_delay_seconds: float = 3.0):
-    """Call run_agent with retries on Azure OpenAI rate limit errors."""
-    delay = initial_delay_seconds
-    for attempt in range(max_retries):
-        try:
-            return run_agent(query)
-        except Exception as e:
-            # Detect Azure OpenAI rate limit error
-            msg = str(e)
-            if "RateLimitReached" in msg or "429" in msg:
-                time.sleep(delay)
-                delay *= 2  # exponential backoff
-                continue
-            # Non-rate-limit errors should be raised
-            raise
-    # Fallback after exhausting retries
-    return (
-        "Rate limit reached. Please wait a moment and try again.",
-        []
-    )
+# Agents, retries, the answer cache and streaming live in legal_agent.py
+
+def render_message(msg):
+    if msg["role"] == "user":
+        return f"""
+        <div style="display: flex; justify-content: flex-end; margin-bottom: 10px;">
+            <div class="user-msg">
+                {msg['content']}
+            </div>
+        </div>
+        """
+    return f"""
+    <div style="display: flex; justify-content: flex-start; margin-bottom: 10px;">
+        <div class="bot-msg">
+            <strong style="color: #0f172a;">LexAI Assistant</strong>{' <small>⚡ cached</small>' if msg.get('cached') else ''}<br>
+            {msg['content']}
+        </div>
+    </div>
+    """
 
 # --- SESSION STATE MANAGEMENT ---
 if "chat_history" not in st.session_state:
@@ -424,6 +364,115 @@ if "doc_meta" not in st.session_state:
     st.session_state.doc_meta = {}
 if "last_answer" not in st.session_state:
     st.session_state.last_answer = ""
+if "last_trace_id" not in st.session_state:
+    st.session_state.last_trace_id = None
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if "indexing_jobs" not in st.session_state:
+    st.session_state.indexing_jobs = []
+if "submitted_uploads" not in st.session_state:
+    st.session_state.submitted_uploads = set()
+if "matter_id" not in st.session_state:
+    # Each session indexes into its own matter unless one is named in the URL (?matter=smith_v_jones)
+    try:
+        st.session_state.matter_id = matter_id_for(st.query_params.get("matter", ""))
+    except ValueError:
+        st.session_state.matter_id = f"session_{st.session_state.session_id[:12]}"
+
+
+def matter_persist_dir():
+    return matter_dir(st.session_state.matter_id)
+
+
+def cancel_consultations():
+    """Stop any answer still being generated for this session."""
+    # The service only exists once this session has asked something
+    if "agent_pool" in st.session_state:
+        from consultation_service import get_consultation_service
+        get_consultation_service().cancel(st.session_state.session_id)
+
+
+def switch_matter(matter_id):
+    """Open another matter: its documents and a fresh chat."""
+    from index_manager import read_manifest
+
+    cancel_consultations()
+    st.session_state.matter_id = matter_id
+    st.query_params["matter"] = matter_id
+    st.session_state.chat_history = []
+    st.session_state.last_answer = ""
+    st.session_state.doc_meta = {}
+    st.session_state.pdf_processed = bool((read_manifest(matter_persist_dir()) or {}).get("documents"))
+
+
+STAGE_LABELS = {
+    "upload": "📤 Receiving upload",
+    "extract": "📖 Extracting pages",
+    "embed": "🔍 Embedding chunks",
+    "summarize": "📝 Summarizing sections",
+    "facts": "📌 Extracting facts",
+    "save": "💾 Writing index",
+}
+
+
+def submit_upload(uploaded_file):
+    """Queue an uploaded PDF for indexing into this session's matter (once per upload)."""
+    if uploaded_file.file_id in st.session_state.submitted_uploads:
+        return
+    from indexing_jobs import get_indexing_queue
+
+    # Each upload is added to the case file; re-uploading a file with the same name replaces it
+    job = get_indexing_queue().submit(uploaded_file, uploaded_file.name, matter_persist_dir())
+    st.session_state.submitted_uploads.add(uploaded_file.file_id)
+    st.session_state.indexing_jobs.append(job.id)
+
+
+@st.fragment(run_every=1)
+def show_indexing_jobs():
+    """Progress of this session's indexing jobs, refreshed every second without rerunning the page."""
+    from indexing_jobs import get_indexing_queue
+
+    queue = get_indexing_queue()
+    finished = False
+    for job_id in list(st.session_state.indexing_jobs):
+        job = queue.get(job_id)
+        if job is None:
+            st.session_state.indexing_jobs.remove(job_id)
+            continue
+        if job.persist_dir != matter_persist_dir():
+            continue
+        info = job.snapshot()
+        if info["status"] == "done":
+            index_stats = (info["entry"] or {}).get("stats", {})
+            st.session_state.doc_meta = {
+                "name": info["name"],
+                "pages": info["pages"] or "—",
+                "size": f"{round(info['size'] / 1024, 1)} KB",
+                "chunks": f"{index_stats.get('chunks', '—')} ({index_stats.get('cache_hits', 0)} cached)",
+                "indexed_time": datetime.now().strftime("%Y-%m-%d %H:%M"),
+            }
+            st.session_state.pdf_processed = True
+            st.session_state.indexing_jobs.remove(job_id)
+            finished = True
+        elif info["status"] == "failed":
+            st.error(f"❌ {info['name']}: indexing failed ({info['error']})")
+            if st.button("Dismiss", key=f"dismiss_{job_id}"):
+                st.session_state.indexing_jobs.remove(job_id)
+                st.rerun(scope="fragment")
+        elif info["status"] == "cancelled":
+            st.session_state.indexing_jobs.remove(job_id)
+        else:
+            done, total = info["progress"].get(info["stage"], (0, 0))
+            label = "⏳ Queued" if info["status"] == "queued" else STAGE_LABELS[info["stage"]]
+            if total and info["stage"] != "upload":
+                label += f"... {done}/{total}"
+            job_cols = st.columns([5, 1])
+            job_cols[0].progress(info["fraction"], text=f"{info['name']}: {label}")
+            if job_cols[1].button("✖️ Cancel", key=f"cancel_{job_id}"):
+                job.cancel()
+    if finished:
+        # Show the new document in the sidebar and open the consultation
+        st.rerun()
 
 # --- UI LAYOUT ---
 
@@ -432,6 +481,16 @@ with st.sidebar:
     st.markdown("### ⚖️ LexAI")
     st.caption("Legal RAG Assistant")
     st.markdown("---")
+    st.markdown("### 🗂️ Matter")
+    # Documents, their index and cached answers are kept separately for each matter
+    matter_name = st.text_input("Matter", value=st.session_state.matter_id, label_visibility="collapsed")
+    if matter_name.strip() and matter_name != st.session_state.matter_id:
+        try:
+            switch_matter(matter_id_for(matter_name))
+            st.rerun()
+        except ValueError as e:
+            st.warning(str(e))
+    st.markdown("---")
     st.markdown("### 📋 System Status")
     
     if st.session_state.pdf_processed:
@@ -442,8 +501,56 @@ with st.sidebar:
             **File:** {meta.get("name", "—")}  
             **Pages:** {meta.get("pages", "—")}  
             **Size:** {meta.get("size", "—")}  
+            **Chunks:** {meta.get("chunks", "—")}  
             **Indexed:** {meta.get("indexed_time", "—")}
             """)
+        from index_manager import get_index_manager
+
+        indexed_documents = get_index_manager(matter_persist_dir()).list_documents()
+        with st.expander(f"📚 Case File ({len(indexed_documents)} documents)", expanded=False):
+            for doc_id, entry in indexed_documents.items():
+                doc_cols = st.columns([4, 1])
+                doc_cols[0].caption(entry.get("name", doc_id))
+                if doc_cols[1].button("🗑️", key=f"remove_{doc_id}"):
+                    get_index_manager(matter_persist_dir()).remove_document(doc_id)
+                    st.rerun()
+            if len(indexed_documents) > 1 and st.button("🗜️ Compact index", use_container_width=True):
+                # Merge all documents into one segment built with the configured INDEX_TYPE
+                with st.spinner("Compacting index..."):
+                    get_index_manager(matter_persist_dir()).compact()
+                st.rerun()
+        with st.expander("➕ Add Document", expanded=bool(st.session_state.indexing_jobs)):
+            # Indexed in the background; questions keep going to the documents already indexed
+            more_file = st.file_uploader("Add PDF", type=["pdf"], key="add_document", label_visibility="collapsed")
+            if more_file is not None:
+                submit_upload(more_file)
+            # Polling (and importing the indexing stack) only while this session has jobs
+            if st.session_state.indexing_jobs:
+                show_indexing_jobs()
+        last_trace = tracing.get_trace(st.session_state.last_trace_id)
+        if last_trace:
+            with st.expander("⏱️ Last Query Timing", expanded=False):
+                for span in sorted(last_trace, key=lambda s: s["start_time"]):
+                    attrs = span["attrs"]
+                    detail = ""
+                    if "prompt_tokens" in attrs:
+                        detail = f" · {attrs['prompt_tokens']}+{attrs['completion_tokens']} tokens"
+                    label = f"{span['name']} ({attrs['kind']})" if "kind" in attrs else span["name"]
+                    st.caption(f"{label}: {span['duration_ms']:.0f} ms{detail}")
+                # Shared with every other session on this server
+                for name, stats in rate_governor.governor_stats().items():
+                    depth, waits = stats["queue_depth"], stats["waits"]["interactive"]
+                    st.caption(
+                        f"{name} queue: {depth['interactive']} interactive / {depth['bulk']} bulk"
+                        f" · wait p95 {waits['p95_ms']:.0f} ms"
+                    )
+                from retriever import index_pool_stats
+
+                pool_stats = index_pool_stats()
+                st.caption(
+                    f"indexes loaded: {pool_stats['loaded']} · {pool_stats['memory_mb']:.0f}"
+                    f" of {pool_stats['max_mb']:.0f} MB · {pool_stats['evictions']} evicted"
+                )
     else:
         st.warning("⏸️ Analysis Engine: Idle")
         st.caption("Please upload a document to begin.")
@@ -458,10 +565,12 @@ with st.sidebar:
     st.markdown("### 🛠️ Actions")
     cols = st.columns(2)
     if cols[0].button("🔄 Reset", use_container_width=True):
+        cancel_consultations()
         st.session_state.chat_history = []
         st.session_state.pdf_processed = False
         st.session_state.doc_meta = {}
         st.session_state.last_answer = ""
+        st.session_state.last_trace_id = None
         st.rerun()
     
     if cols[1].button("📥 Export", use_container_width=True):
@@ -482,7 +591,7 @@ st.markdown("Use AI-powered RAG to review contracts, extract clauses, and summar
 # Tips section
 with st.expander("💡 Tips & Best Practices", expanded=False):
     st.markdown("""
-    - **Upload a single PDF** containing your legal document
+    - **Add more documents** to the case file from the sidebar; you can keep asking questions while they are indexed
     - **Use Quick Actions** for common analysis tasks
     - **Ask specific questions** for better results
     - **Download answers** for record-keeping and reports
@@ -494,53 +603,15 @@ if not st.session_state.pdf_processed:
     st.markdown("### Upload Source Document")
     st.markdown("""
     <div class="info-card">
-        <p><strong>Instructions:</strong> Upload a PDF legal document (contract, case file, or regulation). The system will index the content for semantic search.</p>
+        <p><strong>Instructions:</strong> Upload a PDF legal document (contract, case file, or regulation). The system will index the content for semantic search and add it to the case file.</p>
     </div>
     """, unsafe_allow_html=True)
     
     uploaded_file = st.file_uploader("Select PDF File", type=["pdf"], label_visibility="collapsed")
-
     if uploaded_file is not None:
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            tmp_file.write(uploaded_file.read())
-            tmp_pdf_path = tmp_file.name
-        
-        # Extract PDF metadata
-        try:
-            doc = fitz.open(tmp_pdf_path)
-            pages = doc.page_count
-            size_kb = round(os.path.getsize(tmp_pdf_path) / 1024, 1)
-            st.session_state.doc_meta = {
-                "name": getattr(uploaded_file, "name", "document.pdf"),
-                "pages": pages,
-                "size": f"{size_kb} KB",
-                "indexed_time": datetime.now().strftime("%Y-%m-%d %H:%M")
-            }
-            doc.close()
-        except Exception:
-            st.session_state.doc_meta = {"name": "document.pdf"}
-        
-        status_text.text("📖 Parsing document structure...")
-        for i in range(30):
-            time.sleep(0.01)
-            progress_bar.progress(i + 10)
-            
-        status_text.text("🔍 Building semantic index...")
-        build_index_from_pdf(tmp_pdf_path, persist_dir="rag_faiss_store")
-        
-        for i in range(30, 100):
-            time.sleep(0.01)
-            progress_bar.progress(i + 1)
-            
-        status_text.success("✅ Indexing complete!")
-        time.sleep(0.5)
-        status_text.empty()
-        progress_bar.empty()
-        st.session_state.pdf_processed = True
-        st.rerun()
+        submit_upload(uploaded_file)
+    if st.session_state.indexing_jobs:
+        show_indexing_jobs()
 
 # Step 2: Chat Interface
 else:
@@ -587,6 +658,7 @@ else:
 
     # Handle clear button
     if clear_button:
+        cancel_consultations()
         st.session_state.chat_history = []
         st.session_state.last_answer = ""
         st.success("Chat cleared successfully!")
@@ -601,17 +673,67 @@ else:
         del st.session_state.temp_prompt
 
     if active_prompt:
+        from consultation_service import get_consultation_service
+        from legal_agent import AgentPool, make_llm_config, visible_text
+
+        if "agent_pool" not in st.session_state:
+            # Agents are built on the session's first query and reused for the rest
+            st.session_state.agent_pool = AgentPool(make_llm_config(stream=STREAM_ANSWERS), asynchronous=True)
         st.session_state.chat_history.append({"role": "user", "content": active_prompt})
         
-        with st.spinner("🔍 Analyzing legal corpus..."):
-            # Use retry wrapper to handle 429s gracefully
-            answer, _ = run_agent_with_retry(active_prompt)
-            
-            if answer.startswith("Rate limit reached"):
-                st.warning(answer)
+        with tracing.span("query", chars=len(active_prompt)) as query_span:
+            # The answer is computed on the service's event loop; this script only displays it.
+            # Repeated questions (e.g. Quick Actions) come from the answer cache and 429s are
+            # retried with backoff there.
+            # The consultation, and the tool calls it makes, search this session's matter
+            with use_matter(st.session_state.matter_id):
+                consultation = get_consultation_service().submit(
+                    active_prompt, pool=st.session_state.agent_pool, session_id=st.session_state.session_id
+                )
+            try:
+                if STREAM_ANSWERS:
+                    # Show the conversation so far and fill the answer bubble as tokens arrive
+                    with chat_container:
+                        for msg in st.session_state.chat_history:
+                            st.markdown(render_message(msg), unsafe_allow_html=True)
+                        status_line = st.empty()
+                        answer_bubble = st.empty()
+                    status_line.caption("🔍 Analyzing legal corpus...")
+                    draft = ""
+                    for kind, payload in consultation.events():
+                        if kind == "status":
+                            # Text streamed before a tool call belongs to an intermediate turn
+                            draft = ""
+                            answer_bubble.empty()
+                            status_line.caption(payload)
+                        elif kind == "token":
+                            draft += payload
+                            status_line.empty()
+                            answer_bubble.markdown(
+                                render_message({"role": "assistant", "content": visible_text(draft) + " ▌"}),
+                                unsafe_allow_html=True,
+                            )
+                        else:
+                            answer, cached = payload["answer"], payload["cached"]
+                    status_line.empty()
+                else:
+                    with st.spinner("🔍 Analyzing legal corpus..."):
+                        for kind, payload in consultation.events():
+                            if kind == "answer":
+                                answer, cached = payload["answer"], payload["cached"]
+            finally:
+                # Streamlit stops this script when the user navigates or clicks elsewhere;
+                # don't keep spending tokens on an answer nobody will see
+                if not consultation.done():
+                    consultation.cancel()
+            query_span.set(cached=cached)
+        st.session_state.last_trace_id = query_span.trace_id
+
+        if answer.startswith("Rate limit reached"):
+            st.warning(answer)
         
         st.session_state.last_answer = answer
-        st.session_state.chat_history.append({"role": "assistant", "content": answer})
+        st.session_state.chat_history.append({"role": "assistant", "content": answer, "cached": cached})
         st.rerun()
 
     # Display History
@@ -620,21 +742,19 @@ else:
             st.info("Session started. Please select a quick action or type a specific query.")
         
         for msg in st.session_state.chat_history:
-            if msg["role"] == "user":
-                st.markdown(f"""
-                <div style="display: flex; justify-content: flex-end; margin-bottom: 10px;">
-                    <div class="user-msg">
-                        {msg['content']}
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                st.markdown(f"""
-                <div style="display: flex; justify-content: flex-start; margin-bottom: 10px;">
-                    <div class="bot-msg">
-                        <strong style="color: #0f172a;">LexAI Assistant</strong><br>
-                        {msg['content']}
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
+            st.markdown(render_message(msg), unsafe_allow_html=True)
+
+
+# --- BACKGROUND WARM-UP ---
+@st.cache_resource
+def warm_up_imports():
+    """Import the heavy modules once per server process, after the first page has been sent."""
+    def run():
+        for module in ("index_manager", "indexing_jobs", "retriever", "legal_agent", "consultation_service"):
+            importlib.import_module(module)
+
+    thread = threading.Thread(target=run, name="lexai-warm-up", daemon=True)
+    thread.start()
+    return thread
 
+warm_up_imports()
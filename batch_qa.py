@@ -0,0 +1,185 @@
+"""Answer a checklist of questions from a JSONL file against the current index.
+
+Usage:
+    python batch_qa.py checklist.jsonl answers.jsonl --concurrency 8 --questions-per-minute 60 [--matter ID]
+
+Each input line is a JSON object with a ``query`` (or ``question``) and an optional ``id``,
+or just a JSON string; ids default to the line number. Each output line holds the id,
+query, answer, the contexts the retrieval tool returned, the number of tool calls and the
+time taken, or an ``error``. Results are appended as they finish, so a run that is
+interrupted picks up where it stopped: questions already answered in the output file
+are skipped (failed ones are retried).
+
+The questions are answered concurrently on the consultation service at bulk priority, so
+the rate governor keeps serving interactive users of the same deployments first. They are
+not embedded up front: the agent searches with queries it writes itself, so vectors of the
+checklist's wording would rarely be used.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+DEFAULT_CONCURRENCY = int(os.environ.get("BATCH_QA_CONCURRENCY", "8"))
+
+
+def read_questions(path: str):
+    """Return ``[{"id", "query"}]`` from a JSONL file; blank lines are skipped."""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"query": item}
+            query = item.get("query") or item.get("question")
+            if not query:
+                raise ValueError(f"{path}:{number}: no 'query' field.")
+            questions.append({"id": str(item.get("id", number)), "query": query})
+    return questions
+
+
+def answered_ids(path: str):
+    """Ids already answered in an output file; a line cut off by an interruption is ignored."""
+    done = set()
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "error" not in record:
+                    done.add(str(record["id"]))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def tool_contexts(history):
+    """The texts the retrieval tool returned during a consultation, in order."""
+    contexts = []
+    for message in history:
+        for response in message.get("tool_responses") or ():
+            contexts.append(response.get("content"))
+    return contexts
+
+
+def run_batch(questions, output_path: str, concurrency: int = DEFAULT_CONCURRENCY,
+              questions_per_minute: int = None, use_cache: bool = True, pool=None, on_result=None):
+    """Answer ``questions`` not yet in ``output_path`` and append a JSON line for each.
+
+    At most ``concurrency`` consultations run at once and, with ``questions_per_minute``,
+    no more than that many start per minute. Returns counts for the run.
+    """
+    import rate_governor
+    from consultation_service import get_consultation_service
+    from legal_agent import get_agent_pool
+
+    done = answered_ids(output_path)
+    pending = [question for question in questions if question["id"] not in done]
+    summary = {"questions": len(questions), "skipped": len(questions) - len(pending), "answered": 0, "failed": 0}
+    if not pending:
+        return summary
+
+    start = time.perf_counter()
+    service = get_consultation_service()
+    pool = pool or get_agent_pool(stream=False, asynchronous=True)
+    # Only the batch's own pace; the deployments' quotas are enforced by the shared governors
+    pacer = rate_governor.Governor("batch_qa", 10 ** 12, questions_per_minute, state_path="") \
+        if questions_per_minute else None
+
+    # A run after an interruption may end in a partial line; start on a fresh one
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            newline = f.read(1) == b"\n"
+    else:
+        newline = True
+
+    running = {}
+    with open(output_path, "a", encoding="utf-8") as out, rate_governor.priority(rate_governor.BULK):
+        if not newline:
+            out.write("\n")
+
+        def finish(future):
+            question, started = running.pop(future)
+            record = {"id": question["id"], "query": question["query"]}
+            try:
+                result = future.result()
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+                summary["failed"] += 1
+            else:
+                history = result["history"]
+                record.update({
+                    "answer": result["answer"],
+                    "contexts": tool_contexts(history),
+                    "tool_calls": sum(len(message.get("tool_calls") or ()) for message in history),
+                    "cached": result["cached"],
+                })
+                summary["answered"] += 1
+            record["seconds"] = round(time.perf_counter() - started, 3)
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if on_result is not None:
+                on_result(record)
+
+        try:
+            for question in pending:
+                while len(running) >= concurrency:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        finish(future)
+                if pacer is not None:
+                    pacer.acquire(0)
+                consultation = service.submit(question["query"], pool, use_cache=use_cache)
+                running[consultation.future] = (question, time.perf_counter())
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    finish(future)
+        finally:
+            # Interrupted: whatever is still running is answered again on the next run
+            for future in running:
+                future.cancel()
+
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer a JSONL checklist of questions against the current index.")
+    parser.add_argument("input", help="JSONL file of questions")
+    parser.add_argument("output", help="JSONL file answers are appended to; existing answers are skipped")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="consultations run at once")
+    parser.add_argument("--questions-per-minute", type=int, default=None, help="cap on questions started per minute")
+    parser.add_argument("--no-cache", action="store_true", help="don't answer from or write to the answer cache")
+    parser.add_argument("--matter", help="answer from this matter's index instead of the default store")
+    args = parser.parse_args(argv)
+    from matters import use_matter
+
+    questions = read_questions(args.input)
+
+    def report(record):
+        status = "error: " + record["error"] if "error" in record else f"{record['seconds']:.1f}s"
+        print(f"[{record['id']}] {status}", file=sys.stderr, flush=True)
+
+    try:
+        with use_matter(args.matter):
+            summary = run_batch(
+                questions, args.output, concurrency=max(1, args.concurrency),
+                questions_per_minute=args.questions_per_minute, use_cache=not args.no_cache, on_result=report,
+            )
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume.", file=sys.stderr)
+        return 130
+    print(json.dumps(summary))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Compare the fixed-size splitter with the clause-aware legal chunker.
+
+For each chunker the synthetic contract is chunked and indexed, then measured on:
+
+- chunking time, chunk count and size in tokens;
+- ``clauses_intact``: share of the contract's clauses that end up whole in a single chunk;
+- retrieval hit rate of hybrid search at k, and of the context the tool hands the agent;
+- the agent loop against the mock LLM with ``--max-requeries``: the mock searches again
+  while the retrieved context lacks the clause it was asked about, so tool calls and
+  prompt tokens per answer show how often a fragment forced another search.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_chunker --pages 100 --queries 100 --agent-queries 30
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+
+def _normalize(text):
+    # PDF lines are wrapped differently by each chunker; compare the words only
+    return " ".join(text.split()).lower()
+
+
+def measure_chunker(chunker, pdf_path, clauses, queries, k, agent_queries, llm_config):
+    import tracing
+    from benchmarks.fakes import MockChatClient
+    from config import DEFAULT_PERSIST_DIR
+    from context_builder import CONTEXT_CANDIDATES, build_context
+    from embedding_pipeline import count_tokens
+    from legal_agent import AgentPool, run_agent
+    from rag_index_builder import build_vector_store, save_vector_store, split_pdf
+    from retriever import get_retriever
+
+    start = time.perf_counter()
+    documents = split_pdf(pdf_path, chunker=chunker)
+    chunk_seconds = time.perf_counter() - start
+    for document in documents:
+        document.metadata["source"] = os.path.basename(pdf_path)
+
+    chunk_texts = [_normalize(document.page_content) for document in documents]
+    intact = sum(any(_normalize(clause["text"]) in text for text in chunk_texts) for clause in clauses)
+    tokens = [count_tokens(document.page_content) for document in documents]
+
+    # The agent's tool searches the default store, so each chunker's index is written there in turn
+    db, stats = build_vector_store(documents, use_cache=False)
+    save_vector_store(db, DEFAULT_PERSIST_DIR, stats["index_params"])
+    retriever = get_retriever()
+    retriever.refresh()
+
+    search_hits = context_hits = 0
+    for item in queries:
+        expected = _normalize(item["expected"])
+        docs = retriever.search(item["query"], k=k)
+        search_hits += any(expected in _normalize(doc.page_content) for doc in docs)
+        context = build_context(retriever.search(item["query"], k=CONTEXT_CANDIDATES))
+        context_hits += expected in _normalize(context.text)
+
+    pool = AgentPool(llm_config, model_client_cls=MockChatClient)
+    before = tracing.counters()
+    tool_calls = []
+    for item in queries[:agent_queries]:
+        # Keep the tool's console output out of the JSON report
+        with redirect_stdout(io.StringIO()):
+            _, history = run_agent(item["query"], pool=pool)
+        tool_calls.append(sum(len(message.get("tool_calls") or []) for message in history))
+    after = tracing.counters()
+    answers = max(1, len(tool_calls))
+
+    return {
+        "chunk_seconds": chunk_seconds,
+        "chunks": len(documents),
+        "mean_tokens": statistics.fmean(tokens),
+        "max_tokens": max(tokens),
+        "clauses_intact": intact / len(clauses),
+        f"hit_rate_at_{k}": search_hits / len(queries),
+        "context_hit_rate": context_hits / len(queries),
+        "tool_calls_per_answer": statistics.fmean(tool_calls) if tool_calls else 0.0,
+        "prompt_tokens_per_answer": (after.get("llm.prompt_tokens", 0) - before.get("llm.prompt_tokens", 0)) / answers,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fixed-size vs clause-aware chunking.")
+    parser.add_argument("--pages", type=int, default=100, help="pages in the synthetic PDF")
+    parser.add_argument("--queries", type=int, default=100, help="labelled queries to run")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--agent-queries", type=int, default=30)
+    parser.add_argument("--max-requeries", type=int, default=2, help="extra searches the mock LLM may make")
+    parser.add_argument("--mock-llm-latency", type=float, default=0.0, help="seconds per mock chat call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="lexai_chunker_")
+    # Configure the project for offline use before any of its modules are imported
+    os.environ.update({
+        "EMBEDDINGS_BACKEND": "hash",
+        "EMBEDDING_TPM": str(10 ** 12),
+        "EMBEDDING_RPM": str(10 ** 9),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite"),
+        "RAG_PERSIST_DIR": os.path.join(workdir, "rag_faiss_store"),
+    })
+
+    from benchmarks.fakes import mock_llm_config
+    from benchmarks.synthetic_pdf import generate_legal_pdf, labelled_queries
+
+    pdf_path = os.path.join(workdir, "synthetic.pdf")
+    clauses = generate_legal_pdf(pdf_path, pages=args.pages, seed=args.seed)
+    queries = labelled_queries(clauses, count=args.queries, seed=args.seed)
+    llm_config = mock_llm_config(latency=args.mock_llm_latency, max_requeries=args.max_requeries)
+
+    report = {"args": vars(args), "clauses": len(clauses)}
+    for chunker in ("recursive", "legal"):
+        report[chunker] = measure_chunker(
+            chunker, pdf_path, clauses, queries, args.k, args.agent_queries, llm_config
+        )
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
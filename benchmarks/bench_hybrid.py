@@ -0,0 +1,61 @@
+"""Compare vector, BM25 and hybrid retrieval hit rates and latency on a labelled query set.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_hybrid --queries queries.jsonl [--persist-dir rag_faiss_store] [--k 3]
+
+Each line of the queries file is ``{"query": "...", "expected": "..."}``; a query counts as a
+hit when any retrieved chunk contains the expected text (case-insensitive). ``expected`` may
+also be a list, in which case any of the strings counts.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from retriever import LegalRetriever
+
+
+def _is_hit(docs, expected):
+    expected = [expected] if isinstance(expected, str) else expected
+    return any(e.lower() in doc.page_content.lower() for doc in docs for e in expected)
+
+
+def run(retriever, queries, k):
+    modes = {
+        "vector": lambda q: retriever.similarity_search(q, k=k),
+        "bm25": lambda q: retriever.lexical_search(q, k=k),
+        "hybrid": lambda q: retriever.hybrid_search(q, k=k),
+    }
+    retriever.get_stores()  # load the index before timing anything
+    results = {}
+    for mode, search in modes.items():
+        hits, latencies = 0, []
+        for item in queries:
+            start = time.perf_counter()
+            docs = search(item["query"])
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += _is_hit(docs, item["expected"])
+        latencies.sort()
+        results[mode] = {
+            "hit_rate": hits / len(queries),
+            "latency_ms_p50": statistics.median(latencies),
+            "latency_ms_p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", required=True, help="JSONL file of {query, expected}")
+    parser.add_argument("--persist-dir", default="rag_faiss_store")
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with open(args.queries, encoding="utf-8") as f:
+        queries = [json.loads(line) for line in f if line.strip()]
+    results = run(LegalRetriever(args.persist_dir), queries, args.k)
+    print(json.dumps({"k": args.k, "queries": len(queries), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
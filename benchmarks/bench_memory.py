@@ -0,0 +1,212 @@
+"""Memory per million chunks, and recall, of each vector codec and chunk store.
+
+A corpus of ``--chunks`` synthetic clauses is embedded once, then saved as:
+
+- ``before``: float32 vectors with LangChain's pickled docstore (the format stores had
+  before chunk_store.py), read fully into memory;
+- one store per codec (float32, float16, int8, pq) with chunk texts in the SQLite chunk
+  store and the index memory-mapped (``--no-mmap`` reads it instead).
+
+Each store is loaded in a fresh process that then runs the queries and reads every hit's
+chunk, so the numbers cover a serving worker. ``private_mb`` is the growth of anonymous
+memory (what each worker pays on its own); ``mapped_mb`` is file pages the searches
+touched, which the page cache shares between workers and can drop under pressure. Both
+are extrapolated to a million chunks. ``recall_at_k`` is the share of the exact float32
+top-k found by the codec's top-k.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_memory --chunks 100000 --dim 1536 --queries 200
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+CODECS = ("float32", "float16", "int8", "pq")
+
+
+def _rss_mb():
+    # Linux only: anonymous and file-backed resident memory of this process
+    values = {}
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("RssAnon", "RssFile"):
+                values[key] = int(value.split()[0]) / 1024
+    return values.get("RssAnon", 0.0), values.get("RssFile", 0.0)
+
+
+def _load_pickled(persist_dir):
+    # The benchmark's own baseline store, so unpickling it is safe
+    from langchain_community.vectorstores import FAISS
+
+    from config import get_embeddings
+
+    return FAISS.load_local(persist_dir, get_embeddings(), allow_dangerous_deserialization=True), None
+
+
+def probe(persist_dir, queries_path, k, mmap, pickled=False):
+    """Load a store and serve the queries in this process; print memory and timing as JSON."""
+    import numpy as np
+
+    from rag_index_builder import load_vector_store
+
+    queries = np.load(queries_path)
+    anon_before, file_before = _rss_mb()
+    start = time.perf_counter()
+    db, _ = _load_pickled(persist_dir) if pickled else load_vector_store(persist_dir, mmap=mmap)
+    load_seconds = time.perf_counter() - start
+    anon_loaded, _ = _rss_mb()
+
+    start = time.perf_counter()
+    _, positions = db.index.search(queries, k)
+    for position in positions.ravel():
+        if position >= 0:
+            db.docstore.search(db.index_to_docstore_id[int(position)])
+    search_seconds = time.perf_counter() - start
+    anon_after, file_after = _rss_mb()
+    print(json.dumps({
+        "load_seconds": load_seconds,
+        "load_private_mb": anon_loaded - anon_before,
+        "search_seconds": search_seconds,
+        "private_mb": anon_after - anon_before,
+        "mapped_mb": file_after - file_before,
+    }))
+
+
+def measure(persist_dir, queries_path, k, mmap, chunks, pickled=False):
+    env = dict(os.environ, PYTHONWARNINGS="ignore")
+    command = [sys.executable, "-m", "benchmarks.bench_memory", "--probe", persist_dir,
+               "--probe-queries", queries_path, "--k", str(k)]
+    command += ([] if mmap else ["--no-mmap"]) + (["--probe-pickled"] if pickled else [])
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(command, cwd=root, env=env, check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    sizes = {name: os.path.getsize(os.path.join(persist_dir, name)) for name in os.listdir(persist_dir)}
+    chunk_bytes = sizes.get("chunks.sqlite", sizes.get("index.pkl", 0))
+    scale = 10 ** 6 / chunks
+    result.update({
+        "index_bytes_per_chunk": sizes["index.faiss"] / chunks,
+        "chunk_store_bytes_per_chunk": chunk_bytes / chunks,
+        "private_mb_per_million": result["private_mb"] * scale,
+        "mapped_mb_per_million": result["mapped_mb"] * scale,
+        "disk_mb_per_million": sum(sizes.values()) / 2 ** 20 * scale,
+    })
+    return result
+
+
+def recall(index, queries, truth, k):
+    _, positions = index.search(queries, k)
+    found = sum(len(set(row) & set(expected)) for row, expected in zip(positions.tolist(), truth.tolist()))
+    return found / truth.size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory per million chunks and recall of each vector codec.")
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1536, help="hash embedding dimension")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--index-type", default="flat", help="flat, ivf_flat or hnsw")
+    parser.add_argument("--pq-m", type=int, default=64, help="PQ sub-quantizers (bytes per vector)")
+    parser.add_argument("--no-mmap", action="store_true", help="read the quantized indexes instead of mapping them")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    parser.add_argument("--probe-queries", help=argparse.SUPPRESS)
+    parser.add_argument("--probe-pickled", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.probe:
+        probe(args.probe, args.probe_queries, args.k, not args.no_mmap, args.probe_pickled)
+        return 0
+
+    workdir = tempfile.mkdtemp(prefix="lexai_memory_")
+    # Configure the project for offline use before any of its modules are imported;
+    # the probe processes inherit the same settings
+    os.environ.update({
+        "EMBEDDINGS_BACKEND": "hash",
+        "HASH_EMBEDDING_DIM": str(args.dim),
+        "EMBEDDING_TPM": str(10 ** 12),
+        "EMBEDDING_RPM": str(10 ** 9),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite"),
+    })
+
+    import faiss
+    import numpy as np
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+
+    from ann_index import build_faiss_index
+    from benchmarks.synthetic_pdf import labelled_queries, synthetic_clauses
+    from config import get_embeddings
+    from rag_index_builder import save_vector_store
+
+    clauses = synthetic_clauses(args.chunks, seed=args.seed)
+    documents = [
+        Document(
+            page_content=f"ARTICLE - {clause['article'].upper()}\n{clause['number']} {clause['text']}",
+            metadata={"source": "synthetic.pdf", "section_path": [clause["article"], clause["number"]],
+                      "page_start": n // 4 + 1, "page_end": n // 4 + 1, "chunk_id": f"synthetic:{n}"},
+        )
+        for n, clause in enumerate(clauses)
+    ]
+    ids = [document.metadata["chunk_id"] for document in documents]
+    embeddings = get_embeddings()
+    vectors = np.asarray(embeddings.embed_documents([document.page_content for document in documents]), dtype="float32")
+    queries = np.asarray(
+        embeddings.embed_documents([item["query"] for item in labelled_queries(clauses, args.queries, args.seed)]),
+        dtype="float32",
+    )
+    queries_path = os.path.join(workdir, "queries.npy")
+    np.save(queries_path, queries)
+
+    exact = faiss.IndexFlatL2(args.dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    def save(name, codec, pickled=False):
+        index, params = build_faiss_index(vectors, args.index_type, codec=codec, pq_m=args.pq_m)
+        db = FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=InMemoryDocstore(dict(zip(ids, documents))),
+            index_to_docstore_id=dict(enumerate(ids)),
+        )
+        persist_dir = os.path.join(workdir, name)
+        if pickled:
+            db.save_local(persist_dir)
+        else:
+            save_vector_store(db, persist_dir, params)
+        return index, params, persist_dir
+
+    report = {"args": vars(args), "stores": {}}
+    index, params, persist_dir = save("before", "float32", pickled=True)
+    report["stores"]["before"] = {
+        "codec": params["codec"], "chunk_store": "pickle", "mmap": False,
+        "recall_at_k": recall(index, queries, truth, args.k),
+        **measure(persist_dir, queries_path, args.k, False, args.chunks, pickled=True),
+    }
+    for codec in CODECS:
+        index, params, persist_dir = save(codec, codec)
+        report["stores"][codec] = {
+            "codec": params["codec"], "index_type": params["index_type"], "chunk_store": "sqlite",
+            "mmap": not args.no_mmap,
+            "recall_at_k": recall(index, queries, truth, args.k),
+            **measure(persist_dir, queries_path, args.k, not args.no_mmap, args.chunks),
+        }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
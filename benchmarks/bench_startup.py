@@ -0,0 +1,114 @@
+"""Cold-start benchmark for the Streamlit app and the CLI entry points.
+
+Each measurement runs in a fresh interpreter:
+
+- ``app_first_render``: executing app.py once under Streamlit's AppTest harness, i.e. what a
+  new session waits for before the upload page is painted;
+- ``cli_help``: ``python main_chat.py --help``;
+- ``import <module>``: wall time of importing the module, plus its heaviest imports
+  according to ``python -X importtime``.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_startup --first-render-budget 1.5 --cli-budget 0.5
+
+Prints a JSON report and exits with status 1 if a budget is exceeded.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_RENDER_SNIPPET = """
+import time
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("app.py", default_timeout=120)
+start = time.perf_counter()
+app.run()
+elapsed = time.perf_counter() - start
+if app.exception:
+    raise SystemExit(f"app.py raised: {app.exception[0].message}")
+print(elapsed)
+"""
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def _run(args, env):
+    return subprocess.run([sys.executable, *args], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+def first_render_seconds(env):
+    return float(_run(["-c", FIRST_RENDER_SNIPPET], env).stdout.strip().splitlines()[-1])
+
+
+def cli_help_seconds(env):
+    start = time.perf_counter()
+    _run(["main_chat.py", "--help"], env)
+    return time.perf_counter() - start
+
+
+def import_profile(module, env, top=8):
+    """Wall time of ``import module`` and its heaviest direct and transitive imports."""
+    start = time.perf_counter()
+    result = _run(["-X", "importtime", "-c", f"import {module}"], env)
+    seconds = time.perf_counter() - start
+    packages = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            cumulative_us, name = int(match.group(2)), match.group(4)
+            root = name.split(".")[0]
+            # The outermost entry of a package carries the cumulative time of everything under it
+            packages[root] = max(packages.get(root, 0), cumulative_us)
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return seconds, {name: round(us / 1e6, 3) for name, us in heaviest[:top] if name != module}
+
+
+def median_of(measure, repeat):
+    return statistics.median(measure() for _ in range(repeat))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for app.py and the CLI entry points.")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (the median is reported)")
+    parser.add_argument("--first-render-budget", type=float, default=1.5, help="seconds")
+    parser.add_argument("--cli-budget", type=float, default=0.5, help="seconds for main_chat.py --help")
+    parser.add_argument("--modules", nargs="*", default=["tools", "legal_agent", "index_manager"])
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args(argv)
+
+    # No index and no credentials are needed to render the upload page
+    env = dict(os.environ, EMBEDDINGS_BACKEND="hash", RAG_PERSIST_DIR=os.path.join(tempfile.mkdtemp(), "store"))
+
+    report = {
+        "app_first_render_s": median_of(lambda: first_render_seconds(env), args.repeat),
+        "cli_help_s": median_of(lambda: cli_help_seconds(env), args.repeat),
+        "imports": {},
+    }
+    for module in args.modules:
+        runs = [import_profile(module, env) for _ in range(args.repeat)]
+        report["imports"][module] = {
+            "seconds": statistics.median(seconds for seconds, _ in runs),
+            "heaviest": runs[-1][1],
+        }
+
+    report["budgets"] = {"app_first_render_s": args.first_render_budget, "cli_help_s": args.cli_budget}
+    report["over_budget"] = [name for name, budget in report["budgets"].items() if report[name] > budget]
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    return 1 if report["over_budget"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
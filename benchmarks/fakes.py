@@ -0,0 +1,150 @@
+"""Offline stand-ins for the Azure chat deployment used by the benchmarks."""
+import json
+import random
+import re
+import time
+import uuid
+from types import SimpleNamespace
+
+from autogen.events.client_events import StreamEvent
+from autogen.io.base import IOStream
+from openai.types.chat import ChatCompletion
+
+
+class MockRateLimitError(Exception):
+    """Stands in for openai.RateLimitError (a 429 from the deployment)."""
+
+    def __init__(self, message, retry_after_ms: int = 100):
+        super().__init__(message)
+        # Read by embedding_pipeline.retry_after_seconds like a real error's response headers
+        self.response = SimpleNamespace(headers={"retry-after-ms": str(retry_after_ms)})
+
+
+def mock_llm_config(
+    latency: float = 0.05,
+    tokens_per_second: float = 0.0,
+    stream: bool = False,
+    rate_limit_rate: float = 0.0,
+    max_requeries: int = 0,
+):
+    """An AutoGen ``llm_config`` that routes every chat call to ``MockChatClient``.
+
+    Agents built with it must call ``agent.register_model_client(model_client_cls=MockChatClient)``.
+    ``rate_limit_rate`` is the fraction of calls that fail with ``MockRateLimitError``;
+    ``max_requeries`` lets the mock search again when the context misses the question's quote.
+    """
+    return {
+        "config_list": [
+            {
+                "model": "mock-gpt-4o",
+                "model_client_cls": "MockChatClient",
+                "latency": latency,
+                "tokens_per_second": tokens_per_second,
+                "stream": stream,
+                "rate_limit_rate": rate_limit_rate,
+                "max_requeries": max_requeries,
+            }
+        ],
+        "temperature": 0,
+        "cache_seed": None,
+    }
+
+
+class MockChatClient:
+    """Deterministic AutoGen model client that mimics the assistant's tool-calling loop.
+
+    On a user message it calls the first available tool with the message as the query;
+    once a tool result comes back it answers with the start of the retrieved context and
+    TERMINATE (with ``max_requeries``, it first searches again for a quote it didn't find).
+    Each call sleeps ``latency`` seconds (plus ``tokens / tokens_per_second`` when set)
+    to stand in for the network and generation time of a real deployment.
+    With ``stream`` in the request, the answer is sent word by word as stream events.
+    """
+
+    def __init__(self, config, **kwargs):
+        self.model = config.get("model", "mock-gpt-4o")
+        self.latency = float(config.get("latency", 0.05))
+        self.tokens_per_second = float(config.get("tokens_per_second", 0.0))
+        self.rate_limit_rate = float(config.get("rate_limit_rate", 0.0))
+        self.max_requeries = int(config.get("max_requeries", 0))
+
+    def create(self, params):
+        if self.rate_limit_rate and random.random() < self.rate_limit_rate:
+            time.sleep(self.latency / 10)
+            raise MockRateLimitError("Error code: 429 - mock rate limit")
+        messages = params.get("messages", [])
+        tools = params.get("tools") or []
+        last = messages[-1] if messages else {}
+        prompt_tokens = sum(len(str(message.get("content") or "")) // 4 for message in messages)
+
+        quote = self._missing_quote(messages) if last.get("role") == "tool" else None
+        if (last.get("role") == "tool" and quote is None) or not tools:
+            context = str(last.get("content") or "")
+            answer = f"Based on the retrieved context: {context[:400]}\nTERMINATE"
+            message = {"role": "assistant", "content": answer}
+            completion_tokens = len(answer) // 4
+        else:
+            name = tools[0]["function"]["name"]
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": {"name": name, "arguments": json.dumps({"query": quote or str(last.get("content") or "")})},
+                }],
+            }
+            completion_tokens = 20
+
+        time.sleep(self.latency)
+        if params.get("stream") and message.get("content"):
+            # Emit the answer word by word the way AutoGen's OpenAI client streams chunks
+            iostream = IOStream.get_default()
+            for word in re.findall(r"\S+\s*", message["content"]):
+                if self.tokens_per_second:
+                    time.sleep(max(1, len(word) // 4) / self.tokens_per_second)
+                iostream.send(StreamEvent(content=word))
+        elif self.tokens_per_second:
+            time.sleep(completion_tokens / self.tokens_per_second)
+
+        return ChatCompletion.model_validate({
+            "id": f"mock-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": self.model,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def _missing_quote(self, messages):
+        """The part of the question after ':' if no tool result so far contains it and
+        requeries are left, like an agent searching again for evidence it didn't get."""
+        tool_results = [str(message.get("content") or "") for message in messages if message.get("role") == "tool"]
+        if len(tool_results) > self.max_requeries:
+            return None
+        question = next((str(message.get("content") or "") for message in messages if message.get("role") == "user"), "")
+        if ":" not in question:
+            return None
+        quote = " ".join(question.split(":", 1)[1].rstrip("?").split())
+        found = " ".join(" ".join(tool_results).split()).lower()
+        return None if not quote or quote.lower() in found else quote
+
+    def message_retrieval(self, response):
+        return [choice.message for choice in response.choices]
+
+    def cost(self, response):
+        return 0.0
+
+    @staticmethod
+    def get_usage(response):
+        return {
+            "prompt_tokens": response.usage.prompt_tokens,
+            "completion_tokens": response.usage.completion_tokens,
+            "total_tokens": response.usage.total_tokens,
+            "cost": 0.0,
+            "model": response.model,
+        }
@@ -0,0 +1,161 @@
+"""Load test: N simulated users asking questions at the same time against the mock LLM.
+
+Each user sends ``--queries-per-user`` distinct questions one after another, the way a
+Streamlit session would, through consultation_service (the asyncio pipeline used by the
+app). The answer cache is bypassed so every question runs the full tool-calling loop. With
+``--baseline`` the same load is also run with one thread per user calling the blocking
+``run_agent_with_retry``, for comparison.
+
+Usage (from the repository root):
+    python -m benchmarks.load_test --users 1 4 16 64 --mock-llm-latency 0.2 --rate-limit-rate 0.05 --baseline
+
+Prints a JSON report with throughput, latency percentiles and rate-limit retries per level,
+and the rate governor's queue and wait statistics (``--chat-rpm`` lowers the chat quota it
+paces to).
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+from benchmarks.run_benchmarks import percentiles
+
+
+def _run_users(users, queries_per_user, queries, ask):
+    """Run ``users`` concurrent sessions calling ``ask(query)``; returns latencies and wall time."""
+    latencies = [[] for _ in range(users)]
+
+    def session(user):
+        for n in range(queries_per_user):
+            query = queries[(user * queries_per_user + n) % len(queries)]["query"]
+            start = time.perf_counter()
+            ask(query)
+            latencies[user].append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        list(executor.map(session, range(users)))
+    return [ms for per_user in latencies for ms in per_user], time.perf_counter() - start
+
+
+def _level_report(users, latencies, seconds, retries_before, extra):
+    import tracing
+
+    return {
+        "users": users,
+        "answers": len(latencies),
+        "seconds": seconds,
+        "answers_per_second": len(latencies) / seconds if seconds else 0.0,
+        "rate_limit_retries": tracing.counters().get("agent.rate_limit_retries", 0) - retries_before,
+        **extra,
+        **percentiles(latencies),
+    }
+
+
+def run_async_level(users, queries_per_user, queries, llm_config, backoff):
+    import tracing
+    from benchmarks.fakes import MockChatClient
+    from consultation_service import get_consultation_service
+    from legal_agent import AgentPool
+
+    service = get_consultation_service()
+    pool = AgentPool(llm_config, model_client_cls=MockChatClient, asynchronous=True)
+
+    def ask(query):
+        service.submit(query, pool, use_cache=False, initial_delay_seconds=backoff).result()
+
+    retries_before = tracing.counters().get("agent.rate_limit_retries", 0)
+    latencies, seconds = _run_users(users, queries_per_user, queries, ask)
+    return _level_report(users, latencies, seconds, retries_before, {"agents_built": pool.created})
+
+
+def run_threaded_level(users, queries_per_user, queries, llm_config, backoff):
+    import tracing
+    from benchmarks.fakes import MockChatClient
+    from legal_agent import AgentPool, run_agent_with_retry
+
+    pool = AgentPool(llm_config, model_client_cls=MockChatClient)
+
+    def ask(query):
+        run_agent_with_retry(query, initial_delay_seconds=backoff, pool=pool)
+
+    retries_before = tracing.counters().get("agent.rate_limit_retries", 0)
+    # The blocking tool prints the retrieved documents
+    with redirect_stdout(io.StringIO()):
+        latencies, seconds = _run_users(users, queries_per_user, queries, ask)
+    return _level_report(users, latencies, seconds, retries_before, {"agents_built": pool.created})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-user load test against the mock LLM.")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16, 64], help="concurrency levels")
+    parser.add_argument("--queries-per-user", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=40, help="pages in the synthetic PDF")
+    parser.add_argument("--mock-llm-latency", type=float, default=0.2, help="seconds per mock chat call")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of mock chat calls that return 429")
+    parser.add_argument("--backoff", type=float, default=0.1, help="initial retry delay in seconds")
+    parser.add_argument("--chat-rpm", type=int, default=10 ** 6, help="chat quota the rate governor paces to")
+    parser.add_argument("--baseline", action="store_true", help="also run one blocking thread per user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="lexai_load_")
+    # Configure the project for offline use before any of its modules are imported
+    os.environ.update({
+        "EMBEDDINGS_BACKEND": "hash",
+        "EMBEDDING_TPM": str(10 ** 12),
+        "EMBEDDING_RPM": str(10 ** 9),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite"),
+        "ANSWER_CACHE_PATH": os.path.join(workdir, "answer_cache.sqlite"),
+        "RAG_PERSIST_DIR": os.path.join(workdir, "rag_faiss_store"),
+        "CONSULTATION_WORKERS": str(max(32, max(args.users) * 2)),
+        "CHAT_RPM": str(args.chat_rpm),
+        "CHAT_TPM": str(10 ** 9),
+    })
+
+    # AutoGen logs a notice for every agent built with the mock client
+    logging.getLogger("autogen.oai.client").setLevel(logging.WARNING)
+
+    import rate_governor
+    from benchmarks.fakes import mock_llm_config
+    from benchmarks.synthetic_pdf import generate_legal_pdf, labelled_queries
+    from config import DEFAULT_PERSIST_DIR
+    from index_manager import IndexManager
+    from retriever import get_retriever
+
+    pdf_path = os.path.join(workdir, "synthetic.pdf")
+    clauses = generate_legal_pdf(pdf_path, pages=args.pages, seed=args.seed)
+    IndexManager(DEFAULT_PERSIST_DIR).add_document(pdf_path, name="synthetic.pdf")
+    get_retriever().get_stores()
+    queries = labelled_queries(clauses, count=max(args.users) * args.queries_per_user, seed=args.seed)
+
+    llm_config = mock_llm_config(latency=args.mock_llm_latency, rate_limit_rate=args.rate_limit_rate)
+    report = {"args": vars(args), "async": []}
+    for users in args.users:
+        report["async"].append(run_async_level(users, args.queries_per_user, queries, llm_config, args.backoff))
+    if args.baseline:
+        report["threaded"] = [
+            run_threaded_level(users, args.queries_per_user, queries, llm_config, args.backoff)
+            for users in args.users
+        ]
+    report["threads_alive"] = threading.active_count()
+    report["rate_governor"] = rate_governor.governor_stats()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""Offline benchmark of the indexing and retrieval pipeline.
+
+Runs entirely locally: embeddings come from the deterministic hash backend
+(EMBEDDINGS_BACKEND=hash) and the agent stage uses a mock chat model, so no Azure
+credentials are needed and results are comparable between runs and releases.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks --pages 200 --queries 100 --output bench.json
+
+Reports wall time and peak RSS per stage (PDF extraction, chunking, embedding, index build,
+indexing end to end, index load), per-query latency percentiles for vector / BM25 / hybrid
+search with hit rates, context size and hit rate of the token-budgeted context builder
+against the plain top-k chunks, and, with --agent, end-to-end latency of the tool-calling loop.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timezone
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentiles(samples_ms):
+    samples = sorted(samples_ms)
+    if not samples:
+        return {}
+
+    def pick(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples),
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": samples[-1],
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name, **extra):
+        start = time.perf_counter()
+        yield extra
+        self.stages[name] = {"seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb(), **extra}
+
+
+def _is_hit(docs, expected):
+    return any(expected.lower() in doc.page_content.lower() for doc in docs)
+
+
+def run_query_benchmark(retriever, queries, k):
+    modes = {
+        "vector": lambda q: retriever.similarity_search(q, k=k),
+        "bm25": lambda q: retriever.lexical_search(q, k=k),
+        "hybrid": lambda q: retriever.hybrid_search(q, k=k),
+    }
+    results = {}
+    for mode, search in modes.items():
+        latencies, hits = [], 0
+        for item in queries:
+            start = time.perf_counter()
+            docs = search(item["query"])
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += _is_hit(docs, item["expected"])
+        results[mode] = {"hit_rate": hits / len(queries), **percentiles(latencies)}
+    return results
+
+
+def run_context_benchmark(retriever, queries, k, budget):
+    """Compare the tool's old context (top-k labelled chunks joined) with the token-budgeted builder."""
+    from context_builder import CONTEXT_CANDIDATES, Passage, build_context
+    from embedding_pipeline import count_tokens
+
+    raw_tokens, raw_hits, built_tokens, built_hits, stats = [], 0, [], 0, []
+    for item in queries:
+        expected = item["expected"].lower()
+        docs = retriever.search(item["query"], k=k)
+        raw = "\n\n".join(Passage(doc, rank).render() for rank, doc in enumerate(docs))
+        raw_tokens.append(count_tokens(raw))
+        raw_hits += expected in raw.lower()
+
+        context = build_context(retriever.search(item["query"], k=CONTEXT_CANDIDATES), token_budget=budget)
+        built_tokens.append(context.stats["tokens"])
+        built_hits += expected in context.text.lower()
+        stats.append(context.stats)
+    return {
+        f"top{k}_joined": {"hit_rate": raw_hits / len(queries), "mean_tokens": statistics.fmean(raw_tokens)},
+        "budgeted": {
+            "token_budget": budget,
+            "candidates": CONTEXT_CANDIDATES,
+            "hit_rate": built_hits / len(queries),
+            "mean_tokens": statistics.fmean(built_tokens),
+            "mean_passages": statistics.fmean(s["passages"] for s in stats),
+            "merged_per_query": statistics.fmean(s["merged"] for s in stats),
+            "duplicates_per_query": statistics.fmean(s["duplicates"] for s in stats),
+        },
+    }
+
+
+def run_agent_benchmark(queries, latency, summary_method):
+    import tracing
+    from benchmarks.fakes import MockChatClient, mock_llm_config
+    from legal_agent import AgentPool, run_agent
+
+    # Same agents and conversation as the app, with the chat deployment replaced by the mock
+    pool = AgentPool(mock_llm_config(latency=latency), model_client_cls=MockChatClient)
+
+    tokens_before = tracing.counters()
+    latencies, tool_calls = [], []
+    for item in queries:
+        start = time.perf_counter()
+        # Keep the tool's console output out of the JSON report
+        with redirect_stdout(io.StringIO()):
+            _, history = run_agent(item["query"], pool=pool, summary_method=summary_method)
+        latencies.append((time.perf_counter() - start) * 1000)
+        tool_calls.append(sum(len(message.get("tool_calls") or []) for message in history))
+    tokens = tracing.counters()
+    usage = {
+        f"{name.split('.')[-1]}_per_answer": (tokens.get(name, 0) - tokens_before.get(name, 0)) / len(queries)
+        for name in ("llm.calls", "llm.prompt_tokens", "llm.completion_tokens")
+    }
+    return {
+        "mock_llm_latency_s": latency,
+        "summary_method": summary_method,
+        "agents_built": pool.created,
+        "tool_calls_per_answer": statistics.fmean(tool_calls),
+        **usage,
+        **percentiles(latencies),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline indexing and retrieval benchmark.")
+    parser.add_argument("--pages", type=int, default=100, help="pages in the synthetic PDF")
+    parser.add_argument("--queries", type=int, default=100, help="labelled queries to run")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--index-type", default="flat", help="flat, ivf_flat, hnsw or ivf_pq")
+    parser.add_argument("--dim", type=int, default=256, help="hash embedding dimension")
+    parser.add_argument("--workers", type=int, default=None, help="PDF extraction processes")
+    parser.add_argument("--context-budget", type=int, default=1000, help="token budget of the built context")
+    parser.add_argument("--agent", action="store_true", help="also run the agent loop against the mock LLM")
+    parser.add_argument("--agent-queries", type=int, default=20)
+    parser.add_argument("--mock-llm-latency", type=float, default=0.05, help="seconds per mock chat call")
+    parser.add_argument("--summary-method", default="last_msg", help="last_msg or reflection_with_llm")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="lexai_bench_")
+    # Configure the project for offline use before any of its modules are imported
+    os.environ.update({
+        "EMBEDDINGS_BACKEND": "hash",
+        "HASH_EMBEDDING_DIM": str(args.dim),
+        "EMBEDDING_TPM": str(10 ** 12),
+        "EMBEDDING_RPM": str(10 ** 9),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite"),
+        "RAG_PERSIST_DIR": os.path.join(workdir, "rag_faiss_store"),
+    })
+
+    import faiss
+    import numpy as np
+
+    from ann_index import build_faiss_index
+    from benchmarks.synthetic_pdf import generate_legal_pdf, labelled_queries
+    from config import DEFAULT_PERSIST_DIR, get_embeddings
+    from embedding_pipeline import embed_texts
+    from index_manager import IndexManager
+    from legal_chunker import chunk_lines, iter_pdf_lines
+    from rag_index_builder import CHUNKER, iter_pdf_pages, split_pages
+    from retriever import LegalRetriever
+
+    recorder = Recorder()
+    pdf_path = os.path.join(workdir, "synthetic.pdf")
+    with recorder.stage("generate_pdf", pages=args.pages):
+        clauses = generate_legal_pdf(pdf_path, pages=args.pages, seed=args.seed)
+
+    # The same chunker as split_pdf (CHUNKER), with extraction and chunking timed apart
+    with recorder.stage("extract") as info:
+        if CHUNKER == "legal":
+            pages = list(iter_pdf_lines(pdf_path, workers=args.workers))
+            info["pages"] = pages[-1][0] if pages else 0
+        else:
+            pages = list(iter_pdf_pages(pdf_path, workers=args.workers))
+            info["pages"] = len(pages)
+    with recorder.stage("chunk", chunker=CHUNKER) as info:
+        chunks = list(chunk_lines(pages) if CHUNKER == "legal" else split_pages(pages))
+        info["chunks"] = len(chunks)
+    with recorder.stage("embed") as info:
+        vectors = embed_texts([chunk.page_content for chunk in chunks], get_embeddings())
+        info["dim"] = len(vectors[0]) if vectors else 0
+    with recorder.stage("index_build") as info:
+        _, params = build_faiss_index(np.asarray(vectors, dtype="float32"), args.index_type)
+        info["index_type"] = params["index_type"]
+    del pages, chunks, vectors
+
+    with recorder.stage("index_total", note="extract + chunk + embed (cache cold) + build + write") as info:
+        entry = IndexManager(DEFAULT_PERSIST_DIR).add_document(
+            pdf_path, name="synthetic.pdf", use_cache=False, index_type=args.index_type
+        )
+        info["chunks"] = entry["stats"]["chunks"]
+
+    retriever = LegalRetriever(DEFAULT_PERSIST_DIR)
+    with recorder.stage("index_load"):
+        retriever.get_stores()
+
+    queries = labelled_queries(clauses, count=args.queries, seed=args.seed)
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "faiss": getattr(faiss, "__version__", "unknown"),
+            "args": vars(args),
+        },
+        "stages": recorder.stages,
+        "queries": run_query_benchmark(retriever, queries, args.k),
+        "context": run_context_benchmark(retriever, queries, args.k, args.context_budget),
+    }
+    if args.agent:
+        report["agent"] = run_agent_benchmark(queries[:args.agent_queries], args.mock_llm_latency, args.summary_method)
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Generate synthetic legal PDFs with PyMuPDF for offline benchmarks."""
+import random
+import textwrap
+
+import fitz
+
+ARTICLE_TOPICS = [
+    "Definitions", "Term", "Rent and Payment", "Security Deposit", "Use of Premises", "Maintenance",
+    "Pets", "Insurance", "Indemnification", "Confidentiality", "Termination", "Default and Remedies",
+    "Assignment", "Notices", "Governing Law", "Dispute Resolution", "Force Majeure", "Miscellaneous",
+]
+PARTIES = ["Northwind Properties LLC", "Contoso Holdings Inc.", "Fabrikam Ltd.", "Adventure Works LLP"]
+SUBJECTS = ["The Tenant", "The Landlord", "Each Party", "The Licensee", "The Service Provider"]
+VERBS = ["shall", "shall not", "may", "must promptly"]
+OBJECTS = [
+    "pay the monthly rent of ${amount:,} on or before the {day} day of each month",
+    "provide written notice at least {days} days before {topic_lower} takes effect",
+    "indemnify and hold harmless the other party against claims arising from {topic_lower}",
+    "keep confidential all information disclosed in connection with {topic_lower}",
+    "maintain insurance coverage of not less than ${amount:,} for {topic_lower}",
+    "terminate this Agreement upon {days} days' written notice if a material breach is not cured",
+    "obtain prior written consent before any assignment relating to {topic_lower}",
+    "comply with all applicable laws of the State of {state} regarding {topic_lower}",
+]
+STATES = ["New York", "California", "Delaware", "Texas"]
+ROMAN = ["I", "II", "III", "IV", "V", "VI", "VII", "VIII", "IX", "X", "XI", "XII", "XIII", "XIV", "XV",
+         "XVI", "XVII", "XVIII", "XIX", "XX"]
+
+PAGE_WIDTH, PAGE_HEIGHT, MARGIN = 612, 792, 54
+
+
+def _clause_text(rng, topic):
+    sentences = []
+    for _ in range(rng.randint(2, 4)):
+        template = rng.choice(OBJECTS)
+        sentences.append(
+            f"{rng.choice(SUBJECTS)} {rng.choice(VERBS)} "
+            + template.format(
+                amount=rng.randrange(500, 250000, 250),
+                day=rng.choice(["first", "fifth", "tenth", "fifteenth"]),
+                days=rng.choice([10, 14, 30, 45, 60, 90]),
+                topic_lower=topic.lower(),
+                state=rng.choice(STATES),
+            )
+            + "."
+        )
+    return " ".join(sentences)
+
+
+def generate_legal_pdf(path: str, pages: int = 10, seed: int = 0, clauses_per_article: int = 6):
+    """Write a contract-like PDF of about ``pages`` pages and return its clauses.
+
+    Articles use bold headings ("ARTICLE IV - TERMINATION") and numbered clauses ("4.2").
+    The returned list of ``{"number", "article", "text", "page"}`` dicts is used to build
+    labelled queries for hit-rate measurements.
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    page = None
+    y = PAGE_HEIGHT
+    clauses = []
+
+    def new_page():
+        nonlocal page, y
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        y = MARGIN
+
+    def write_line(text, fontname="helv", fontsize=10, gap=4):
+        nonlocal y
+        if y + fontsize > PAGE_HEIGHT - MARGIN:
+            new_page()
+        page.insert_text((MARGIN, y + fontsize), text, fontname=fontname, fontsize=fontsize)
+        y += fontsize + gap
+
+    new_page()
+    write_line("MASTER AGREEMENT", fontname="hebo", fontsize=16, gap=10)
+    party_a, party_b = rng.sample(PARTIES, 2)
+    write_line(f"This Agreement is made between {party_a} (the \"Landlord\") and {party_b} (the \"Tenant\").")
+    y += 8
+
+    article = 0
+    while doc.page_count <= pages:
+        topic = ARTICLE_TOPICS[article % len(ARTICLE_TOPICS)]
+        article += 1
+        numeral = ROMAN[(article - 1) % len(ROMAN)]
+        y += 6
+        write_line(f"ARTICLE {numeral} - {topic.upper()}", fontname="hebo", fontsize=12, gap=6)
+        for clause in range(1, clauses_per_article + 1):
+            number = f"{article}.{clause}"
+            text = _clause_text(rng, topic)
+            lines = textwrap.wrap(f"{number} {text}", width=95)
+            first_page = doc.page_count
+            for line in lines:
+                write_line(line)
+            y += 4
+            clauses.append({"number": number, "article": topic, "text": text, "page": first_page})
+            if doc.page_count > pages:
+                break
+
+    # The loop stops once it spills onto one page too many; drop that partial page
+    if doc.page_count > pages:
+        doc.delete_page(doc.page_count - 1)
+        clauses = [clause for clause in clauses if clause["page"] <= pages]
+    doc.save(path)
+    doc.close()
+    return clauses
+
+
+def labelled_queries(clauses, count: int = 50, seed: int = 0):
+    """Build ``{"query", "expected"}`` pairs: the query paraphrases part of a clause and a
+    retrieval counts as a hit when the clause's own sentence shows up in the results."""
+    rng = random.Random(seed)
+    queries = []
+    for clause in rng.sample(clauses, min(count, len(clauses))):
+        sentence = clause["text"].split(". ")[0]
+        words = sentence.split()
+        query = f"What does the agreement say about {clause['article'].lower()}: {' '.join(words[2:12])}?"
+        queries.append({"query": query, "expected": sentence[:60], "number": clause["number"]})
+    return queries
+
+
+def synthetic_clauses(count: int, seed: int = 0, clauses_per_article: int = 6):
+    """Return ``count`` clauses like ``generate_legal_pdf``'s without writing a PDF, for
+    benchmarks that need more chunks than a PDF can be generated for quickly."""
+    rng = random.Random(seed)
+    clauses = []
+    for n in range(count):
+        article, clause = divmod(n, clauses_per_article)
+        topic = ARTICLE_TOPICS[article % len(ARTICLE_TOPICS)]
+        clauses.append({"number": f"{article + 1}.{clause + 1}", "article": topic, "text": _clause_text(rng, topic)})
+    return clauses
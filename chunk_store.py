@@ -0,0 +1,98 @@
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+from pathlib import Path
+
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+CHUNKS_FILE = "chunks.sqlite"
+
+
+class ChunkStore(Docstore):
+    """Chunk texts and metadata of one saved index, read from SQLite when a search hits them.
+
+    Opening a store only opens the file, so a worker's memory doesn't grow with the corpus.
+    Rows are keyed by FAISS position and chunk ID; ``positions`` is the position -> chunk ID
+    mapping LangChain's FAISS wrapper calls ``index_to_docstore_id``. Stores are written
+    once and never modified.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # Files are only ever replaced, never changed, so SQLite can skip locking entirely
+        self._conn = sqlite3.connect(
+            f"{Path(path).absolute().as_uri()}?mode=ro&immutable=1", uri=True, check_same_thread=False
+        )
+        (last,) = self._conn.execute("SELECT MAX(position) FROM chunks").fetchone()
+        self._count = 0 if last is None else last + 1
+        self.positions = PositionMap(self)
+
+    @classmethod
+    def write(cls, path: str, ids, documents):
+        """Write ``documents`` (in FAISS position order) under ``ids`` and return the opened store."""
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute(
+                "CREATE TABLE chunks ("
+                " position INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, text TEXT NOT NULL, metadata TEXT NOT NULL)"
+            )
+            conn.executemany(
+                "INSERT INTO chunks (position, id, text, metadata) VALUES (?, ?, ?, ?)",
+                (
+                    (position, chunk_id, document.page_content, json.dumps(document.metadata))
+                    for position, (chunk_id, document) in enumerate(zip(ids, documents))
+                ),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def _one(self, sql, args):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchone()
+
+    def search(self, search: str):
+        row = self._one("SELECT text, metadata FROM chunks WHERE id = ?", (search,))
+        if row is None:
+            # Same contract as InMemoryDocstore
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def chunk_id(self, position: int):
+        row = self._one("SELECT id FROM chunks WHERE position = ?", (position,))
+        return None if row is None else row[0]
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PositionMap(Mapping):
+    """Read-only FAISS position -> chunk ID mapping backed by a ``ChunkStore``."""
+
+    def __init__(self, store: ChunkStore):
+        self._store = store
+
+    def __getitem__(self, position):
+        chunk_id = self._store.chunk_id(int(position))
+        if chunk_id is None:
+            raise KeyError(position)
+        return chunk_id
+
+    def __iter__(self):
+        return iter(range(len(self._store)))
+
+    def __len__(self):
+        return len(self._store)
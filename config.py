@@ -0,0 +1,51 @@
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Load Azure OpenAI credentials and config from environment variables
+AZURE_OPENAI_API_KEY = os.environ.get("AZURE_OPENAI_API_KEY")
+AZURE_OPENAI_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT")
+AZURE_OPENAI_API_VERSION = os.environ.get("AZURE_OPENAI_API_VERSION")
+AZURE_OPENAI_EMBEDDING_DEPLOYMENT = os.environ.get("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+AZURE_OPENAI_CHAT_DEPLOYMENT = os.environ.get("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-4o")
+
+DEFAULT_PERSIST_DIR = os.environ.get("RAG_PERSIST_DIR", "rag_faiss_store")
+
+# Stream the final answer token by token in the app (0 waits for the whole conversation)
+STREAM_ANSWERS = os.environ.get("STREAM_ANSWERS", "1").lower() not in ("0", "false", "no")
+
+# "azure" (default) or "hash" for the deterministic local stand-in used offline and in benchmarks
+EMBEDDINGS_BACKEND = os.environ.get("EMBEDDINGS_BACKEND", "azure").lower()
+HASH_EMBEDDING_DIM = int(os.environ.get("HASH_EMBEDDING_DIM", "256"))
+
+
+def embedding_model_id() -> str:
+    """Identify the embedding model, so vectors from different backends are never mixed."""
+    if EMBEDDINGS_BACKEND == "hash":
+        return f"hash-{HASH_EMBEDDING_DIM}"
+    return AZURE_OPENAI_EMBEDDING_DEPLOYMENT or ""
+
+
+@lru_cache(maxsize=1)
+def get_embeddings():
+    """Return the process-wide embeddings client (created on first use)."""
+    if EMBEDDINGS_BACKEND == "hash":
+        from local_embeddings import HashEmbeddings
+        return HashEmbeddings(HASH_EMBEDDING_DIM)
+
+    from langchain_openai import AzureOpenAIEmbeddings
+
+    import rate_governor
+
+    return AzureOpenAIEmbeddings(
+        azure_endpoint=AZURE_OPENAI_ENDPOINT,
+        api_key=AZURE_OPENAI_API_KEY,
+        api_version=AZURE_OPENAI_API_VERSION,
+        azure_deployment=AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+        # Rate-limit headers of every response keep the embeddings governor in step with Azure
+        http_client=rate_governor.http_client("embeddings"),
+        http_async_client=rate_governor.async_http_client("embeddings"),
+    )
@@ -0,0 +1,137 @@
+"""Runs consultations on a shared asyncio event loop.
+
+The Streamlit script (or the CLI) submits a query and reads events from a queue while the
+agent conversation runs on the service's loop: embedding requests are awaited, chat
+completions run in the loop's executor and rate-limit backoff awaits instead of blocking
+a thread. A consultation can be cancelled at any time, e.g. when the user navigates away
+or clears the chat.
+"""
+import asyncio
+import contextvars
+import os
+import queue
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from legal_agent import aanswer_query, get_agent_pool
+
+DEFAULT_WORKERS = int(os.environ.get("CONSULTATION_WORKERS", "32"))
+
+
+class _ContextExecutor(ThreadPoolExecutor):
+    """Runs each call in a copy of the submitter's context, so tracing spans carry over."""
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class Consultation:
+    """Handle to a submitted query: iterate ``events()`` or wait on ``result()``."""
+
+    def __init__(self, session_id=None):
+        self.session_id = session_id
+        self.queue = queue.Queue()
+        self.future = None
+
+    def events(self):
+        """Yield ``("status"|"token", text)`` events, then ``("answer", result)``.
+
+        Errors raised by the consultation are re-raised here.
+        """
+        while True:
+            kind, payload = self.queue.get()
+            if kind == "error":
+                raise payload
+            yield kind, payload
+            if kind == "answer":
+                return
+
+    def cancel(self):
+        if self.future is not None:
+            self.future.cancel()
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+class ConsultationService:
+    """An event loop in a daemon thread that runs consultations concurrently."""
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS):
+        self.loop = asyncio.new_event_loop()
+        # LLM calls and index reads run in the default executor
+        self.loop.set_default_executor(_ContextExecutor(max_workers=max_workers, thread_name_prefix="consultation"))
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="consultation-loop", daemon=True)
+        self._thread.start()
+
+    def submit(self, query, pool=None, session_id=None, **kwargs) -> Consultation:
+        """Start answering ``query``; extra keyword arguments go to ``legal_agent.aanswer_query``."""
+        consultation = Consultation(session_id)
+        pool = pool or get_agent_pool(stream=True, asynchronous=True)
+        coroutine = self._run(consultation, query, pool, kwargs)
+        # Submitted from the caller's context so the consultation joins its trace
+        consultation.future = contextvars.copy_context().run(asyncio.run_coroutine_threadsafe, coroutine, self.loop)
+        if session_id is not None:
+            with self._lock:
+                self._sessions.setdefault(session_id, set()).add(consultation)
+            consultation.future.add_done_callback(lambda _: self._forget(consultation))
+        return consultation
+
+    async def _run(self, consultation, query, pool, kwargs):
+        try:
+            result = await aanswer_query(query, pool, events=consultation.queue, **kwargs)
+        except asyncio.CancelledError:
+            consultation.queue.put(("error", CancelledError()))
+            raise
+        except Exception as e:
+            consultation.queue.put(("error", e))
+            raise
+        consultation.queue.put(("answer", result))
+        return result
+
+    def _forget(self, consultation):
+        with self._lock:
+            running = self._sessions.get(consultation.session_id)
+            if running is not None:
+                running.discard(consultation)
+                if not running:
+                    del self._sessions[consultation.session_id]
+
+    def cancel(self, session_id) -> int:
+        """Cancel every running consultation of a session; returns how many were cancelled."""
+        with self._lock:
+            running = list(self._sessions.get(session_id, ()))
+        for consultation in running:
+            consultation.cancel()
+        return len(running)
+
+
+_shared_service = None
+_shared_service_lock = threading.Lock()
+
+
+def get_consultation_service() -> ConsultationService:
+    """Return the process-wide service, starting its event loop on first use."""
+    global _shared_service
+    with _shared_service_lock:
+        if _shared_service is None:
+            _shared_service = ConsultationService()
+        return _shared_service
+
+
+def stream_answer(query, pool=None, **kwargs):
+    """Yield ``("status"|"token", text)`` events and finally ``("answer", result)``.
+
+    ``result`` is ``{"answer", "history", "cached"}``. Closing the generator early
+    cancels the consultation.
+    """
+    consultation = get_consultation_service().submit(query, pool, **kwargs)
+    try:
+        yield from consultation.events()
+    finally:
+        consultation.cancel()
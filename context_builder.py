@@ -0,0 +1,161 @@
+"""Turns retrieved chunks into the context string handed to the agent.
+
+Chunks are split with a 100-character overlap, so neighbouring hits repeat text. The
+builder takes more candidates than it needs, stitches chunks that overlap or touch in
+the same document back into one passage, drops chunks that are near-duplicates of a
+better-ranked one (e.g. the same boilerplate clause in two contracts) and packs them in
+rank order until the token budget is spent.
+"""
+import os
+import re
+from collections import namedtuple
+
+from embedding_pipeline import count_tokens
+
+# Tokens of retrieved context per tool call, and how many chunks are retrieved to fill it
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1000"))
+CONTEXT_CANDIDATES = int(os.environ.get("CONTEXT_CANDIDATES", "12"))
+# Share of word shingles (of the shorter passage) two passages have in common above which
+# the lower-ranked one is a near-duplicate
+DUPLICATE_SIMILARITY = 0.8
+# Chunks this many characters apart or closer are stitched together; the clause chunker
+# leaves the space that joined two lines or sentences between consecutive chunks
+MERGE_GAP_CHARS = 1
+SHINGLE_WORDS = 5
+
+Context = namedtuple("Context", "text stats")
+
+
+class Passage:
+    """One or more chunks of the same document that overlap or touch, with the best rank among them."""
+
+    def __init__(self, doc, rank):
+        metadata = doc.metadata
+        self.rank = rank
+        self.text = doc.page_content
+        # The clause chunker prepends the section headings ("ARTICLE VII - PETS") to the text
+        # its offsets cover; keep them apart so merging works on the body alone
+        self.header = ""
+        length = (metadata.get("char_end") or 0) - (metadata.get("char_start") or 0)
+        if 0 < length < len(self.text) and self.text[-length - 1] == "\n":
+            self.header, self.text = self.text[:-length - 1], self.text[-length:]
+        self.source = metadata.get("source")
+        self.page_start = metadata.get("page_start")
+        self.page_end = metadata.get("page_end")
+        self.char_start = metadata.get("char_start")
+        self.char_end = metadata.get("char_end")
+        self.chunks = 1
+
+    def touches(self, other) -> bool:
+        """True if the two passages overlap or are adjacent in the same section of a document."""
+        if self.source != other.source or self.header != other.header \
+                or self.char_start is None or other.char_start is None:
+            return False
+        return self.char_start <= other.char_end + MERGE_GAP_CHARS and other.char_start <= self.char_end + MERGE_GAP_CHARS
+
+    def merged(self, other):
+        """A new passage covering both, without repeating the overlapping text."""
+        first, second = (self, other) if self.char_start <= other.char_start else (other, self)
+        passage = Passage.__new__(Passage)
+        passage.__dict__.update(first.__dict__)
+        if second.char_end > first.char_end:
+            overlap = first.char_end - second.char_start
+            passage.text = first.text + ("" if overlap >= 0 else " ") + second.text[max(overlap, 0):]
+            passage.char_end = second.char_end
+            passage.page_end = second.page_end
+        passage.rank = min(self.rank, other.rank)
+        passage.chunks = self.chunks + other.chunks
+        return passage
+
+    def label(self):
+        # Label each passage with its document and pages so answers can cite them
+        parts = []
+        if self.source:
+            parts.append(self.source)
+        if self.page_start is not None:
+            first, last = self.page_start, self.page_end
+            parts.append(f"p. {first}" if first == last else f"pp. {first}-{last}")
+        return ", ".join(parts)
+
+    def render(self, text=None):
+        label = self.label()
+        text = self.text if text is None else text
+        if self.header:
+            text = f"{self.header}\n{text}"
+        return f"[{label}]\n{text}" if label else text
+
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def _is_duplicate(shingles, others, threshold):
+    # Measured against the shorter text: a short chunk inside a longer passage adds nothing
+    return any(len(shingles & other) / (min(len(shingles), len(other)) or 1) >= threshold for other in others)
+
+
+def _truncate(text, tokens):
+    """Cut ``text`` at a word boundary so it fits in about ``tokens`` tokens."""
+    words = text.split(" ")
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:middle])) <= tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low]) + " …"
+
+
+def build_context(docs, token_budget: int = CONTEXT_TOKEN_BUDGET, duplicate_similarity: float = DUPLICATE_SIMILARITY) -> Context:
+    """Pack ranked ``docs`` into at most ``token_budget`` tokens.
+
+    Chunks are taken in rank order. One that overlaps or touches a passage already packed
+    is stitched onto it and only costs its new text; one that mostly repeats a packed
+    passage is dropped; one that doesn't fit is skipped in favour of smaller,
+    lower-ranked ones. If even the best chunk is too large, it is truncated.
+    Returns the context text and counts for tracing.
+    """
+    separator_tokens = count_tokens("\n\n")
+    passages, costs, shingles = [], [], []
+    used = merged = duplicates = 0
+    for rank, doc in enumerate(docs):
+        chunk = Passage(doc, rank)
+        chunk_shingles = _shingles(chunk.text)
+        if _is_duplicate(chunk_shingles, shingles, duplicate_similarity):
+            duplicates += 1
+            continue
+
+        neighbour = next((i for i, passage in enumerate(passages) if passage.touches(chunk)), None)
+        if neighbour is not None:
+            candidate = passages[neighbour].merged(chunk)
+            cost = count_tokens(candidate.render()) + (separator_tokens if neighbour else 0)
+            if used - costs[neighbour] + cost <= token_budget:
+                used += cost - costs[neighbour]
+                passages[neighbour], costs[neighbour] = candidate, cost
+                shingles[neighbour] |= chunk_shingles
+                merged += 1
+            continue
+
+        cost = count_tokens(chunk.render()) + (separator_tokens if passages else 0)
+        if used + cost > token_budget:
+            if passages:
+                continue
+            chunk.text = _truncate(chunk.text, token_budget - count_tokens(chunk.render("")))
+            cost = count_tokens(chunk.render())
+        passages.append(chunk)
+        costs.append(cost)
+        shingles.append(chunk_shingles)
+        used += cost
+
+    stats = {
+        "candidates": len(docs),
+        "merged": merged,
+        "duplicates": duplicates,
+        "passages": len(passages),
+        "tokens": used,
+    }
+    return Context("\n\n".join(passage.render() for passage in passages), stats)
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from config import embedding_model_id
+
+DEFAULT_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "rag_embedding_cache.sqlite")
+DEFAULT_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+
+class EmbeddingCache:
+    """Persistent chunk-vector cache keyed by a hash of the embedding deployment and the chunk text.
+
+    Entries live in a small SQLite file; once the cache holds more than ``max_entries``
+    vectors, the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, deployment: str = None, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.deployment = deployment or embedding_model_id()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.deployment}\n{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts):
+        """Return a list aligned with ``texts`` holding cached vectors, or None for misses."""
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+            )
+            self._conn.commit()
+
+            vectors = [found.get(key) for key in keys]
+            hits = sum(1 for vector in vectors if vector is not None)
+            self.hits += hits
+            self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, texts, vectors):
+        now = time.time()
+        rows = [(self.key(text), array("f", vector).tobytes(), now) for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (overflow,),
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self), "max_entries": self.max_entries}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends chunks missing from the cache to the backend."""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = self.cache.get_many(texts)
+
+        # Embed each distinct missing text once, even if the document repeats it
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        self.hits += len(texts) - sum(1 for vector in vectors if vector is None)
+        self.misses += sum(1 for vector in vectors if vector is None)
+        if missing:
+            new_vectors = self.embeddings.embed_documents(missing)
+            self.cache.put_many(missing, new_vectors)
+            by_text = dict(zip(missing, new_vectors))
+            vectors = [vector if vector is not None else by_text[text] for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Return the process-wide embedding cache, opening it on first use."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = EmbeddingCache()
+        return _shared_cache
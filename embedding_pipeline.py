@@ -0,0 +1,137 @@
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from langchain_core.embeddings import Embeddings
+
+import tracing
+from rate_governor import BULK, Governor, get_governor
+
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", "4"))
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if not _encoding:
+        return max(1, len(text) // 4)
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def is_rate_limit_error(exc: Exception) -> bool:
+    msg = str(exc)
+    return "RateLimit" in type(exc).__name__ or "RateLimitReached" in msg or "429" in msg
+
+
+def retry_after_seconds(exc: Exception):
+    """Return the server's Retry-After hint from an OpenAI error, if it sent one."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    for header in ("retry-after-ms", "retry-after"):
+        value = headers.get(header)
+        if value:
+            try:
+                seconds = float(value)
+            except ValueError:
+                continue
+            return seconds / 1000.0 if header == "retry-after-ms" else seconds
+    return None
+
+
+def _embed_batch(embeddings, texts, limiter, max_retries, initial_delay, priority):
+    delay = initial_delay
+    token_count = sum(count_tokens(text) for text in texts)
+    for attempt in range(max_retries + 1):
+        limiter.acquire(token_count, priority)
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == max_retries:
+                raise
+            wait_seconds = retry_after_seconds(e) or delay
+            tracing.count("embedding.rate_limit_retries")
+            # Hold back every caller of this deployment, not just this worker; the next
+            # acquire waits out the hold, the jitter spreads the retries after it
+            limiter.back_off(wait_seconds)
+            time.sleep(random.uniform(0, 0.5))
+            delay *= 2
+
+
+def iter_embedded_batches(
+    texts,
+    embeddings: Embeddings,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+    limiter: Governor = None,
+    max_retries: int = 6,
+    initial_delay: float = 2.0,
+    priority: int = BULK,
+):
+    """Embed ``texts`` in batches on a bounded pool and yield ``(start, vectors)`` as each batch finishes.
+
+    Batches complete out of order; ``start`` is the index of the batch's first text.
+    A batch that keeps hitting 429 is retried with exponential backoff (honouring
+    Retry-After) before the error is raised. Requests are paced by the embeddings
+    governor at ``priority``, so indexing yields to interactive queries.
+    """
+    limiter = limiter or get_governor("embeddings")
+    starts = list(range(0, len(texts), batch_size))
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+        pending = {}
+        next_batch = 0
+        while next_batch < len(starts) or pending:
+            # Keep at most max_concurrency batches in flight
+            while next_batch < len(starts) and len(pending) < max_concurrency:
+                start = starts[next_batch]
+                future = pool.submit(
+                    _embed_batch, embeddings, texts[start:start + batch_size], limiter, max_retries, initial_delay, priority
+                )
+                pending[future] = start
+                next_batch += 1
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                start = pending.pop(future)
+                try:
+                    vectors = future.result()
+                except Exception:
+                    for other in pending:
+                        other.cancel()
+                    raise
+                yield start, vectors
+
+
+def embed_texts(texts, embeddings: Embeddings, on_progress=None, **kwargs):
+    """Embed ``texts`` through the batched pipeline, calling ``on_progress(done, total)`` per batch."""
+    texts = list(texts)
+    vectors = [None] * len(texts)
+    done = 0
+    for start, batch_vectors in iter_embedded_batches(texts, embeddings, **kwargs):
+        vectors[start:start + len(batch_vectors)] = batch_vectors
+        done += len(batch_vectors)
+        if on_progress is not None:
+            on_progress(done, len(texts))
+    return vectors
+
+
+class BatchedEmbeddings(Embeddings):
+    """Embeddings wrapper that sends ``embed_documents`` through the rate-limited batch pipeline."""
+
+    def __init__(self, embeddings: Embeddings, on_progress=None, **pipeline_kwargs):
+        self.embeddings = embeddings
+        self.on_progress = on_progress
+        self.pipeline_kwargs = pipeline_kwargs
+
+    def embed_documents(self, texts):
+        return embed_texts(texts, self.embeddings, on_progress=self.on_progress, **self.pipeline_kwargs)
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
@@ -0,0 +1,376 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import datetime
+
+import tracing
+from ann_index import PARAMS_FILE
+from chunk_store import CHUNKS_FILE, ChunkStore
+from config import DEFAULT_PERSIST_DIR
+from legal_facts import FACTS_FILE, FactStore, extract_facts
+from lexical_index import LEXICAL_FILE, BM25Index
+from matters import current_persist_dir
+from rag_index_builder import build_vector_store, load_vector_store, save_vector_store, split_pdf
+from summary_tree import (
+    SUMMARY_TREE,
+    build_summary_tree,
+    load_summary_tree,
+    load_summary_trees,
+    remove_summary_tree,
+    save_summary_tree,
+)
+
+MANIFEST_NAME = "manifest.json"
+SEGMENTS_DIR = "segments"
+# A legacy store is index.faiss plus its chunks in either format, optionally with the other files
+LEGACY_FILES = ("index.faiss", "index.pkl", CHUNKS_FILE, PARAMS_FILE, LEXICAL_FILE, FACTS_FILE)
+
+
+def _prefix_chunk_ids(store_dir: str, prefix: str):
+    """Rename the chunks of a saved store to ``prefix:chunk_id`` and return the new IDs.
+
+    A store from build_index_from_pdf names its chunks after the PDF, like add_document
+    does; without the prefix, indexing the same file again would reuse its chunk IDs.
+    Pickled stores (random chunk IDs) keep theirs.
+    """
+    chunks_path = os.path.join(store_dir, CHUNKS_FILE)
+    if not os.path.exists(chunks_path):
+        from migrate_store import read_pickled_docstore
+
+        _, index_to_docstore_id = read_pickled_docstore(os.path.join(store_dir, "index.pkl"))
+        return [index_to_docstore_id[position] for position in range(len(index_to_docstore_id))]
+
+    store = ChunkStore(chunks_path)
+    try:
+        old_ids = list(store.positions.values())
+        documents = [store.search(chunk_id) for chunk_id in old_ids]
+    finally:
+        store.close()
+    renamed = {chunk_id: f"{prefix}:{chunk_id}" for chunk_id in old_ids}
+    ids = [renamed[chunk_id] for chunk_id in old_ids]
+    for chunk_id, document in zip(ids, documents):
+        if "chunk_id" in document.metadata:
+            document.metadata["chunk_id"] = chunk_id
+    ChunkStore.write(chunks_path, ids, documents).close()
+    BM25Index.build(ids, [document.page_content for document in documents]).save(store_dir)
+    facts_path = os.path.join(store_dir, FACTS_FILE)
+    if os.path.exists(facts_path):
+        fact_store = FactStore(facts_path)
+        facts = [dict(row, chunk_id=renamed.get(row["chunk_id"], row["chunk_id"])) for row in fact_store.search()]
+        fact_store.close()
+    else:
+        facts = extract_facts(ids, documents, use_llm=False)
+    FactStore.write(facts_path, facts).close()
+    return ids
+
+
+def document_id_for(name: str) -> str:
+    """Derive a stable document ID from a file name, e.g. 'Lease 2024.pdf' -> 'lease_2024_pdf'."""
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_") or "document"
+
+
+def file_fingerprint(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(persist_dir: str):
+    """Return the manifest of an index directory, or None for a legacy single-store directory."""
+    try:
+        with open(os.path.join(persist_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class IndexManager:
+    """Multi-document index made of immutable FAISS segments.
+
+    ``persist_dir/manifest.json`` maps each document ID to its segment directory and chunk IDs.
+    Adding, replacing or removing a document only writes (or deletes) that document's segment
+    and rewrites the small manifest, so an update costs in proportion to the document, not
+    the corpus. The manifest is swapped atomically, so readers always see a consistent set.
+
+    ``compact`` merges all segments into one, e.g. to train an IVF/HNSW index over a large
+    corpus. Documents later removed from a shared segment are listed as tombstones in the
+    manifest and filtered out at query time until the next compaction.
+    """
+
+    def __init__(self, persist_dir: str = DEFAULT_PERSIST_DIR):
+        self.persist_dir = persist_dir
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(persist_dir, SEGMENTS_DIR), exist_ok=True)
+        with self._lock:
+            self._adopt_legacy_store()
+
+    # --- manifest helpers ---
+
+    def _manifest(self):
+        return read_manifest(self.persist_dir) or {"version": 1, "generation": 0, "documents": {}}
+
+    def _write_manifest(self, manifest):
+        path = os.path.join(self.persist_dir, MANIFEST_NAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _adopt_legacy_store(self):
+        # A store written by build_index_from_pdf becomes the first segment of the manifest
+        legacy_paths = [os.path.join(self.persist_dir, name) for name in LEGACY_FILES]
+        legacy_paths = [path for path in legacy_paths if os.path.exists(path)]
+        names = {os.path.basename(path) for path in legacy_paths}
+        if read_manifest(self.persist_dir) is not None or "index.faiss" not in names \
+                or not names & {"index.pkl", CHUNKS_FILE}:
+            return
+        segment = os.path.join(SEGMENTS_DIR, "legacy-1")
+        os.makedirs(os.path.join(self.persist_dir, segment), exist_ok=True)
+        for path in legacy_paths:
+            os.replace(path, os.path.join(self.persist_dir, segment, os.path.basename(path)))
+        # The chunk IDs are kept in the manifest to tombstone them once the segment is shared
+        chunk_ids = _prefix_chunk_ids(os.path.join(self.persist_dir, segment), "legacy")
+        # build_index_from_pdf saved the summary tree under the file's name
+        summaries = list(load_summary_trees(self.persist_dir))
+        if len(summaries) == 1:
+            tree = load_summary_tree(self.persist_dir, summaries[0])
+            for section in tree["sections"]:
+                for leaf in section["leaves"]:
+                    leaf["chunk_ids"] = [f"legacy:{chunk_id}" for chunk_id in leaf.get("chunk_ids", ())]
+            save_summary_tree(self.persist_dir, "legacy", tree)
+            remove_summary_tree(self.persist_dir, summaries[0])
+        manifest = self._manifest()
+        manifest["generation"] = 1
+        manifest["documents"]["legacy"] = {
+            "name": "legacy index",
+            "segment": segment,
+            "fingerprint": None,
+            "chunk_ids": chunk_ids,
+            "added": datetime.now().isoformat(timespec="seconds"),
+        }
+        self._write_manifest(manifest)
+
+    # --- public API ---
+
+    def list_documents(self):
+        return self._manifest()["documents"]
+
+    def has_document(self, doc_id: str) -> bool:
+        return doc_id in self.list_documents()
+
+    def add_document(self, pdf_path: str, doc_id: str = None, name: str = None, use_cache: bool = True,
+                     on_progress=None, index_type: str = None, on_stage=None, summarize: bool = None):
+        """Index a PDF as a new document and return its entry from the manifest.
+
+        ``on_progress(done, total)`` follows the embedding of uncached chunks.
+        ``on_stage(stage, done, total)`` follows every stage: "extract" (pages), "embed"
+        (chunks), "summarize" (summary tree nodes, with ``summarize``, default SUMMARY_TREE),
+        "facts" (chunks read by the LLM fact pass, with LEGAL_FACTS_LLM) and "save".
+        An exception raised by either abandons the document before its segment is written.
+        """
+        name = name or os.path.basename(pdf_path)
+        doc_id = doc_id or document_id_for(name)
+        if self.has_document(doc_id):
+            raise ValueError(f"Document '{doc_id}' is already indexed; use replace_document to update it.")
+        db, entry, tree, facts = self._build_document(
+            pdf_path, doc_id, name, use_cache, on_progress, index_type, on_stage, summarize
+        )
+        return self._commit_document(doc_id, db, entry, replace=False, on_stage=on_stage, tree=tree, facts=facts)
+
+    def replace_document(self, doc_id: str, pdf_path: str, name: str = None, use_cache: bool = True,
+                         on_progress=None, index_type: str = None, on_stage=None, summarize: bool = None):
+        """Re-index an existing document (e.g. an amended contract) in place of its old segment."""
+        current = self.list_documents().get(doc_id)
+        if current is None:
+            raise KeyError(f"Document '{doc_id}' is not indexed.")
+        if current.get("fingerprint") == file_fingerprint(pdf_path):
+            return current
+        # Only the sections that changed are summarized again
+        db, entry, tree, facts = self._build_document(
+            pdf_path, doc_id, name or current.get("name"), use_cache, on_progress, index_type, on_stage, summarize
+        )
+        return self._commit_document(doc_id, db, entry, replace=True, on_stage=on_stage, tree=tree, facts=facts)
+
+    def remove_document(self, doc_id: str):
+        with self._lock:
+            manifest = self._manifest()
+            entry = manifest["documents"].pop(doc_id, None)
+            if entry is None:
+                raise KeyError(f"Document '{doc_id}' is not indexed.")
+            unused_segment = self._release_segment(manifest, entry)
+            self._write_manifest(manifest)
+            remove_summary_tree(self.persist_dir, doc_id)
+            if unused_segment:
+                shutil.rmtree(os.path.join(self.persist_dir, unused_segment), ignore_errors=True)
+
+    def compact(self, index_type: str = None, use_cache: bool = True):
+        """Merge every segment into a single one built as ``index_type`` and drop tombstoned chunks.
+
+        Chunk vectors come back from the embedding cache, so only evicted chunks are re-embedded.
+        """
+        with self._lock:
+            manifest = self._manifest()
+            old_segments = sorted({entry["segment"] for entry in manifest["documents"].values()})
+            if not old_segments:
+                return None
+            tombstones = {segment: set(ids) for segment, ids in manifest.get("tombstones", {}).items()}
+
+            documents, ids, facts = [], [], []
+            for segment in old_segments:
+                db, _ = load_vector_store(os.path.join(self.persist_dir, segment))
+                removed = tombstones.get(segment, set())
+                # A legacy entry adopted without its chunk IDs owns the chunks no other document claims
+                unclaimed = [entry for entry in manifest["documents"].values()
+                             if entry["segment"] == segment and not entry["chunk_ids"]]
+                if len(unclaimed) == 1:
+                    claimed = removed.union(*(entry["chunk_ids"] for entry in manifest["documents"].values()
+                                              if entry["segment"] == segment))
+                    unclaimed[0]["chunk_ids"] = [
+                        db.index_to_docstore_id[position] for position in range(db.index.ntotal)
+                        if db.index_to_docstore_id[position] not in claimed
+                    ]
+                # Keep the facts already extracted (LLM ones included) rather than extracting again
+                facts_path = os.path.join(self.persist_dir, segment, FACTS_FILE)
+                if facts is not None and os.path.exists(facts_path):
+                    fact_store = FactStore(facts_path)
+                    facts.extend(fact_store.search(exclude=removed))
+                    fact_store.close()
+                else:
+                    # Segments saved before facts existed: extract everything again when saving
+                    facts = None
+                for position in range(db.index.ntotal):
+                    chunk_id = db.index_to_docstore_id[position]
+                    if chunk_id not in removed:
+                        documents.append(db.docstore.search(chunk_id))
+                        ids.append(chunk_id)
+
+            db, stats = build_vector_store(documents, ids=ids, use_cache=use_cache, index_type=index_type)
+            manifest["generation"] = manifest.get("generation", 0) + 1
+            segment = os.path.join(SEGMENTS_DIR, f"compacted-{manifest['generation']}")
+            save_vector_store(db, os.path.join(self.persist_dir, segment), stats["index_params"], facts=facts)
+
+            for entry in manifest["documents"].values():
+                entry["segment"] = segment
+            manifest["tombstones"] = {}
+            manifest["compacted"] = {"segment": segment, "stats": stats}
+            self._write_manifest(manifest)
+
+            for old_segment in old_segments:
+                shutil.rmtree(os.path.join(self.persist_dir, old_segment), ignore_errors=True)
+            return stats
+
+    def _release_segment(self, manifest, entry):
+        # Called once ``entry`` is no longer in the manifest. Returns the segment to delete, or
+        # None if other documents still share it (then the entry's chunks become tombstones).
+        segment = entry["segment"]
+        tombstones = manifest.setdefault("tombstones", {})
+        if any(other["segment"] == segment for other in manifest["documents"].values()):
+            tombstones.setdefault(segment, []).extend(entry["chunk_ids"])
+            return None
+        tombstones.pop(segment, None)
+        return segment
+
+    def _build_document(self, pdf_path, doc_id, name, use_cache, on_progress, index_type, on_stage=None,
+                        summarize=None):
+        def report(stage, done, total):
+            if on_stage is not None:
+                on_stage(stage, done, total)
+
+        def embedded(done, total):
+            if on_progress is not None:
+                on_progress(done, total)
+            report("embed", len(documents) - total + done, len(documents))
+
+        # Chunking and embedding run outside the lock so other documents can be indexed meanwhile
+        with tracing.span("index.chunk", doc_id=doc_id) as chunk_span:
+            documents = split_pdf(pdf_path, on_page=lambda done, total: report("extract", done, total))
+            chunk_span.set(chunks=len(documents))
+        chunk_ids = [f"{doc_id}:{i}" for i in range(len(documents))]
+        for chunk_id, document in zip(chunk_ids, documents):
+            document.metadata.update({"doc_id": doc_id, "source": name, "chunk_id": chunk_id})
+
+        with tracing.span("index.embed_and_build", doc_id=doc_id) as build_span:
+            # Only uncached chunks are reported as they are embedded; count the cached ones as done
+            report("embed", 0, len(documents))
+            db, stats = build_vector_store(
+                documents, ids=chunk_ids, use_cache=use_cache, on_progress=embedded, index_type=index_type
+            )
+            report("embed", len(documents), len(documents))
+            build_span.set(cache_hits=stats["cache_hits"], cache_misses=stats["cache_misses"])
+
+        tree = None
+        if SUMMARY_TREE if summarize is None else summarize:
+            with tracing.span("index.summarize", doc_id=doc_id) as summary_span:
+                tree = build_summary_tree(
+                    documents, chunk_ids, name, previous=load_summary_tree(self.persist_dir, doc_id),
+                    on_progress=lambda done, total: report("summarize", done, total),
+                )
+                summary_span.set(**tree["stats"])
+            stats["summary"] = tree["stats"]
+        with tracing.span("index.facts", doc_id=doc_id) as facts_span:
+            facts = extract_facts(
+                chunk_ids, documents, on_progress=lambda done, total: report("facts", done, total)
+            )
+            facts_span.set(facts=len(facts))
+        stats["facts"] = len(facts)
+        entry = {
+            "name": name,
+            "fingerprint": file_fingerprint(pdf_path),
+            "chunk_ids": chunk_ids,
+            "added": datetime.now().isoformat(timespec="seconds"),
+            "stats": stats,
+        }
+        return db, entry, tree, facts
+
+    def _commit_document(self, doc_id, db, entry, replace, on_stage=None, tree=None, facts=None):
+        if on_stage is not None:
+            on_stage("save", 0, 1)
+        with self._lock:
+            manifest = self._manifest()
+            previous = manifest["documents"].get(doc_id)
+            if previous is not None and not replace:
+                raise ValueError(f"Document '{doc_id}' is already indexed; use replace_document to update it.")
+
+            # Segments are never modified after they are written: a replacement gets a new directory
+            manifest["generation"] = manifest.get("generation", 0) + 1
+            entry["segment"] = os.path.join(SEGMENTS_DIR, f"{doc_id}-{manifest['generation']}")
+            with tracing.span("index.save", segment=entry["segment"]):
+                save_vector_store(
+                    db, os.path.join(self.persist_dir, entry["segment"]), entry["stats"]["index_params"], facts=facts
+                )
+            # Summaries are per document, so they survive compaction
+            if tree is not None:
+                save_summary_tree(self.persist_dir, doc_id, tree)
+
+            manifest["documents"][doc_id] = entry
+            unused_segment = self._release_segment(manifest, previous) if previous is not None else None
+            self._write_manifest(manifest)
+
+            if unused_segment:
+                shutil.rmtree(os.path.join(self.persist_dir, unused_segment), ignore_errors=True)
+        if on_stage is not None:
+            on_stage("save", 1, 1)
+        return entry
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_index_manager(persist_dir: str = None) -> IndexManager:
+    """Return the shared manager for a persist directory so its lock covers every writer.
+
+    Without ``persist_dir`` the current matter's directory is used (see matters.use_matter).
+    """
+    persist_dir = persist_dir or current_persist_dir()
+    key = os.path.abspath(persist_dir)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = IndexManager(persist_dir)
+        return manager
@@ -0,0 +1,229 @@
+"""Background indexing jobs.
+
+An upload is streamed to a temporary file and indexed on a small worker pool, so the
+Streamlit script (and every other session) stays responsive while a document builds. Each
+job records real progress per stage: "upload" (bytes written), "extract" (pages), "embed"
+(chunks), "summarize" (summary tree nodes, when enabled), "facts" (chunks read by the LLM
+fact pass, when enabled) and "save" (segment written); the UI polls ``snapshot()``. A job can be
+cancelled until its segment is being written; its temporary file is always removed.
+"""
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from index_manager import document_id_for, get_index_manager
+
+DEFAULT_WORKERS = int(os.environ.get("INDEXING_WORKERS", "2"))
+UPLOAD_DIR = os.environ.get("INDEXING_UPLOAD_DIR") or None
+UPLOAD_BLOCK_SIZE = 1 << 20
+# Finished jobs kept for the UI to report on
+MAX_FINISHED_JOBS = 100
+
+STAGES = ("upload", "extract", "embed", "summarize", "facts", "save")
+# Share of the overall progress bar each stage takes
+STAGE_WEIGHTS = {"upload": 0.05, "extract": 0.2, "embed": 0.4, "summarize": 0.2, "facts": 0.05, "save": 0.1}
+FINISHED = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class IndexingJob:
+    """One document being indexed; ``status`` is queued, running, done, failed or cancelled."""
+
+    def __init__(self, name: str, persist_dir: str, doc_id: str = None):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.doc_id = doc_id or document_id_for(name)
+        self.persist_dir = persist_dir
+        self.status = "queued"
+        self.stage = "upload"
+        self.progress = {}
+        self.entry = None
+        self.error = None
+        self.path = None
+        self.size = 0
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def report(self, stage: str, done: int, total: int):
+        """Progress callback for ``IndexManager.add_document(on_stage=...)``; raises once cancelled."""
+        # Once the segment is being written the job runs to completion
+        if self._cancelled.is_set() and stage != "save":
+            raise JobCancelled()
+        with self._lock:
+            self.stage = stage
+            self.progress[stage] = (done, total)
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.future is not None and self.future.cancel():
+            # Never started, so nothing else will clean up after it
+            self._finish("cancelled")
+
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def done(self) -> bool:
+        return self.status in FINISHED
+
+    def fraction(self) -> float:
+        """Overall progress between 0 and 1."""
+        if self.status == "done":
+            return 1.0
+        with self._lock:
+            progress = dict(self.progress)
+        total = 0.0
+        for stage in STAGES:
+            done, count = progress.get(stage, (0, 0))
+            # A document indexed without a summary tree or LLM facts skips those stages
+            skipped = stage in ("summarize", "facts") and "save" in progress and not count
+            total += STAGE_WEIGHTS[stage] * (1.0 if skipped else done / count if count else 0.0)
+        return min(total, 1.0)
+
+    def snapshot(self):
+        with self._lock:
+            progress = dict(self.progress)
+        return {
+            "id": self.id,
+            "name": self.name,
+            "doc_id": self.doc_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": progress,
+            "fraction": self.fraction(),
+            "pages": progress.get("extract", (0, None))[1],
+            "size": self.size,
+            "entry": self.entry,
+            "error": self.error,
+            "seconds": (self.finished or time.time()) - self.created,
+        }
+
+    def _finish(self, status, error=None):
+        with self._lock:
+            if self.status in FINISHED:
+                return
+            self.status = status
+            self.error = error
+            self.finished = time.time()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class IndexingQueue:
+    """A worker pool that indexes uploaded documents into their matter's index."""
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="indexing")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, upload, name: str, persist_dir: str, doc_id: str = None, use_cache: bool = True) -> IndexingJob:
+        """Stream ``upload`` (a binary file object) to disk and queue it for indexing.
+
+        A document already indexed under the same ID is replaced.
+        """
+        job = IndexingJob(name, persist_dir, doc_id)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._save_upload(job, upload)
+        except BaseException as e:
+            job._finish("failed", f"{type(e).__name__}: {e}")
+            raise
+        job.future = self._executor.submit(self._run, job, use_cache)
+        self._prune()
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, persist_dir: str = None):
+        """Known jobs, oldest first; only those of ``persist_dir`` if given."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if persist_dir is not None:
+            key = os.path.abspath(persist_dir)
+            jobs = [job for job in jobs if os.path.abspath(job.persist_dir) == key]
+        return jobs
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.done():
+            return False
+        job.cancel()
+        return True
+
+    @staticmethod
+    def _save_upload(job, upload):
+        if hasattr(upload, "seek"):
+            upload.seek(0)
+        # Streamlit's UploadedFile knows its size; other file objects report bytes so far
+        expected = getattr(upload, "size", None)
+        with tempfile.NamedTemporaryFile(delete=False, prefix="lexai_upload_", suffix=".pdf", dir=UPLOAD_DIR) as f:
+            job.path = f.name
+            while True:
+                block = upload.read(UPLOAD_BLOCK_SIZE)
+                if not block:
+                    break
+                f.write(block)
+                job.size += len(block)
+                job.report("upload", job.size, max(expected or 0, job.size))
+
+    def _run(self, job, use_cache):
+        from retriever import get_retriever
+
+        with job._lock:
+            job.status = "running"
+        try:
+            with tracing.span("index.job", doc_id=job.doc_id):
+                manager = get_index_manager(job.persist_dir)
+                if manager.has_document(job.doc_id):
+                    job.entry = manager.replace_document(
+                        job.doc_id, job.path, name=job.name, use_cache=use_cache, on_stage=job.report
+                    )
+                else:
+                    job.entry = manager.add_document(
+                        job.path, doc_id=job.doc_id, name=job.name, use_cache=use_cache, on_stage=job.report
+                    )
+                # Load the new index now so the first query doesn't pay for it
+                get_retriever(job.persist_dir).refresh()
+        except JobCancelled:
+            job._finish("cancelled")
+        except Exception as e:
+            tracing.count("indexing.jobs_failed")
+            job._finish("failed", f"{type(e).__name__}: {e}")
+        else:
+            job._finish("done")
+
+    def _prune(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.done()]
+            for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self._jobs[job_id]
+
+
+_shared_queue = None
+_shared_queue_lock = threading.Lock()
+
+
+def get_indexing_queue() -> IndexingQueue:
+    """Return the process-wide indexing queue."""
+    global _shared_queue
+    with _shared_queue_lock:
+        if _shared_queue is None:
+            _shared_queue = IndexingQueue()
+        return _shared_queue
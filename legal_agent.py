@@ -0,0 +1,414 @@
+"""The LegalAssistant / User agent pair and the ways to run a consultation.
+
+``run_agent`` / ``run_agent_with_retry`` block until the conversation ends.
+``arun_agent`` / ``aanswer_query`` are their asyncio counterparts used by
+consultation_service, which also streams status and answer tokens to the UI.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from autogen import Agent, AssistantAgent, UserProxyAgent
+from autogen.events.agent_events import ExecuteFunctionEvent
+from autogen.events.client_events import StreamEvent
+from autogen.io.base import IOStream
+
+import rate_governor
+import tracing
+from answer_cache import get_answer_cache
+from config import AZURE_OPENAI_API_KEY, AZURE_OPENAI_API_VERSION, AZURE_OPENAI_CHAT_DEPLOYMENT, AZURE_OPENAI_ENDPOINT
+from embedding_pipeline import is_rate_limit_error
+from matters import current_persist_dir
+from retriever import get_retriever
+from summary_tree import SUMMARY_TREE, has_summary_trees
+from tools import (
+    aget_document_summary,
+    alookup_legal_facts,
+    aretrieve_legal_context,
+    aretrieve_legal_context_batch,
+    aretrieve_legal_contexts,
+    retrieve_legal_context,
+    retrieve_legal_context_batch,
+    get_document_summary,
+    lookup_legal_facts,
+    retrieve_legal_contexts,
+)
+
+# "last_msg" (default) or "reflection_with_llm"; the answer is always read from the chat
+# history, so a reflection summary only costs an extra LLM call
+SUMMARY_METHOD = os.environ.get("AGENT_SUMMARY_METHOD", "last_msg")
+
+RATE_LIMIT_MESSAGE = "Rate limit reached. Please wait a moment and try again."
+NO_ANSWER_MESSAGE = "Unable to generate a valid response based on the provided context."
+
+SYSTEM_MESSAGE = (
+    "You are a highly capable legal research assistant. Answer user queries strictly by utilizing the 'retrieve_legal_context' tool to find evidence in the provided documents; "
+    "to look up several topics at once, call 'retrieve_legal_context_batch' with all of the queries. "
+    "For a specific date, deadline, notice period, amount, party or defined term, call 'lookup_legal_facts' first "
+    "and answer from the facts and sentences it returns when they settle the question. "
+    "Maintain a professional, objective, and precise tone. "
+    "Cite the document and page numbers shown in brackets before each retrieved passage. "
+    "After answering, always respond with 'TERMINATE'."
+)
+# Only offered when there are summary trees to read; otherwise the call would just cost a turn
+SUMMARY_INSTRUCTION = (
+    "For questions about a document as a whole (a summary, its key clauses, risks or dates), call 'get_document_summary' "
+    "first and answer from it, searching for specific clauses only if it lacks the detail needed. "
+)
+
+
+def make_llm_config(stream: bool = False):
+    return {
+        "config_list": [
+            {
+                "api_key": AZURE_OPENAI_API_KEY,
+                "base_url": AZURE_OPENAI_ENDPOINT,
+                "api_type": "azure",
+                "api_version": AZURE_OPENAI_API_VERSION,
+                "model": AZURE_OPENAI_CHAT_DEPLOYMENT,
+                "stream": stream,
+                # Lets the chat governor follow the deployment's rate-limit headers
+                "http_client": rate_governor.http_client("chat"),
+            }
+        ],
+        "temperature": 0
+    }
+
+
+def is_termination_msg(msg):
+    return msg.get("content") and "TERMINATE" in msg["content"]
+
+
+def _parallel_retrievals(messages):
+    # The tool calls of the last message if there are several and all are retrieve_legal_context
+    calls = (messages[-1] if messages else {}).get("tool_calls") or []
+    if len(calls) < 2 or any(call.get("function", {}).get("name") != "retrieve_legal_context" for call in calls):
+        return None, None
+    try:
+        queries = [json.loads(call["function"].get("arguments") or "{}")["query"] for call in calls]
+    except (ValueError, KeyError, TypeError):
+        # Malformed arguments: let AutoGen run the calls and report the error to the model
+        return None, None
+    IOStream.get_default().send(ExecuteFunctionEvent(
+        func_name="retrieve_legal_context_batch", arguments={"queries": queries}, recipient="LegalAssistant"
+    ))
+    tracing.count("agent.batched_tool_calls", len(calls))
+    return calls, queries
+
+
+def _tool_responses(calls, contexts):
+    responses = [
+        {"tool_call_id": call.get("id"), "role": "tool", "content": context} for call, context in zip(calls, contexts)
+    ]
+    return True, {"role": "tool", "tool_responses": responses, "content": "\n\n".join(contexts)}
+
+
+def batched_tool_calls_reply(recipient, messages=None, sender=None, config=None):
+    """Answer a turn's parallel retrieve_legal_context calls with one batched search.
+
+    Registered ahead of AutoGen's own tool-call reply, which would run them one by one.
+    """
+    calls, queries = _parallel_retrievals(messages)
+    if calls is None:
+        return False, None
+    return _tool_responses(calls, retrieve_legal_contexts(queries))
+
+
+async def a_batched_tool_calls_reply(recipient, messages=None, sender=None, config=None):
+    calls, queries = _parallel_retrievals(messages)
+    if calls is None:
+        return False, None
+    return _tool_responses(calls, await aretrieve_legal_contexts(queries))
+
+
+def summaries_available() -> bool:
+    """True if the current matter's index has summary trees, or new documents get one."""
+    return SUMMARY_TREE or has_summary_trees(current_persist_dir())
+
+
+def system_message(summaries: bool) -> str:
+    if not summaries:
+        return SYSTEM_MESSAGE
+    # Right after the retrieval instructions
+    position = SYSTEM_MESSAGE.index("For a specific")
+    return SYSTEM_MESSAGE[:position] + SUMMARY_INSTRUCTION + SYSTEM_MESSAGE[position:]
+
+
+def build_agents(llm_config=None, model_client_cls=None, asynchronous: bool = False, summaries: bool = None):
+    """Create the assistant and user proxy with the retrieval tools registered.
+
+    ``model_client_cls`` registers a custom AutoGen model client (e.g. the benchmarks' mock).
+    ``asynchronous`` registers the async tool, for agents driven by ``a_initiate_chat``.
+    ``summaries`` (default ``summaries_available()``) adds the get_document_summary tool.
+    """
+    summaries = summaries_available() if summaries is None else summaries
+    legal_assistant = AssistantAgent(
+        name="LegalAssistant",
+        system_message=system_message(summaries),
+        llm_config=llm_config or make_llm_config(),
+    )
+
+    user = UserProxyAgent(
+        name="User",
+        llm_config=False,
+        human_input_mode="NEVER",
+        is_termination_msg=is_termination_msg,
+        code_execution_config={"use_docker": False}
+    )
+
+    tool = aretrieve_legal_context if asynchronous else retrieve_legal_context
+    legal_assistant.register_for_llm(name="retrieve_legal_context", description="Retrieve context from legal documents.")(tool)
+    user.register_for_execution(name="retrieve_legal_context")(tool)
+    batch_tool = aretrieve_legal_context_batch if asynchronous else retrieve_legal_context_batch
+    legal_assistant.register_for_llm(
+        name="retrieve_legal_context_batch",
+        description="Retrieve context from legal documents for several queries at once; results are grouped by query.",
+    )(batch_tool)
+    user.register_for_execution(name="retrieve_legal_context_batch")(batch_tool)
+    if summaries:
+        summary_tool = aget_document_summary if asynchronous else get_document_summary
+        legal_assistant.register_for_llm(
+            name="get_document_summary",
+            description="Precomputed summaries of whole documents and their sections; "
+                        "optionally only documents whose name contains 'document'.",
+        )(summary_tool)
+        user.register_for_execution(name="get_document_summary")(summary_tool)
+    facts_tool = alookup_legal_facts if asynchronous else lookup_legal_facts
+    legal_assistant.register_for_llm(
+        name="lookup_legal_facts",
+        description="Look up facts extracted from the documents: 'kind' is one of date, deadline, amount, party, "
+                    "defined_term or obligation (empty for all); 'text' optionally filters on a word or name.",
+    )(facts_tool)
+    user.register_for_execution(name="lookup_legal_facts")(facts_tool)
+    # Parallel retrieve_legal_context calls in one turn are searched together
+    if asynchronous:
+        user.register_reply([Agent, None], a_batched_tool_calls_reply, ignore_async_in_sync_chat=True)
+    else:
+        user.register_reply([Agent, None], batched_tool_calls_reply)
+    # Registering the tool rebuilds the assistant's client, so customise and wrap it afterwards
+    if model_client_cls is not None:
+        legal_assistant.register_model_client(model_client_cls=model_client_cls)
+    rate_governor.govern_llm_client(legal_assistant)
+    tracing.trace_llm_client(legal_assistant, summary_prompt=legal_assistant.DEFAULT_SUMMARY_PROMPT)
+    return legal_assistant, user
+
+
+class AgentPool:
+    """Agent pairs built once and reused across consultations.
+
+    ``agents()`` checks out an idle (assistant, user) pair, or builds one when all are in
+    use, and resets its conversation state when the consultation ends. The Streamlit app
+    keeps one pool per session; other callers share ``get_agent_pool()``. Pools used by
+    the async API must be created with ``asynchronous=True``.
+    """
+
+    def __init__(self, llm_config=None, model_client_cls=None, asynchronous: bool = False):
+        self.llm_config = llm_config or make_llm_config()
+        self.model_client_cls = model_client_cls
+        self.asynchronous = asynchronous
+        self.created = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def agents(self):
+        # Pairs with and without the summary tool are kept apart, as matters may differ
+        summaries = summaries_available()
+        with self._lock:
+            index = next((i for i, (flag, _) in enumerate(self._idle) if flag == summaries), None)
+            pair = self._idle.pop(index)[1] if index is not None else None
+        if pair is None:
+            with tracing.span("agent.construct"):
+                pair = build_agents(self.llm_config, self.model_client_cls, self.asynchronous, summaries)
+            with self._lock:
+                self.created += 1
+        try:
+            yield pair
+        except asyncio.CancelledError:
+            # A cancelled chat may still have an LLM call running in a worker thread, so
+            # this pair is dropped rather than handed to the next consultation
+            raise
+        except BaseException:
+            self._release(summaries, pair)
+            raise
+        else:
+            self._release(summaries, pair)
+
+    def _release(self, summaries, pair):
+        for agent in pair:
+            agent.reset()
+        with self._lock:
+            self._idle.append((summaries, pair))
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_agent_pool(stream: bool = False, asynchronous: bool = False) -> AgentPool:
+    """Return the process-wide pool for the given kind of agents."""
+    with _pools_lock:
+        pool = _pools.get((stream, asynchronous))
+        if pool is None:
+            pool = _pools[(stream, asynchronous)] = AgentPool(make_llm_config(stream=stream), asynchronous=asynchronous)
+        return pool
+
+
+def final_answer(history):
+    """Return the assistant's last message without the TERMINATE marker."""
+    for msg in reversed(history):
+        if msg.get("role") == "user" and msg.get("name") == "LegalAssistant" and msg.get("content"):
+            return msg["content"].replace("TERMINATE", "").strip()
+    return NO_ANSWER_MESSAGE
+
+
+def run_agent(query, pool: AgentPool = None, summary_method: str = SUMMARY_METHOD):
+    with (pool or get_agent_pool()).agents() as (legal_assistant, user):
+        with tracing.span("agent.chat") as chat_span:
+            chat_result = user.initiate_chat(
+                legal_assistant,
+                message=query,
+                summary_method=summary_method
+            )
+            chat_span.set(turns=len(getattr(chat_result, "chat_history", None) or []))
+
+    history = getattr(chat_result, "chat_history", None)
+    if history is None:
+        return "No chat history found.", []
+    return final_answer(history), history
+
+
+def run_agent_with_retry(query, max_retries: int = 5, initial_delay_seconds: float = 3.0, **kwargs):
+    """Call run_agent with retries on Azure OpenAI rate limit errors."""
+    delay = initial_delay_seconds
+    for attempt in range(max_retries):
+        try:
+            return run_agent(query, **kwargs)
+        except Exception as e:
+            # Non-rate-limit errors should be raised
+            if not is_rate_limit_error(e):
+                raise
+            tracing.count("agent.rate_limit_retries")
+            time.sleep(delay)
+            delay *= 2  # exponential backoff
+    # Fallback after exhausting retries
+    return RATE_LIMIT_MESSAGE, []
+
+
+def is_cacheable(answer, history):
+    # Only keep real answers; fallbacks should be retried next time
+    return bool(history) and answer not in (RATE_LIMIT_MESSAGE, NO_ANSWER_MESSAGE)
+
+
+def answer_query(query, pool: AgentPool = None):
+    """Answer from the cache when this index has already answered the query; otherwise run the agent.
+
+    Returns (answer, cached).
+    """
+    # The fingerprint changes whenever a document is added, replaced or removed
+    fingerprint = get_retriever().index_fingerprint()
+    answer_cache = get_answer_cache()
+    cached = answer_cache.get(query, fingerprint)
+    if cached is not None:
+        return cached, True
+
+    answer, history = run_agent_with_retry(query, pool=pool)
+    if is_cacheable(answer, history):
+        answer_cache.put(query, fingerprint, answer)
+    return answer, False
+
+
+# --- asyncio ---
+
+async def arun_agent(query, pool: AgentPool, summary_method: str = SUMMARY_METHOD):
+    """``run_agent`` on the event loop: LLM calls run in the loop's executor and the
+    retrieval tool uses the async embedding API."""
+    with pool.agents() as (legal_assistant, user):
+        with tracing.span("agent.chat") as chat_span:
+            chat_result = await user.a_initiate_chat(
+                legal_assistant,
+                message=query,
+                summary_method=summary_method
+            )
+            chat_span.set(turns=len(getattr(chat_result, "chat_history", None) or []))
+
+    history = getattr(chat_result, "chat_history", None)
+    if history is None:
+        return "No chat history found.", []
+    return final_answer(history), history
+
+
+class _EventStream:
+    """AutoGen IOStream that forwards streamed tokens and tool executions to a queue."""
+
+    def __init__(self, events):
+        self.events = events
+
+    def print(self, *objects, sep=" ", end="\n", flush=False):
+        pass
+
+    def send(self, message):
+        if isinstance(message, StreamEvent):
+            self.events.put(("token", message.content.content))
+        elif isinstance(message, ExecuteFunctionEvent):
+            arguments = message.content.arguments
+            query = "; ".join(arguments.get("queries") or ()) or arguments.get("query", "")
+            self.events.put(("status", f"🔍 Searching the case file: {query}" if query else "🔍 Searching the case file..."))
+
+    def input(self, prompt="", *, password=False):
+        return ""
+
+
+async def aanswer_query(
+    query,
+    pool: AgentPool,
+    events=None,
+    use_cache: bool = True,
+    max_retries: int = 5,
+    initial_delay_seconds: float = 3.0,
+):
+    """Answer a query on the event loop; returns ``{"answer", "history", "cached"}``.
+
+    With ``events`` (a queue), streamed tokens and retrieval status are put on it as
+    ``("token", text)`` / ``("status", text)``. Rate-limit backoff awaits instead of
+    sleeping, so a waiting consultation holds no thread.
+    """
+    answer_cache = get_answer_cache()
+    if use_cache:
+        fingerprint = await asyncio.to_thread(get_retriever().index_fingerprint)
+        cached = await asyncio.to_thread(answer_cache.get, query, fingerprint)
+        if cached is not None:
+            return {"answer": cached, "history": [], "cached": True}
+
+    delay = initial_delay_seconds
+    with IOStream.set_default(_EventStream(events) if events is not None else IOStream.get_default()):
+        for attempt in range(max_retries):
+            try:
+                answer, history = await arun_agent(query, pool)
+                break
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                tracing.count("agent.rate_limit_retries")
+                if attempt == max_retries - 1:
+                    return {"answer": RATE_LIMIT_MESSAGE, "history": [], "cached": False}
+                if events is not None:
+                    events.put(("status", f"⏳ Rate limited, retrying in {delay:.0f}s..."))
+                await asyncio.sleep(delay)
+                delay *= 2  # exponential backoff
+
+    if use_cache and is_cacheable(answer, history):
+        await asyncio.to_thread(answer_cache.put, query, fingerprint, answer)
+    return {"answer": answer, "history": history, "cached": False}
+
+
+def visible_text(text: str) -> str:
+    """Strip TERMINATE from a partial answer, including a half-streamed one at the end."""
+    text = text.replace("TERMINATE", "")
+    for length in range(len("TERMINATE") - 1, 0, -1):
+        if text.endswith("TERMINATE"[:length]):
+            return text[:-length].rstrip()
+    return text.rstrip()
@@ -0,0 +1,241 @@
+"""Structure-aware chunking of contracts and other legal documents.
+
+Chunks end at clause boundaries instead of every 800 characters. Boundaries come from
+numbering ("12.3", "4.", "Section 7", "Article IV") and from PyMuPDF's font information
+(bold or larger lines are headings). Each chunk records its place in the document as
+``section_path`` (e.g. ``["ARTICLE VII - PETS", "7.2"]``), starts with the headings above
+it so the clause is retrievable by topic, and is capped at ``max_tokens``; longer clauses
+are split between sentences.
+
+The document is read in a single streaming pass: only the clause being assembled is
+held in memory.
+"""
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import fitz
+from langchain_core.documents import Document
+
+from embedding_pipeline import count_tokens
+
+LEGAL_CHUNK_MAX_TOKENS = int(os.environ.get("LEGAL_CHUNK_MAX_TOKENS", "400"))
+# A numbered line with less text than this before the next, deeper clause is a heading ("12. Indemnification")
+LEGAL_CHUNK_MIN_TOKENS = 12
+# Longer lines are body text even when bold or large
+MAX_HEADING_CHARS = 120
+
+DIVISION = re.compile(r"^(article|part|chapter|schedule|exhibit|annex|appendix)\s+([ivxlcdm]+|\d+|[a-z])\b", re.IGNORECASE)
+SECTION = re.compile(r"^(?:section|sec\.|§)\s*(\d+(?:\.\d+)*)", re.IGNORECASE)
+NUMBERED = re.compile(r"^(\d{1,3}(?:\.\d{1,3})+|\d{1,3}\.)(?=\s)")
+SENTENCE_END = re.compile(r"(?<=[.;:])\s+")
+
+
+def _page_lines(page):
+    """``(text, size, bold)`` for every non-empty text line of a page, in reading order."""
+    lines = []
+    for block in page.get_text("dict", sort=True)["blocks"]:
+        for line in block.get("lines", ()):
+            spans = [span for span in line["spans"] if span["text"].strip()]
+            if not spans:
+                continue
+            text = " ".join("".join(span["text"] for span in line["spans"]).split())
+            size = max(span["size"] for span in spans)
+            # Bit 4 of the span flags is bold; some PDFs only say so in the font name
+            bold = all(span["flags"] & 16 or "bold" in span["font"].lower() for span in spans)
+            lines.append((text, round(size, 1), bold))
+    return lines
+
+
+def _extract_page_range_lines(task):
+    # Runs in a worker process, so it opens its own handle on the PDF
+    pdf_path, first, last = task
+    with fitz.open(pdf_path) as doc:
+        return [_page_lines(doc[i]) for i in range(first, last)]
+
+
+def _iter_document_lines(pdf_path):
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            yield _page_lines(page)
+
+
+def iter_pdf_lines(pdf_path: str, workers: int = None):
+    """Yield ``(page, text, size, bold)`` per line; ``page`` is 1-based.
+
+    Large documents are read on a process pool like ``rag_index_builder.iter_pdf_pages``;
+    lines are still yielded in document order.
+    """
+    from rag_index_builder import PAGES_PER_TASK, PARALLEL_PAGE_THRESHOLD
+
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+    if workers is None:
+        workers = min(os.cpu_count() or 1, 8) if page_count >= PARALLEL_PAGE_THRESHOLD else 1
+
+    if workers <= 1 or page_count <= PAGES_PER_TASK:
+        pages = _iter_document_lines(pdf_path)
+        for number, lines in enumerate(pages, start=1):
+            for text, size, bold in lines:
+                yield number, text, size, bold
+        return
+
+    tasks = [(pdf_path, first, min(first + PAGES_PER_TASK, page_count)) for first in range(0, page_count, PAGES_PER_TASK)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pages = chain.from_iterable(pool.map(_extract_page_range_lines, tasks))
+        for number, lines in enumerate(pages, start=1):
+            for text, size, bold in lines:
+                yield number, text, size, bold
+
+
+def classify_line(text, size, bold, body_size, after_break):
+    """Return ``(level, title, kind)`` if the line starts a new section or clause, else None.
+
+    ``kind`` is "heading" for lines that are only a title and "clause" for numbered
+    lines whose text is part of the clause body. ``after_break`` says whether the previous
+    line ended a sentence, so a wrapped line that happens to start with "10.5" isn't
+    taken for a new clause.
+    """
+    short = len(text) <= MAX_HEADING_CHARS
+    if short and DIVISION.match(text):
+        return 1, text, "heading"
+    match = SECTION.match(text) or NUMBERED.match(text)
+    if match and after_break:
+        number = match.group(1).rstrip(".")
+        level = 2 + number.count(".")
+        # Unnumbered-looking body text can follow a number on the same line, so only the font tells a title apart
+        if short and bold:
+            return level, text, "heading"
+        return level, match.group(0).rstrip(".") if match.re is SECTION else number, "clause"
+    if short and (bold or size >= body_size + 1.5) and not text.endswith((".", ",", ";")):
+        return 1, text, "heading"
+    return None
+
+
+class _Unit:
+    """The clause (or preamble) being assembled."""
+
+    def __init__(self, page, offset):
+        self.lines = []
+        self.page_start = self.page_end = page
+        self.char_start = offset
+
+    def add(self, text, page):
+        self.lines.append(text)
+        self.page_end = page
+
+    @property
+    def text(self):
+        return " ".join(self.lines)
+
+
+def _split_sentences(text, max_tokens):
+    """Split ``text`` between sentences into ``(start, piece)`` pieces of at most ``max_tokens`` tokens."""
+    pieces = []
+    piece_start, piece_end, piece_tokens = None, 0, 0
+
+    def cut():
+        if piece_start is not None:
+            pieces.append((piece_start, text[piece_start:piece_end]))
+
+    start = 0
+    for end in chain((match.start() for match in SENTENCE_END.finditer(text)), [len(text)]):
+        sentence_start = start
+        while sentence_start < end and text[sentence_start] == " ":
+            sentence_start += 1
+        sentence = text[sentence_start:end]
+        start = end
+        tokens = count_tokens(sentence)
+        if piece_start is not None and piece_tokens + tokens > max_tokens:
+            cut()
+            piece_start = None
+        if tokens > max_tokens:
+            # A single sentence over the cap is cut between words
+            word_start, word_tokens = sentence_start, 0
+            for word in re.finditer(r"\S+", sentence):
+                tokens = count_tokens(" " + word.group())
+                if word_tokens and word_tokens + tokens > max_tokens:
+                    pieces.append((word_start, text[word_start:sentence_start + word.start()].rstrip()))
+                    word_start, word_tokens = sentence_start + word.start(), 0
+                word_tokens += tokens
+            pieces.append((word_start, text[word_start:end]))
+            continue
+        if piece_start is None:
+            piece_start, piece_tokens = sentence_start, 0
+        piece_end = end
+        piece_tokens += tokens
+    cut()
+    return pieces
+
+
+def chunk_lines(lines, max_tokens: int = LEGAL_CHUNK_MAX_TOKENS):
+    """Turn ``(page, text, size, bold)`` lines into clause-sized ``Document`` chunks.
+
+    Metadata: ``section_path`` (list of titles), ``page_start``/``page_end`` (1-based),
+    ``char_start``/``char_end`` (offsets of the clause text in the document's lines joined
+    by single spaces) and ``part`` when a long clause had to be split.
+    """
+    sizes = Counter()
+    path = []  # [level, title, kind] from the outermost section inwards
+    unit = None
+    offset = 0
+    previous = None
+
+    def flush():
+        text = unit.text
+        if not text:
+            return
+        headings = [title for _, title, kind in path if kind == "heading"]
+        header = " > ".join(headings)
+        section_path = [title for _, title, _ in path]
+        pieces = [(0, text)] if count_tokens(text) <= max_tokens else _split_sentences(text, max_tokens)
+        for part, (start, piece) in enumerate(pieces):
+            metadata = {
+                "section_path": section_path,
+                "page_start": unit.page_start,
+                "page_end": unit.page_end,
+                "char_start": unit.char_start + start,
+                "char_end": unit.char_start + start + len(piece),
+            }
+            if len(pieces) > 1:
+                metadata["part"] = part + 1
+            yield Document(page_content=f"{header}\n{piece}" if header else piece, metadata=metadata)
+
+    for page, text, size, bold in lines:
+        sizes[size] += len(text)
+        body_size = sizes.most_common(1)[0][0]
+        after_break = previous is None or previous is True or previous.endswith((".", ";", ":"))
+        found = classify_line(text, size, bold, body_size, after_break)
+
+        if found is not None:
+            level, title, kind = found
+            if unit is not None and path and path[-1][2] == "clause" and level > path[-1][0] \
+                    and count_tokens(unit.text) < LEGAL_CHUNK_MIN_TOKENS:
+                # "12. Indemnification" followed by 12.1: the short numbered line was a title
+                path[-1] = [path[-1][0], unit.text, "heading"]
+            elif unit is not None:
+                yield from flush()
+            unit = None
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append([level, title, kind])
+            if kind == "heading":
+                offset += len(text) + 1
+                previous = True
+                continue
+
+        if unit is None:
+            unit = _Unit(page, offset)
+        unit.add(text, page)
+        offset += len(text) + 1
+        previous = text
+
+    if unit is not None:
+        yield from flush()
+
+
+def split_pdf_legal(pdf_path: str, workers: int = None, max_tokens: int = LEGAL_CHUNK_MAX_TOKENS):
+    """Chunk a PDF on clause boundaries; see ``chunk_lines``."""
+    yield from chunk_lines(iter_pdf_lines(pdf_path, workers=workers), max_tokens=max_tokens)
@@ -0,0 +1,271 @@
+"""Structured facts extracted from chunks at index time: dates, deadlines, amounts, parties
+and defined terms.
+
+"What's the notice period?" or the Dates quick action used to need a semantic search and
+several LLM turns every time. ``extract_facts`` runs local regular expressions over every
+chunk (milliseconds per document); with ``LEGAL_FACTS_LLM=1`` the chat deployment also
+lists each obligation (who must do what, by when) in the chunks that state one. The facts
+are saved in ``facts.sqlite`` next to each store's chunks, keyed by chunk ID and page, and
+the agent's ``lookup_legal_facts`` tool reads them directly.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+
+FACTS_FILE = "facts.sqlite"
+FACT_KINDS = ("date", "deadline", "amount", "party", "defined_term", "obligation")
+LEGAL_FACTS_LLM = os.environ.get("LEGAL_FACTS_LLM", "0").lower() not in ("0", "false", "no")
+LEGAL_FACTS_WORKERS = int(os.environ.get("LEGAL_FACTS_WORKERS", "8"))
+SNIPPET_CHARS = 300
+
+MONTHS = {
+    name: number
+    for number, names in enumerate(
+        [("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"), ("may",), ("june", "jun"),
+         ("july", "jul"), ("august", "aug"), ("september", "sep", "sept"), ("october", "oct"),
+         ("november", "nov"), ("december", "dec")],
+        start=1,
+    )
+    for name in names
+}
+_MONTH = r"(?P<month>" + "|".join(sorted(MONTHS, key=len, reverse=True)) + r")\.?"
+DATE_PATTERNS = [
+    re.compile(_MONTH + r"\s+(?P<day>\d{1,2})(?:st|nd|rd|th)?,?\s+(?P<year>\d{4})", re.I),
+    re.compile(r"(?P<day>\d{1,2})(?:st|nd|rd|th)?\s+(?:day\s+of\s+)?" + _MONTH + r",?\s+(?P<year>\d{4})", re.I),
+    re.compile(r"(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})"),
+    # Numeric dates are read month first, as in US contracts
+    re.compile(r"(?P<month>\d{1,2})/(?P<day>\d{1,2})/(?P<year>\d{4})"),
+]
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9,
+    "ten": 10, "eleven": 11, "twelve": 12, "fourteen": 14, "fifteen": 15, "twenty": 20, "thirty": 30,
+    "forty-five": 45, "sixty": 60, "ninety": 90, "hundred twenty": 120, "one hundred twenty": 120,
+}
+DEADLINE_PATTERN = re.compile(
+    r"(?P<number>\d+|" + "|".join(sorted(NUMBER_WORDS, key=len, reverse=True)) + r")"
+    r"(?:\s*\(\d+\))?\s+(?P<kind>business\s+|calendar\s+|working\s+)?"
+    r"(?P<unit>days?|weeks?|months?|years?)(?:'|’)?",
+    re.I,
+)
+# A duration is only a deadline next to one of these words ("within 30 days", "30 days' notice")
+DEADLINE_CUES = re.compile(
+    r"\b(within|at least|not less than|no later than|no fewer than|upon|after|before|prior|notice|following|"
+    r"period|term|expir|renew|cure|from the date)\b",
+    re.I,
+)
+AMOUNT_PATTERN = re.compile(
+    r"(?P<currency>US\$|\$|USD|EUR|€|£|GBP)\s?(?P<number>\d[\d,]*(?:\.\d+)?)(?:\s?(?P<scale>million|billion|thousand))?",
+    re.I,
+)
+CURRENCIES = {"$": "USD", "us$": "USD", "usd": "USD", "€": "EUR", "eur": "EUR", "£": "GBP", "gbp": "GBP"}
+SCALES = {"thousand": 10 ** 3, "million": 10 ** 6, "billion": 10 ** 9}
+ENTITY = r"[A-Z][\w&.,'-]*(?:\s+[A-Z&][\w&.,'-]*)*?\s+(?:LLC|LLP|L\.L\.C\.|Inc\.?|Ltd\.?|Limited|Corporation|Corp\.?|Company|GmbH|PLC|plc|LP|L\.P\.|S\.A\.|N\.V\.)"
+# 'Northwind Properties LLC (the "Landlord")'
+PARTY_ROLE_PATTERN = re.compile(r"(?P<name>" + ENTITY + r")\s*,?\s*\((?:the\s+|hereinafter\s+)?[\"“](?P<role>[A-Z][^\"”]{1,40})[\"”]\)")
+PARTY_PATTERN = re.compile(ENTITY)
+DEFINED_TERM_PATTERNS = [
+    # '"Confidential Information" means ...'
+    re.compile(r"[\"“](?P<term>[A-Z][^\"”]{1,60})[\"”]\s+(?:shall\s+)?(?:means?|has the meaning|refers to|includes?)\b"),
+    # '... (the "Premises")'
+    re.compile(r"\((?:the\s+|each\s+a\s+|collectively,?\s+the\s+|hereinafter\s+)?[\"“](?P<term>[A-Z][^\"”]{1,60})[\"”]\)"),
+]
+
+OBLIGATION_CUES = re.compile(r"\b(shall|must|agrees? to|is required to|will)\b", re.I)
+OBLIGATION_PROMPT = (
+    "List every obligation stated in this excerpt of a legal document as a JSON array of objects with "
+    "the keys \"party\" (who is bound), \"obligation\" (what they must or must not do, in a few words) "
+    "and \"deadline\" (when, or null). Answer with the JSON array only; [] if there is none."
+)
+OBLIGATION_MAX_TOKENS = 400
+
+
+def _sentence(text, start, end):
+    # The sentence around a match, as evidence for the fact
+    left = max(text.rfind(". ", 0, start), text.rfind("\n", 0, start))
+    right_candidates = [position for position in (text.find(". ", end), text.find("\n", end)) if position >= 0]
+    right = min(right_candidates) + 1 if right_candidates else len(text)
+    snippet = " ".join(text[left + 1:right].split())
+    return snippet[:SNIPPET_CHARS]
+
+
+def _iso_date(match):
+    parts = match.groupdict()
+    month = parts["month"]
+    month = int(month) if month.isdigit() else MONTHS[month.lower().rstrip(".")]
+    try:
+        return date(int(parts["year"]), month, int(parts["day"])).isoformat()
+    except ValueError:
+        return None
+
+
+def _number(text):
+    text = text.lower()
+    return int(text) if text.isdigit() else NUMBER_WORDS.get(text)
+
+
+def rule_facts(text):
+    """``(kind, value, normalized, snippet)`` found in ``text`` by the regular expressions."""
+    facts = []
+    taken = []
+
+    def add(kind, match, value, normalized):
+        facts.append((kind, value, normalized, _sentence(text, match.start(), match.end())))
+
+    for pattern in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            if any(start <= match.start() < end for start, end in taken):
+                continue
+            normalized = _iso_date(match)
+            if normalized is not None:
+                taken.append(match.span())
+                add("date", match, match.group(0), normalized)
+
+    for match in DEADLINE_PATTERN.finditer(text):
+        number = _number(match.group("number"))
+        window = text[max(0, match.start() - 40):match.end() + 40]
+        if number is None or not DEADLINE_CUES.search(window):
+            continue
+        unit = match.group("unit").lower().rstrip("s")
+        kind = (match.group("kind") or "").strip().lower()
+        normalized = f"{number} {kind + ' ' if kind else ''}{unit}{'s' if number != 1 else ''}"
+        add("deadline", match, match.group(0).rstrip("'’"), normalized)
+
+    for match in AMOUNT_PATTERN.finditer(text):
+        value = float(match.group("number").replace(",", "")) * SCALES.get((match.group("scale") or "").lower(), 1)
+        currency = CURRENCIES[match.group("currency").lower()]
+        add("amount", match, match.group(0), f"{currency} {value:.2f}")
+
+    roles = set()
+    for match in PARTY_ROLE_PATTERN.finditer(text):
+        name, role = " ".join(match.group("name").split()), match.group("role")
+        roles.add(role)
+        add("party", match, name, role)
+    named = {fact[1] for fact in facts if fact[0] == "party"}
+    for match in PARTY_PATTERN.finditer(text):
+        name = " ".join(match.group(0).split())
+        if name not in named:
+            named.add(name)
+            add("party", match, name, None)
+
+    terms = set()
+    for pattern in DEFINED_TERM_PATTERNS:
+        for match in pattern.finditer(text):
+            term = match.group("term").strip()
+            if term not in terms and term not in roles:
+                terms.add(term)
+                add("defined_term", match, term, term.lower())
+    return facts
+
+
+def llm_facts(text, completer):
+    """Obligations listed by the chat deployment; an unusable answer yields none."""
+    answer = completer.summarize(OBLIGATION_PROMPT, text, OBLIGATION_MAX_TOKENS)
+    answer = answer.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+    try:
+        items = json.loads(answer)
+    except ValueError:
+        return []
+    facts = []
+    for item in items if isinstance(items, list) else ():
+        if not isinstance(item, dict) or not item.get("obligation"):
+            continue
+        party = str(item.get("party") or "").strip()
+        obligation = str(item["obligation"]).strip()
+        deadline = item.get("deadline")
+        value = f"{party}: {obligation}" if party else obligation
+        facts.append(("obligation", value, str(deadline) if deadline else None, value[:SNIPPET_CHARS]))
+    return facts
+
+
+def extract_facts(ids, documents, use_llm: bool = None, workers: int = LEGAL_FACTS_WORKERS, on_progress=None):
+    """Fact rows (dicts) for chunks ``documents`` stored under ``ids``.
+
+    ``use_llm`` (default LEGAL_FACTS_LLM) adds obligations from the chat deployment, for the
+    chunks that state one; ``on_progress(done, total)`` follows those calls.
+    """
+    rows = []
+
+    def row(chunk_id, document, fact, origin):
+        kind, value, normalized, snippet = fact
+        metadata = document.metadata
+        return {
+            "chunk_id": chunk_id, "source": metadata.get("source"),
+            "page_start": metadata.get("page_start"), "page_end": metadata.get("page_end"),
+            "kind": kind, "value": value, "normalized": normalized, "snippet": snippet, "origin": origin,
+        }
+
+    for chunk_id, document in zip(ids, documents):
+        rows.extend(row(chunk_id, document, fact, "rules") for fact in rule_facts(document.page_content))
+
+    if LEGAL_FACTS_LLM if use_llm is None else use_llm:
+        from summary_tree import get_summarizer
+
+        # Any instruction -> completion; paced by the chat governor at bulk priority
+        completer = get_summarizer()
+        todo = [(chunk_id, document) for chunk_id, document in zip(ids, documents)
+                if OBLIGATION_CUES.search(document.page_content)]
+        executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="legal-facts")
+        try:
+            futures = [executor.submit(llm_facts, document.page_content, completer) for _, document in todo]
+            for done, ((chunk_id, document), future) in enumerate(zip(todo, futures), start=1):
+                rows.extend(row(chunk_id, document, fact, "llm") for fact in future.result())
+                if on_progress is not None:
+                    on_progress(done, len(todo))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+    return rows
+
+
+class FactStore:
+    """The facts of one saved store, in SQLite; written once like the ``ChunkStore``."""
+
+    COLUMNS = ("chunk_id", "source", "page_start", "page_end", "kind", "value", "normalized", "snippet", "origin")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            f"{Path(path).absolute().as_uri()}?mode=ro&immutable=1", uri=True, check_same_thread=False
+        )
+
+    @classmethod
+    def write(cls, path: str, rows):
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute(f"CREATE TABLE facts ({', '.join(cls.COLUMNS)})")
+            conn.execute("CREATE INDEX facts_kind ON facts (kind, normalized)")
+            conn.executemany(
+                f"INSERT INTO facts VALUES ({', '.join('?' * len(cls.COLUMNS))})",
+                ([row[column] for column in cls.COLUMNS] for row in rows),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def search(self, kind: str = None, text: str = None, exclude=()):
+        """Facts of ``kind`` whose value or sentence contains ``text``, in page order."""
+        sql, args = "SELECT * FROM facts WHERE 1", []
+        if kind:
+            sql += " AND kind = ?"
+            args.append(kind)
+        if text:
+            sql += " AND (value LIKE ? OR normalized LIKE ? OR snippet LIKE ?)"
+            args += [f"%{text}%"] * 3
+        sql += " ORDER BY page_start, rowid"
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows if row[0] not in exclude]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,110 @@
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+
+LEXICAL_FILE = "lexical_index.json"
+
+# Keeps section numbers ("12.3", "4(b)") and hyphenated terms ("non-compete") as single tokens
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-'][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 inverted index over chunk texts.
+
+    ``keys`` identify each indexed chunk (chunk IDs, or ``(segment, chunk_id)`` pairs once
+    several segment indexes are merged). Postings are ``term -> ([positions], [term counts])``.
+    """
+
+    def __init__(self, keys, postings, lengths, k1: float = 1.5, b: float = 0.75):
+        self.keys = keys
+        self.postings = postings
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+        self.avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+
+    @classmethod
+    def build(cls, keys, texts):
+        postings, lengths = {}, []
+        for position, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                positions, term_counts = postings.setdefault(term, ([], []))
+                positions.append(position)
+                term_counts.append(count)
+        return cls(list(keys), postings, lengths)
+
+    @classmethod
+    def merge(cls, indexes):
+        """Combine ``(prefix, index)`` pairs into one index whose keys are ``(prefix, key)``."""
+        keys, postings, lengths = [], {}, []
+        for prefix, index in indexes:
+            offset = len(keys)
+            keys.extend((prefix, key) for key in index.keys)
+            lengths.extend(index.lengths)
+            for term, (positions, term_counts) in index.postings.items():
+                merged_positions, merged_counts = postings.setdefault(term, ([], []))
+                merged_positions.extend(position + offset for position in positions)
+                merged_counts.extend(term_counts)
+        return cls(keys, postings, lengths)
+
+    def search(self, query: str, k: int = 10, exclude=None):
+        """Return up to ``k`` ``(key, score)`` pairs, best first, skipping keys in ``exclude``."""
+        if not self.keys:
+            return []
+        scores = {}
+        total = len(self.keys)
+        for term in set(tokenize(query)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            positions, term_counts = entry
+            idf = math.log(1 + (total - len(positions) + 0.5) / (len(positions) + 0.5))
+            for position, count in zip(positions, term_counts):
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / (self.avg_length or 1))
+                scores[position] = scores.get(position, 0.0) + idf * count * (self.k1 + 1) / (count + norm)
+
+        results = []
+        for position, score in heapq.nlargest(k + len(exclude or ()), scores.items(), key=lambda item: item[1]):
+            key = self.keys[position]
+            if exclude and key in exclude:
+                continue
+            results.append((key, score))
+            if len(results) == k:
+                break
+        return results
+
+    def save(self, persist_dir: str):
+        with open(os.path.join(persist_dir, LEXICAL_FILE), "w", encoding="utf-8") as f:
+            json.dump({"keys": self.keys, "lengths": self.lengths, "postings": self.postings}, f)
+
+    @classmethod
+    def load(cls, persist_dir: str):
+        """Load a saved index, or return None if the store was built without one."""
+        try:
+            with open(os.path.join(persist_dir, LEXICAL_FILE), encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        postings = {term: (entry[0], entry[1]) for term, entry in data["postings"].items()}
+        return cls(data["keys"], postings, data["lengths"])
+
+
+def reciprocal_rank_fusion(rankings, k: int = 60):
+    """Fuse ranked lists of keys with RRF: score(key) = sum over lists of 1 / (k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,34 @@
+import hashlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from lexical_index import tokenize
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic local embedding stand-in based on feature hashing.
+
+    Each word and word bigram is hashed to a signed bucket of a ``dim``-sized vector, which
+    is then L2-normalised. Texts that share vocabulary end up close together, which is
+    enough to exercise indexing and retrieval offline (benchmarks, development without
+    Azure credentials). It is not a substitute for a real embedding model.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _embed(self, text: str):
+        vector = np.zeros(self.dim, dtype="float32")
+        tokens = tokenize(text)
+        for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if (digest >> 63) else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
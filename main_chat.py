@@ -1,63 +1,39 @@
-import os
-from dotenv import load_dotenv
-from autogen import AssistantAgent, UserProxyAgent
-from tools import retrieve_legal_context
-
-load_dotenv()
-
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
-AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
-
-llm_config = {
-        "config_list": [
-            {
-                "api_key": AZURE_OPENAI_API_KEY,
-                "base_url": AZURE_OPENAI_ENDPOINT,
-                "api_type": "azure",
-                "api_version": AZURE_OPENAI_API_VERSION,
-                "model": "gpt-4o",  # Replace with your Azure deployment model name
-            }
-        ],
-        "temperature": 0
-    }
-
-def is_termination_msg(msg):
-    return msg.get("content") and "TERMINATE" in msg["content"]
-
-# Define the assistant agent
-legal_assistant = AssistantAgent(
-    name="LegalAssistant",
-    system_message=(
-        "You are a helpful legal assistant that retrieves relevant clauses from legal documents.\n" \
-        "Please give summarised responses to user queries based on the legal context retrieved.\n" \
-        "After answering the user query, always respond with 'TERMINATE' to end the chat."
-    ),
-    llm_config = llm_config
-)
-
-# Define the user proxy agent
-user = UserProxyAgent(
-    name="User",
-    llm_config=False,
-    human_input_mode="NEVER",  # auto-execution
-    is_termination_msg = is_termination_msg,
-    code_execution_config={"use_docker": False}
-)
-
-
-# Register the tool with both agents
-legal_assistant.register_for_llm(
-    name="retrieve_legal_context",
-    description="Retrieve relevant legal context from the indexed legal documents based on the query."
-)(retrieve_legal_context)
-
-user.register_for_execution(
-    name="retrieve_legal_context"
-)(retrieve_legal_context)
-
-if __name__ == "__main__":# Initiate the conversation
-    user.initiate_chat(
-        legal_assistant,
-        message="Can I have a pet in the apartment?"
-    )
\ No newline at end of file
+import argparse
+
+
+def ask(query):
+    """Print retrieval status and the answer as it streams in; returns the final answer."""
+    # AutoGen and the index libraries are only imported once there is a question to answer
+    from consultation_service import stream_answer
+    from legal_agent import visible_text
+
+    draft, printed = "", 0
+    for kind, payload in stream_answer(query):
+        if kind == "status":
+            # Anything streamed before a tool call was an intermediate turn
+            if printed:
+                print()
+            draft, printed = "", 0
+            print(payload, flush=True)
+        elif kind == "token":
+            draft += payload
+            # visible_text holds back a partially streamed TERMINATE, so print only what is new
+            text = visible_text(draft)
+            print(text[printed:], end="", flush=True)
+            printed = len(text)
+        else:
+            # Cached answers arrive in one piece
+            print("" if printed else payload["answer"])
+            return payload["answer"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ask LexAI a question about the indexed documents.")
+    parser.add_argument("query", nargs="*", help="the question (default: a sample question)")
+    parser.add_argument("--matter", help="search this matter's index instead of the default store")
+    args = parser.parse_args()
+    from matters import use_matter
+
+    # Initiate the conversation
+    with use_matter(args.matter):
+        ask(" ".join(args.query) or "Can I have a pet in the apartment?")
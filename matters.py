@@ -0,0 +1,61 @@
+"""Per-matter index namespaces.
+
+Every matter (a case, a client engagement, or by default a Streamlit session) gets its own
+index directory under ``RAG_MATTERS_DIR``, so two users uploading at the same time never
+write to the same store. Which matter a query runs against is carried in a context
+variable: code inside ``use_matter(matter_id)`` (including the consultations it submits and
+the tool calls they make) resolves ``get_retriever()`` to that matter's index. Outside any
+matter, the single ``RAG_PERSIST_DIR`` store is used as before.
+"""
+import contextvars
+import os
+import re
+from contextlib import contextmanager
+
+from config import DEFAULT_PERSIST_DIR
+
+MATTERS_DIR = os.environ.get("RAG_MATTERS_DIR", "rag_matters")
+MAX_MATTER_ID_CHARS = 64
+
+_current_matter = contextvars.ContextVar("current_matter", default=None)
+
+
+def matter_id_for(name: str) -> str:
+    """Normalize a matter name into a directory-safe ID, e.g. 'Smith v. Jones' -> 'smith_v_jones'."""
+    matter_id = re.sub(r"[^a-z0-9_-]+", "_", name.lower()).strip("_")[:MAX_MATTER_ID_CHARS]
+    if not matter_id:
+        raise ValueError(f"'{name}' is not a usable matter name.")
+    return matter_id
+
+
+def matter_dir(matter_id: str = None) -> str:
+    """The index directory of a matter; None is the default store."""
+    if matter_id is None:
+        return DEFAULT_PERSIST_DIR
+    return os.path.join(MATTERS_DIR, matter_id_for(matter_id))
+
+
+@contextmanager
+def use_matter(matter_id: str):
+    """Resolve indexes to ``matter_id`` for the calls made in this block."""
+    token = _current_matter.set(matter_id)
+    try:
+        yield
+    finally:
+        _current_matter.reset(token)
+
+
+def current_matter():
+    return _current_matter.get()
+
+
+def current_persist_dir() -> str:
+    return matter_dir(_current_matter.get())
+
+
+def list_matters():
+    """IDs of the matters that have an index directory."""
+    try:
+        return sorted(entry.name for entry in os.scandir(MATTERS_DIR) if entry.is_dir())
+    except FileNotFoundError:
+        return []
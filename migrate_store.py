@@ -0,0 +1,102 @@
+"""Convert saved indexes from LangChain's pickled docstore (index.pkl) to the chunk store.
+
+Usage:
+    python migrate_store.py [PERSIST_DIR ...]
+
+Handles managed directories (every segment listed in manifest.json) as well as legacy
+single-store directories. The pickle is read by an unpickler that only accepts the
+docstore and Document classes, so a store copied from another machine cannot run code
+while it is converted. The FAISS index, its parameters and the BM25 index are kept.
+"""
+import argparse
+import os
+import pickle
+import sys
+
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+
+from chunk_store import CHUNKS_FILE, ChunkStore
+from config import DEFAULT_PERSIST_DIR
+from index_manager import read_manifest
+
+# Everything a pickled docstore may refer to, including the module paths older LangChain releases used
+ALLOWED_CLASSES = {
+    ("langchain_community.docstore.in_memory", "InMemoryDocstore"): InMemoryDocstore,
+    ("langchain.docstore.in_memory", "InMemoryDocstore"): InMemoryDocstore,
+    ("langchain_core.documents.base", "Document"): Document,
+    ("langchain_core.documents", "Document"): Document,
+    ("langchain.schema.document", "Document"): Document,
+    ("langchain.docstore.document", "Document"): Document,
+}
+
+
+class _DocstoreUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        try:
+            return ALLOWED_CLASSES[(module, name)]
+        except KeyError:
+            raise pickle.UnpicklingError(
+                f"index.pkl refers to {module}.{name}, which is not part of a docstore; refusing to load it."
+            ) from None
+
+
+def read_pickled_docstore(path: str):
+    """Return ``(docstore, index_to_docstore_id)`` from an ``index.pkl`` without running foreign code."""
+    with open(path, "rb") as f:
+        return _DocstoreUnpickler(f).load()
+
+
+def migrate_store_dir(store_dir: str, keep_pickle: bool = False):
+    """Write ``chunks.sqlite`` for one store directory and drop its ``index.pkl``.
+
+    Returns the number of chunks converted, or None if the directory had no pickled docstore.
+    """
+    pickle_path = os.path.join(store_dir, "index.pkl")
+    if not os.path.exists(pickle_path):
+        return None
+    docstore, index_to_docstore_id = read_pickled_docstore(pickle_path)
+    ids = [index_to_docstore_id[position] for position in range(len(index_to_docstore_id))]
+    documents = [docstore.search(chunk_id) for chunk_id in ids]
+    missing = [chunk_id for chunk_id, document in zip(ids, documents) if not isinstance(document, Document)]
+    if missing:
+        raise ValueError(f"'{pickle_path}' has no text for {len(missing)} indexed chunk(s), e.g. {missing[0]!r}.")
+
+    ChunkStore.write(os.path.join(store_dir, CHUNKS_FILE), ids, documents).close()
+    if keep_pickle:
+        os.replace(pickle_path, pickle_path + ".bak")
+    else:
+        os.remove(pickle_path)
+    return len(ids)
+
+
+def store_dirs(persist_dir: str):
+    """The store directories of a persist directory: its segments, or itself for a legacy store."""
+    manifest = read_manifest(persist_dir)
+    if manifest is None:
+        return [persist_dir]
+    return sorted({os.path.join(persist_dir, entry["segment"]) for entry in manifest["documents"].values()})
+
+
+def migrate(persist_dir: str, keep_pickle: bool = False):
+    """Convert every store under ``persist_dir``; returns ``{store_dir: chunks converted or None}``."""
+    return {store_dir: migrate_store_dir(store_dir, keep_pickle) for store_dir in store_dirs(persist_dir)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert pickled FAISS docstores to the SQLite chunk store.")
+    parser.add_argument("persist_dirs", nargs="*", default=[DEFAULT_PERSIST_DIR], help="index directories")
+    parser.add_argument("--keep-pickle", action="store_true", help="keep index.pkl as index.pkl.bak")
+    args = parser.parse_args(argv)
+
+    for persist_dir in args.persist_dirs:
+        if not os.path.isdir(persist_dir):
+            print(f"{persist_dir}: not found", file=sys.stderr)
+            return 1
+        for store_dir, chunks in migrate(persist_dir, args.keep_pickle).items():
+            print(f"{store_dir}: " + ("already converted" if chunks is None else f"{chunks} chunks converted"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
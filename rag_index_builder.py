@@ -1,48 +1,268 @@
 import fitz
 import os
+import uuid
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
 
-from dotenv import load_dotenv
-load_dotenv()
-
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
-from langchain_openai import AzureOpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
 
-# Load Azure OpenAI credentials and config from environment variables
-AZURE_OPENAI_API_KEY = os.environ.get("AZURE_OPENAI_API_KEY")
-AZURE_OPENAI_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT")
-AZURE_OPENAI_API_VERSION = os.environ.get("AZURE_OPENAI_API_VERSION")
-AZURE_OPENAI_EMBEDDING_DEPLOYMENT = os.environ.get("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+from ann_index import INDEX_MMAP, build_faiss_index, load_index_params, read_index, save_index_params, write_index
+from chunk_store import CHUNKS_FILE, ChunkStore
+from config import get_embeddings
+from embedding_cache import CachedEmbeddings, get_embedding_cache
+from embedding_pipeline import BatchedEmbeddings
+from legal_chunker import chunk_lines, iter_pdf_lines
+from legal_facts import FACTS_FILE, FactStore, extract_facts
+from lexical_index import BM25Index
+from summary_tree import SUMMARY_TREE, build_summary_tree, load_summary_tree, save_summary_tree
+
+# Documents with at least this many pages are extracted on a process pool by default
+PARALLEL_PAGE_THRESHOLD = int(os.environ.get("PDF_PARALLEL_PAGE_THRESHOLD", "200"))
+PAGES_PER_TASK = 32
+# "legal" splits on clauses and headings (legal_chunker); "recursive" every 800 characters
+CHUNKER = os.environ.get("CHUNKER", "legal").lower()
+
+def _page_text(page):
+    page_text = page.get_text()
+    if isinstance(page_text, list):
+        page_text = " ".join(str(item) for item in page_text)
+    elif isinstance(page_text, dict):
+        page_text = str(page_text)
+    return page_text
+
+def _extract_page_range(task):
+    # Runs in a worker process, so it opens its own handle on the PDF
+    pdf_path, first, last = task
+    with fitz.open(pdf_path) as doc:
+        return [_page_text(doc[i]) for i in range(first, last)]
+
+def iter_pdf_pages(pdf_path: str, workers: int = None):
+    """Yield one record per page: ``{"page", "text", "start", "end"}``.
+
+    ``page`` is 1-based; ``start``/``end`` are character offsets of the page within the
+    document's text as a whole, so chunks can be mapped back to pages without ever
+    building that text. With ``workers`` > 1 page ranges are extracted on a process
+    pool (by default only for documents of PARALLEL_PAGE_THRESHOLD pages or more);
+    records are still yielded in page order.
+    """
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+    if workers is None:
+        workers = min(os.cpu_count() or 1, 8) if page_count >= PARALLEL_PAGE_THRESHOLD else 1
+
+    if workers <= 1 or page_count <= PAGES_PER_TASK:
+        yield from _page_records(_iter_page_texts(pdf_path))
+        return
+
+    tasks = [(pdf_path, first, min(first + PAGES_PER_TASK, page_count)) for first in range(0, page_count, PAGES_PER_TASK)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from _page_records(chain.from_iterable(pool.map(_extract_page_range, tasks)))
+
+def _iter_page_texts(pdf_path):
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            yield _page_text(page)
+
+def _page_records(texts):
+    offset = 0
+    for number, text in enumerate(texts, start=1):
+        yield {"page": number, "text": text, "start": offset, "end": offset + len(text)}
+        offset += len(text)
 
 def extract_text_from_pdf(pdf_path:str):
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page in doc:
-        page_text = page.get_text()
-        if isinstance(page_text, list):
-            page_text = " ".join(str(item) for item in page_text)
-        elif isinstance(page_text, dict):
-            page_text = str(page_text)
-        text += page_text
-    return text
-
-def build_index_from_pdf(pdf_path: str, persist_dir: str = "./rag_faiss_store"):
-    full_text = extract_text_from_pdf(pdf_path)
-    
-
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
-    documents = text_splitter.split_documents([Document(page_content=full_text)])
-
-    embeddings = AzureOpenAIEmbeddings(
-        azure_endpoint=AZURE_OPENAI_ENDPOINT,
-        api_key=AZURE_OPENAI_API_KEY,
-        api_version=AZURE_OPENAI_API_VERSION,
-        azure_deployment=AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+    return "".join(record["text"] for record in iter_pdf_pages(pdf_path))
+
+def split_pages(pages, chunk_size: int = 800, chunk_overlap: int = 100):
+    """Split a stream of page records into chunks carrying page-range metadata.
+
+    Only the unfinished tail of the previous page is carried over, so the document is
+    never held as one string. Each chunk gets ``page_start``/``page_end`` (1-based) and
+    ``char_start``/``char_end`` offsets.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+    )
+    page_starts, page_numbers = [], []
+    buffer, buffer_start = "", 0
+
+    def with_pages(chunk):
+        start = buffer_start + max(chunk.metadata.pop("start_index", 0), 0)
+        end = start + len(chunk.page_content)
+        chunk.metadata.update({
+            "page_start": page_numbers[bisect_right(page_starts, start) - 1],
+            "page_end": page_numbers[bisect_right(page_starts, max(start, end - 1)) - 1],
+            "char_start": start,
+            "char_end": end,
+        })
+        return chunk
+
+    for record in pages:
+        page_starts.append(record["start"])
+        page_numbers.append(record["page"])
+        buffer += record["text"]
+        chunks = text_splitter.create_documents([buffer])
+        if len(chunks) < 2:
+            continue
+        # Everything but the last chunk is final; the last one may continue on the next page
+        tail_start = chunks[-1].metadata["start_index"]
+        for chunk in chunks[:-1]:
+            yield with_pages(chunk)
+        if tail_start > 0:
+            buffer, buffer_start = buffer[tail_start:], buffer_start + tail_start
+
+    if buffer.strip():
+        for chunk in text_splitter.create_documents([buffer]):
+            yield with_pages(chunk)
+
+def _report_pages(items, page_of, total, on_page):
+    # A page is done once an item of a later page arrives
+    done = 0
+    for item in items:
+        page = page_of(item)
+        if page - 1 > done:
+            done = page - 1
+            on_page(done, total)
+        yield item
+    on_page(total, total)
+
+def split_pdf(pdf_path: str, workers: int = None, chunker: str = CHUNKER, on_page=None):
+    """Chunk a PDF with the clause-aware legal chunker (default) or the fixed-size ``split_pages``.
+
+    ``on_page(done, total)`` is called as pages are extracted.
+    """
+    if chunker == "legal":
+        items, page_of = iter_pdf_lines(pdf_path, workers=workers), lambda line: line[0]
+    else:
+        items, page_of = iter_pdf_pages(pdf_path, workers=workers), lambda record: record["page"]
+    if on_page is not None:
+        with fitz.open(pdf_path) as doc:
+            page_count = doc.page_count
+        items = _report_pages(items, page_of, page_count, on_page)
+    if chunker == "legal":
+        return list(chunk_lines(items))
+    return list(split_pages(items))
+
+def build_vector_store(documents, ids=None, use_cache: bool = True, on_progress=None, index_type: str = None,
+                       codec: str = None):
+    """Embed the chunks and return the in-memory FAISS store plus build stats.
+
+    Chunks are embedded in rate-limited batches; ``on_progress(done, total)`` is called as
+    each batch of uncached chunks comes back. ``index_type`` selects the FAISS index
+    (see ann_index.INDEX_TYPES) and ``codec`` how its vectors are stored (VECTOR_CODECS);
+    ``stats["index_params"]`` records what was built and must be saved with the store.
+    """
+    if not documents:
+        raise ValueError("No text could be extracted from the document.")
+
+    embeddings = BatchedEmbeddings(get_embeddings(), on_progress=on_progress)
+    if use_cache:
+        # Only chunks we haven't embedded before (with this deployment) hit the API
+        embeddings = CachedEmbeddings(embeddings, get_embedding_cache())
+    vectors = embeddings.embed_documents([doc.page_content for doc in documents])
+
+    index, index_params = build_faiss_index(np.asarray(vectors, dtype="float32"), index_type, codec=codec)
+    ids = ids or [str(uuid.uuid4()) for _ in documents]
+    db = FAISS(
+        embedding_function=get_embeddings(),
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(ids, documents))),
+        index_to_docstore_id=dict(enumerate(ids)),
     )
-    db = FAISS.from_documents(documents, embeddings)
+
+    stats = {
+        "chunks": len(documents),
+        "cache_hits": getattr(embeddings, "hits", 0),
+        "cache_misses": getattr(embeddings, "misses", len(documents)),
+        "index_params": index_params,
+    }
+    return db, stats
+
+def build_lexical_index(db):
+    """Build the BM25 index over a store's chunks, keyed by docstore ID."""
+    ids = [db.index_to_docstore_id[position] for position in range(len(db.index_to_docstore_id))]
+    return BM25Index.build(ids, [db.docstore.search(chunk_id).page_content for chunk_id in ids])
+
+def save_vector_store(db, persist_dir: str, index_params, facts=None):
+    """Save the FAISS index, its chunks (as a ``ChunkStore``), its parameters, a BM25
+    index of the same chunks and their facts (see legal_facts.py).
+
+    ``facts`` are rows from ``extract_facts``; by default the rule-based pass runs here.
+    """
     os.makedirs(persist_dir, exist_ok=True)
-    db.save_local(persist_dir)
+    # Files are replaced rather than rewritten so processes that map the old index keep working
+    write_index(db.index, os.path.join(persist_dir, "index.faiss"))
+    ids = [db.index_to_docstore_id[position] for position in range(db.index.ntotal)]
+    documents = (db.docstore.search(chunk_id) for chunk_id in ids)
+    ChunkStore.write(os.path.join(persist_dir, CHUNKS_FILE), ids, documents).close()
+    if facts is None:
+        facts = extract_facts(ids, (db.docstore.search(chunk_id) for chunk_id in ids), use_llm=False)
+    FactStore.write(os.path.join(persist_dir, FACTS_FILE), facts).close()
+    # A store saved over one in the old format must not keep its pickled docstore around
+    pickle_path = os.path.join(persist_dir, "index.pkl")
+    if os.path.exists(pickle_path):
+        os.remove(pickle_path)
+    save_index_params(persist_dir, index_params)
+    build_lexical_index(db).save(persist_dir)
+
+def load_vector_store(persist_dir: str, embeddings=None, mmap: bool = None):
+    """Load a saved store and its index parameters.
+
+    Nothing is deserialized: chunks stay in the chunk store until a search needs them, so
+    loading takes the same time whatever the corpus size. ``mmap`` (default INDEX_MMAP)
+    maps the index file instead of reading it into memory.
+    """
+    params = load_index_params(persist_dir)
+    mmap = INDEX_MMAP if mmap is None else mmap
+    chunks_path = os.path.join(persist_dir, CHUNKS_FILE)
+    if not os.path.exists(chunks_path) and os.path.exists(os.path.join(persist_dir, "index.pkl")):
+        raise FileNotFoundError(
+            f"'{persist_dir}' was saved with a pickled docstore (index.pkl), which is no longer loaded. "
+            f"Convert it with: python migrate_store.py {persist_dir}"
+        )
+    store = ChunkStore(chunks_path)
+    db = FAISS(
+        embedding_function=embeddings or get_embeddings(),
+        index=read_index(os.path.join(persist_dir, "index.faiss"), params, mmap),
+        docstore=store,
+        index_to_docstore_id=store.positions,
+    )
+    return db, params
+
+def build_index_from_pdf(pdf_path: str, persist_dir: str = "./rag_faiss_store", use_cache: bool = True,
+                         on_progress=None, index_type: str = None, summarize: bool = None):
+    """Build and save a FAISS index for a PDF, returning chunk and embedding-cache counts.
+
+    With ``summarize`` (default SUMMARY_TREE) a summary tree of the document is built too
+    and saved next to the index (see summary_tree.py); sections unchanged since the last
+    build keep their summaries. Facts are extracted from the chunks as well (the LLM pass
+    only with LEGAL_FACTS_LLM).
+    """
+    from index_manager import document_id_for
+
+    documents = split_pdf(pdf_path)
+    doc_id = document_id_for(os.path.basename(pdf_path))
+    ids = [f"{doc_id}:{i}" for i in range(len(documents))]
+
+    db, stats = build_vector_store(documents, ids=ids, use_cache=use_cache, on_progress=on_progress, index_type=index_type)
+    if SUMMARY_TREE if summarize is None else summarize:
+        tree = build_summary_tree(
+            documents, ids, os.path.basename(pdf_path), previous=load_summary_tree(persist_dir, doc_id)
+        )
+        save_summary_tree(persist_dir, doc_id, tree)
+        stats["summary"] = tree["stats"]
+    facts = extract_facts(ids, documents)
+    stats["facts"] = len(facts)
+    save_vector_store(db, persist_dir, stats["index_params"], facts=facts)
+
+    print(
+        f"Indexed {stats['chunks']} chunks into a {stats['index_params']['index_type']} index "
+        f"({stats['cache_hits']} cached, {stats['cache_misses']} embedded)"
+    )
+    return stats
 
 
 
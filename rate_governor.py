@@ -0,0 +1,379 @@
+"""Process-wide pacing of calls to the Azure OpenAI deployments.
+
+Every chat and embedding request takes its tokens and one request from the governor of
+its deployment before it is sent. Waiting callers are served in order of priority
+(interactive questions before bulk indexing) and arrival. The budgets refill at the
+configured per-minute quota and are corrected from the ``x-ratelimit-remaining-*``
+headers the service returns; a 429 holds every caller until its Retry-After has passed.
+
+With ``RATE_GOVERNOR_PATH`` set, the budgets live in a SQLite file shared by every
+process on the machine (e.g. several Streamlit servers and a batch job); queue order
+is still per process.
+"""
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import tracing
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Per-minute quotas of the deployments
+QUOTAS = {
+    "chat": (int(os.environ.get("CHAT_TPM", "150000")), int(os.environ.get("CHAT_RPM", "900"))),
+    "embeddings": (int(os.environ.get("EMBEDDING_TPM", "350000")), int(os.environ.get("EMBEDDING_RPM", "2100"))),
+}
+# Empty keeps the budgets in this process
+GOVERNOR_STATE_PATH = os.environ.get("RATE_GOVERNOR_PATH", "")
+# Completion tokens reserved for a chat call until its real usage is known
+CHAT_COMPLETION_ESTIMATE = int(os.environ.get("CHAT_COMPLETION_ESTIMATE", "800"))
+# Hold applied after a 429 that came without a Retry-After header
+DEFAULT_HOLD_SECONDS = 5.0
+# How often a waiter re-reads budgets shared with other processes
+SHARED_POLL_SECONDS = 0.25
+
+_priority = contextvars.ContextVar("rate_governor_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int):
+    """Run the calls made in this block at ``level`` (``INTERACTIVE`` or ``BULK``)."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    """The priority calls made here run at; worker threads don't inherit it, so pass it on."""
+    return _priority.get()
+
+
+class Budget:
+    """Requests and tokens left in the current window, refilled continuously.
+
+    Azure enforces quotas over short windows, so the burst capacity is ten seconds'
+    worth of the per-minute rate.
+    """
+
+    def __init__(self, tpm: int, rpm: int):
+        self.state = {
+            "token_rate": tpm / 60.0,
+            "request_rate": rpm / 60.0,
+            "token_capacity": max(1.0, tpm / 6.0),
+            "request_capacity": max(1.0, rpm / 6.0),
+            "tokens": max(1.0, tpm / 6.0),
+            "requests": max(1.0, rpm / 6.0),
+            "updated": time.time(),
+            "hold_until": 0.0,
+        }
+
+    @contextmanager
+    def _locked(self):
+        yield self.state
+
+    @staticmethod
+    def _refill(state, now):
+        elapsed = max(0.0, now - state["updated"])
+        state["tokens"] = min(state["token_capacity"], state["tokens"] + elapsed * state["token_rate"])
+        state["requests"] = min(state["request_capacity"], state["requests"] + elapsed * state["request_rate"])
+        state["updated"] = now
+
+    def take(self, tokens: float) -> float:
+        """Take one request and ``tokens`` if available; otherwise return the seconds to wait."""
+        with self._locked() as state:
+            now = time.time()
+            self._refill(state, now)
+            if now < state["hold_until"]:
+                return state["hold_until"] - now
+            # A request larger than the bucket can never fit, so let it through once the bucket is full
+            tokens = min(tokens, state["token_capacity"])
+            if state["requests"] >= 1 and state["tokens"] >= tokens:
+                state["requests"] -= 1
+                state["tokens"] -= tokens
+                return 0.0
+            return max(
+                (1 - state["requests"]) / state["request_rate"] if state["requests"] < 1 else 0.0,
+                (tokens - state["tokens"]) / state["token_rate"] if state["tokens"] < tokens else 0.0,
+            )
+
+    def give_back(self, tokens: float):
+        """Return over-reserved tokens (negative to charge more once real usage is known)."""
+        with self._locked() as state:
+            self._refill(state, time.time())
+            state["tokens"] = min(state["token_capacity"], state["tokens"] + tokens)
+
+    def observe(self, remaining_requests=None, remaining_tokens=None, limit_requests=None, limit_tokens=None):
+        """Align the budget with what the service reported; never raises it above our own count."""
+        with self._locked() as state:
+            self._refill(state, time.time())
+            if limit_tokens:
+                state["token_rate"] = limit_tokens / 60.0
+                state["token_capacity"] = max(1.0, limit_tokens / 6.0)
+            if limit_requests:
+                state["request_rate"] = limit_requests / 60.0
+                state["request_capacity"] = max(1.0, limit_requests / 6.0)
+            # Requests still in flight aren't in the service's numbers yet, so only ever lower ours
+            if remaining_tokens is not None:
+                state["tokens"] = min(state["tokens"], remaining_tokens)
+            if remaining_requests is not None:
+                state["requests"] = min(state["requests"], remaining_requests)
+
+    def hold(self, seconds: float):
+        """Let nothing through for ``seconds`` (after the service answered 429)."""
+        with self._locked() as state:
+            state["hold_until"] = max(state["hold_until"], time.time() + seconds)
+
+    def snapshot(self):
+        with self._locked() as state:
+            now = time.time()
+            self._refill(state, now)
+            return {
+                "requests": round(state["requests"], 2),
+                "tokens": round(state["tokens"]),
+                "held_for_s": round(max(0.0, state["hold_until"] - now), 2),
+            }
+
+
+class SharedBudget(Budget):
+    """A ``Budget`` stored in a SQLite file so several processes draw from the same quota."""
+
+    def __init__(self, path: str, name: str, tpm: int, rpm: int):
+        super().__init__(tpm, rpm)
+        self.name = name
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # isolation_level=None: transactions are managed explicitly below
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS budgets (name TEXT PRIMARY KEY, state TEXT NOT NULL)")
+            self._conn.execute(
+                "INSERT OR IGNORE INTO budgets (name, state) VALUES (?, ?)", (name, json.dumps(self.state))
+            )
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            # BEGIN IMMEDIATE takes the file's write lock, serialising updates across processes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                (raw,) = self._conn.execute("SELECT state FROM budgets WHERE name = ?", (self.name,)).fetchone()
+                state = json.loads(raw)
+                yield state
+                self._conn.execute("UPDATE budgets SET state = ? WHERE name = ?", (json.dumps(state), self.name))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+class Governor:
+    """Priority queue in front of one deployment's ``Budget``.
+
+    ``acquire`` blocks until the caller is first in line (lowest priority value, then
+    arrival order) and the budget has room, and returns the seconds it waited.
+    """
+
+    def __init__(self, name: str, tpm: int, rpm: int, state_path: str = GOVERNOR_STATE_PATH):
+        self.name = name
+        self.budget = SharedBudget(state_path, name, tpm, rpm) if state_path else Budget(tpm, rpm)
+        self.shared = bool(state_path)
+        self._cond = threading.Condition()
+        self._queue = []
+        self._arrivals = itertools.count()
+        self._waits = {level: deque(maxlen=500) for level in PRIORITY_NAMES}
+        self.granted = {level: 0 for level in PRIORITY_NAMES}
+
+    def acquire(self, tokens: float = 1.0, priority: int = None) -> float:
+        level = current_priority() if priority is None else priority
+        ticket = (level, next(self._arrivals))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    timeout = None
+                    if self._queue[0] == ticket:
+                        timeout = self.budget.take(tokens)
+                        if timeout <= 0:
+                            break
+                        if self.shared:
+                            timeout = min(timeout, SHARED_POLL_SECONDS)
+                    # The head of the line sleeps until the budget refills; everyone else until the head moves
+                    self._cond.wait(timeout)
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+            waited = time.monotonic() - start
+            self._waits[level].append(waited)
+            self.granted[level] += 1
+        if waited > 0.001:
+            tracing.count(f"rate_governor.{self.name}.wait_ms", round(waited * 1000, 1))
+        return waited
+
+    def _changed(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def give_back(self, tokens: float):
+        self.budget.give_back(tokens)
+        self._changed()
+
+    def back_off(self, seconds: float):
+        self.budget.hold(seconds)
+
+    def observe_headers(self, headers, status_code: int = 200):
+        """Update the budget from a response's rate-limit headers."""
+        def number(name):
+            value = headers.get(name)
+            try:
+                return float(value) if value is not None else None
+            except ValueError:
+                return None
+
+        self.budget.observe(
+            remaining_requests=number("x-ratelimit-remaining-requests"),
+            remaining_tokens=number("x-ratelimit-remaining-tokens"),
+            limit_requests=number("x-ratelimit-limit-requests"),
+            limit_tokens=number("x-ratelimit-limit-tokens"),
+        )
+        if status_code == 429:
+            retry_after_ms = number("retry-after-ms")
+            retry_after = retry_after_ms / 1000.0 if retry_after_ms is not None else number("retry-after")
+            self.back_off(retry_after or DEFAULT_HOLD_SECONDS)
+            tracing.count(f"rate_governor.{self.name}.throttled")
+        self._changed()
+
+    def stats(self):
+        """Queue depth per priority, wait times of recent grants and the remaining budget."""
+        with self._cond:
+            depth = {PRIORITY_NAMES[level]: 0 for level in PRIORITY_NAMES}
+            for level, _ in self._queue:
+                depth[PRIORITY_NAMES[level]] += 1
+            waits = {}
+            for level, samples in self._waits.items():
+                ordered = sorted(samples)
+                waits[PRIORITY_NAMES[level]] = {
+                    "granted": self.granted[level],
+                    "mean_ms": round(1000 * sum(ordered) / len(ordered), 1) if ordered else 0.0,
+                    "p95_ms": round(1000 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 1) if ordered else 0.0,
+                    "max_ms": round(1000 * ordered[-1], 1) if ordered else 0.0,
+                }
+        return {"queue_depth": depth, "waits": waits, "budget": self.budget.snapshot(), "shared": self.shared}
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(name: str) -> Governor:
+    """Return the process-wide governor for ``"chat"`` or ``"embeddings"``."""
+    with _governors_lock:
+        governor = _governors.get(name)
+        if governor is None:
+            tpm, rpm = QUOTAS[name]
+            governor = _governors[name] = Governor(name, tpm, rpm)
+        return governor
+
+
+def governor_stats():
+    with _governors_lock:
+        governors = dict(_governors)
+    return {name: governor.stats() for name, governor in governors.items()}
+
+
+# --- HTTP clients that report rate-limit headers ---
+
+_http_clients = {}
+_async_http_clients = {}
+
+
+def http_client(name: str):
+    """The shared httpx client for the OpenAI SDK that feeds every response's headers to ``get_governor(name)``."""
+    import httpx
+
+    class GovernedClient(httpx.Client):
+        # AutoGen deep-copies llm_config; the client (and its connection pool) is shared instead
+        def __deepcopy__(self, memo):
+            return self
+
+    governor = get_governor(name)
+    with _governors_lock:
+        client = _http_clients.get(name)
+        if client is None:
+            client = _http_clients[name] = GovernedClient(
+                event_hooks={"response": [lambda response: governor.observe_headers(response.headers, response.status_code)]}
+            )
+        return client
+
+
+def async_http_client(name: str):
+    """The shared ``httpx.AsyncClient`` counterpart of ``http_client``.
+
+    Async requests all run on the consultation service's event loop, so one client per
+    process keeps its connections pooled like the sync client's.
+    """
+    import httpx
+
+    class GovernedAsyncClient(httpx.AsyncClient):
+        def __deepcopy__(self, memo):
+            return self
+
+    governor = get_governor(name)
+
+    async def observe(response):
+        governor.observe_headers(response.headers, response.status_code)
+
+    with _governors_lock:
+        client = _async_http_clients.get(name)
+        if client is None:
+            client = _async_http_clients[name] = GovernedAsyncClient(event_hooks={"response": [observe]})
+        return client
+
+
+# --- AutoGen ---
+
+def govern_llm_client(agent, governor: Governor = None):
+    """Make every chat call of ``agent`` wait for the chat governor.
+
+    The prompt plus ``CHAT_COMPLETION_ESTIMATE`` tokens are reserved up front and the
+    difference is settled from the response's usage. Must be applied after the model
+    client is registered, since registration rebuilds ``agent.client``.
+    """
+    from embedding_pipeline import count_tokens, is_rate_limit_error, retry_after_seconds
+
+    governor = governor or get_governor("chat")
+    client = agent.client
+    if client is None or getattr(client, "_lexai_governed", False):
+        return
+    create = client.create
+
+    def governed_create(**params):
+        prompt = "".join(str(message.get("content") or "") for message in params.get("messages", []))
+        reserved = count_tokens(prompt) + (params.get("max_tokens") or CHAT_COMPLETION_ESTIMATE)
+        governor.acquire(reserved)
+        try:
+            response = create(**params)
+        except Exception as e:
+            if is_rate_limit_error(e):
+                governor.back_off(retry_after_seconds(e) or DEFAULT_HOLD_SECONDS)
+            raise
+        usage = getattr(response, "usage", None)
+        if usage is not None and getattr(usage, "total_tokens", None):
+            governor.give_back(reserved - usage.total_tokens)
+        return response
+
+    client.create = governed_create
+    client._lexai_governed = True
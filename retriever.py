@@ -0,0 +1,435 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+import tracing
+from ann_index import INDEX_MMAP, search_parameters
+from config import DEFAULT_PERSIST_DIR, get_embeddings
+from embedding_pipeline import count_tokens, embed_texts
+from index_manager import MANIFEST_NAME, read_manifest
+from lexical_index import LEXICAL_FILE, BM25Index, reciprocal_rank_fusion
+from matters import current_persist_dir
+from rag_index_builder import build_lexical_index, load_vector_store
+from rate_governor import current_priority, get_governor
+
+HYBRID_SEARCH = os.environ.get("HYBRID_SEARCH", "1").lower() not in ("0", "false", "no")
+# Query embeddings kept in memory, so a repeated query skips the embedding API. Nothing is
+# embedded ahead of time (e.g. a batch_qa checklist): the agent searches with queries it
+# rewords itself, so vectors of the original questions would rarely be used
+QUERY_EMBEDDING_MEMO = int(os.environ.get("QUERY_EMBEDDING_MEMO", "1024"))
+# Most inputs the embedding API accepts in one request
+MAX_EMBEDDING_INPUTS = 2048
+# Loaded indexes are evicted, least recently used first, once their estimated size passes this
+INDEX_POOL_MAX_MB = float(os.environ.get("INDEX_POOL_MAX_MB", "2048"))
+# A loaded BM25 index takes about five times its JSON file, and is held twice: per segment
+# and merged into the corpus-wide index
+LEXICAL_MEMORY_FACTOR = 10
+
+Segment = namedtuple("Segment", "db params lexical size")
+
+
+def segment_memory_bytes(path):
+    """Estimated memory of a loaded segment: its FAISS index, unless memory-mapped, and its
+    BM25 index. Chunk texts stay on disk in the chunk store."""
+    size = 0
+    if not INDEX_MMAP:
+        size += os.path.getsize(os.path.join(path, "index.faiss"))
+    lexical_path = os.path.join(path, LEXICAL_FILE)
+    if os.path.exists(lexical_path):
+        size += LEXICAL_MEMORY_FACTOR * os.path.getsize(lexical_path)
+    return size
+
+
+class _QueryEmbeddingMemo:
+    """Most recently used query embeddings, as float32 arrays."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query):
+        with self._lock:
+            embedding = self._entries.get(query)
+            if embedding is not None:
+                self._entries.move_to_end(query)
+            return embedding
+
+    def put(self, query, embedding):
+        # float32 arrays take an eighth of the memory of the client's lists of floats
+        embedding = np.asarray(embedding, dtype="float32")
+        with self._lock:
+            self._entries[query] = embedding
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return embedding
+
+
+# Every retriever using the default embeddings shares one memo, however many indexes are loaded
+_default_query_embeddings = _QueryEmbeddingMemo(QUERY_EMBEDDING_MEMO)
+
+
+class LegalRetriever:
+    """Keeps the FAISS index loaded in memory and reloads it only when the files on disk change.
+
+    A single instance per persist directory is shared by every caller in the process (tools,
+    Streamlit sessions, the CLI; see ``get_retriever``), so the index is loaded once instead
+    of on every tool call. Directories managed by ``IndexManager`` hold one or more
+    segments; only segments that are new since the last load are read from disk, and a
+    query searches all of them. The BM25 indexes saved with each segment are merged into
+    one corpus-wide lexical index for ``hybrid_search``.
+    """
+
+    def __init__(self, persist_dir: str = DEFAULT_PERSIST_DIR, embeddings=None, on_load=None):
+        self.persist_dir = persist_dir
+        self.embeddings = embeddings or get_embeddings()
+        if embeddings is None:
+            self._query_embeddings = _default_query_embeddings
+        else:
+            self._query_embeddings = _QueryEmbeddingMemo(QUERY_EMBEDDING_MEMO)
+        # Called with the retriever after each (re)load, e.g. by the IndexPool to enforce its budget
+        self._on_load = on_load
+        # (segment -> Segment, segment -> removed chunk IDs, merged BM25 index), swapped as one
+        self._state = ({}, {}, None)
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _disk_signature(self):
+        # Managed directories change only when the manifest is swapped; legacy stores are
+        # rewritten in place by save_local, so watch (name, size, mtime) of every file
+        manifest_path = os.path.join(self.persist_dir, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            stat = os.stat(manifest_path)
+            return ((MANIFEST_NAME, stat.st_size, stat.st_mtime_ns),)
+        try:
+            entries = sorted(os.scandir(self.persist_dir), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            return None
+        signature = []
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                signature.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def _load_segment(self, path):
+        db, params = load_vector_store(path, self.embeddings)
+        # Stores written before lexical indexes existed get one built in memory
+        lexical = BM25Index.load(path) or build_lexical_index(db)
+        return Segment(db, params, lexical, segment_memory_bytes(path))
+
+    def _load(self, signature):
+        while True:
+            try:
+                manifest = read_manifest(self.persist_dir)
+                if manifest is None:
+                    segments, tombstones = {"": self._load_segment(self.persist_dir)}, {}
+                else:
+                    # Segments are immutable, so anything already in memory can be reused as is
+                    segments = {}
+                    for entry in manifest["documents"].values():
+                        segment = entry["segment"]
+                        if segment not in segments:
+                            segments[segment] = self._state[0].get(segment) or self._load_segment(
+                                os.path.join(self.persist_dir, segment)
+                            )
+                    tombstones = {segment: set(ids) for segment, ids in manifest.get("tombstones", {}).items()}
+            except (FileNotFoundError, RuntimeError):
+                # A segment was removed or rewritten while we were reading; start over
+                if self._disk_signature() == signature:
+                    raise
+                signature = self._disk_signature()
+                continue
+            # The store may have been rewritten while we were reading it; if so, read it again
+            current = self._disk_signature()
+            if current == signature:
+                lexical = BM25Index.merge((name, segment.lexical) for name, segment in segments.items())
+                return (segments, tombstones, lexical), signature
+            signature = current
+
+    def _get_state(self):
+        signature = self._disk_signature()
+        if not signature:
+            raise FileNotFoundError(f"No FAISS index found in '{self.persist_dir}'. Upload a document first.")
+
+        state = self._state
+        if state[0] and signature == self._signature:
+            return state
+
+        loaded = False
+        with self._lock:
+            # Another thread may have reloaded while we waited for the lock
+            if not self._state[0] or signature != self._signature:
+                with tracing.span("retrieval.index_load", persist_dir=self.persist_dir) as load_span:
+                    self._state, self._signature = self._load(signature)
+                    load_span.set(segments=len(self._state[0]), memory_mb=round(self.memory_bytes() / 2 ** 20, 1))
+                loaded = True
+            state = self._state
+        # Outside the lock: the pool may unload other retrievers
+        if loaded and self._on_load is not None:
+            self._on_load(self)
+        return state
+
+    def memory_bytes(self) -> int:
+        """Estimated memory held by the loaded index (0 when nothing is loaded)."""
+        return sum(segment.size for segment in self._state[0].values())
+
+    def unload(self):
+        """Drop the loaded index; the next search loads it again."""
+        with self._lock:
+            self._state, self._signature = ({}, {}, None), None
+
+    def index_fingerprint(self):
+        """Return a hash identifying the indexed content; it changes whenever a document is added,
+        replaced or removed (used to invalidate cached answers)."""
+        manifest = read_manifest(self.persist_dir)
+        if manifest is None:
+            content = repr(self._disk_signature())
+        else:
+            content = json.dumps(
+                {"documents": {doc_id: entry["segment"] for doc_id, entry in manifest["documents"].items()},
+                 "tombstones": manifest.get("tombstones", {})},
+                sort_keys=True,
+            )
+        return hashlib.sha256(f"{os.path.abspath(self.persist_dir)}\n{content}".encode("utf-8")).hexdigest()
+
+    def get_stores(self):
+        """Return the loaded stores, reloading first if the persist directory changed."""
+        segments = self._get_state()[0]
+        return [segment.db for segment in segments.values()]
+
+    def refresh(self):
+        """Force the next access to re-check the persist directory and reload it now."""
+        with self._lock:
+            self._signature = None
+        return self.get_stores()
+
+    def _vector_hits(self, state, embedding, k, nprobe=None, ef_search=None):
+        # ((segment, chunk_id), L2 distance) pairs for the k closest live chunks, best first
+        return self._vector_hits_many(state, [embedding], k, nprobe, ef_search)[0]
+
+    def _vector_hits_many(self, state, embeddings, k, nprobe=None, ef_search=None):
+        # ``_vector_hits`` for several queries, with one FAISS search per segment for all of them
+        segments, tombstones, _ = state
+        queries = np.asarray(embeddings, dtype="float32")
+        hits = [[] for _ in range(len(queries))]
+        for name, segment in segments.items():
+            index = segment.db.index
+            removed = tombstones.get(name, ())
+            fetch = min(index.ntotal, k + len(removed))
+            if fetch <= 0:
+                continue
+            distances, positions = index.search(queries, fetch, params=search_parameters(segment.params, nprobe, ef_search))
+            for query_hits, row_distances, row_positions in zip(hits, distances, positions):
+                for distance, position in zip(row_distances, row_positions):
+                    if position < 0:
+                        continue
+                    chunk_id = segment.db.index_to_docstore_id[int(position)]
+                    if chunk_id not in removed:
+                        query_hits.append(((name, chunk_id), float(distance)))
+        for query_hits in hits:
+            query_hits.sort(key=lambda pair: pair[1])
+        return [query_hits[:k] for query_hits in hits]
+
+    @staticmethod
+    def _document(state, key):
+        name, chunk_id = key
+        return state[0][name].db.docstore.search(chunk_id)
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 3, nprobe: int = None, ef_search: int = None):
+        """Search every segment for the k closest chunks to ``embedding``; returns (doc, L2 distance) pairs.
+
+        ``nprobe`` (IVF indexes) and ``ef_search`` (HNSW) trade recall for latency; by default
+        each segment uses the values saved with it (or SEARCH_NPROBE / SEARCH_EF_SEARCH).
+        """
+        state = self._get_state()
+        return [(self._document(state, key), distance) for key, distance in self._vector_hits(state, embedding, k, nprobe, ef_search)]
+
+    def _embed_query(self, query):
+        embedding = self._query_embeddings.get(query)
+        if embedding is not None:
+            return embedding
+        with tracing.span("retrieval.embed_query"):
+            # Paced at the caller's priority: interactive unless run under rate_governor.priority(BULK)
+            get_governor("embeddings").acquire(count_tokens(query))
+            embedding = self.embeddings.embed_query(query)
+        return self._query_embeddings.put(query, embedding)
+
+    async def _aembed_query(self, query):
+        embedding = self._query_embeddings.get(query)
+        if embedding is not None:
+            return embedding
+        with tracing.span("retrieval.embed_query"):
+            await asyncio.to_thread(get_governor("embeddings").acquire, count_tokens(query))
+            embedding = await self.embeddings.aembed_query(query)
+        return self._query_embeddings.put(query, embedding)
+
+    def _embed_queries(self, queries, priority: int = None):
+        """Embeddings of ``queries``; those not in memory are embedded in as few requests as
+        the API allows, at ``priority`` (default: the caller's)."""
+        embeddings = {query: self._query_embeddings.get(query) for query in queries}
+        missing = [query for query, embedding in embeddings.items() if embedding is None]
+        if missing:
+            with tracing.span("retrieval.embed_queries", queries=len(missing)):
+                vectors = embed_texts(
+                    missing, self.embeddings, batch_size=min(len(missing), MAX_EMBEDDING_INPUTS),
+                    priority=current_priority() if priority is None else priority,
+                )
+            for query, vector in zip(missing, vectors):
+                embeddings[query] = self._query_embeddings.put(query, vector)
+        return [embeddings[query] for query in queries]
+
+    def similarity_search(self, query: str, k: int = 3, nprobe: int = None, ef_search: int = None, embedding=None):
+        if embedding is None:
+            embedding = self._embed_query(query)
+        with tracing.span("retrieval.vector_search", k=k):
+            return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, nprobe, ef_search)]
+
+    def lexical_search(self, query: str, k: int = 3):
+        state = self._get_state()
+        return [self._document(state, key) for key, _ in self._lexical_hits(state, query, k)]
+
+    def _lexical_hits(self, state, query, k):
+        _, tombstones, lexical = state
+        removed = {(name, chunk_id) for name, chunk_ids in tombstones.items() for chunk_id in chunk_ids}
+        return [(tuple(key), score) for key, score in lexical.search(query, k, exclude=removed)]
+
+    def hybrid_search(
+        self, query: str, k: int = 3, candidates: int = None, nprobe: int = None, ef_search: int = None, embedding=None
+    ):
+        """Fuse vector and BM25 results with reciprocal-rank fusion.
+
+        Exact terms such as defined party names, "indemnify" or "Section 12.3" are often
+        missed by the embedding alone; the lexical side recovers them. ``candidates`` is
+        how many hits each side contributes before fusion. Pass ``embedding`` if the query
+        vector has already been computed.
+        """
+        state = self._get_state()
+        candidates = candidates or max(4 * k, 20)
+        if embedding is None:
+            embedding = self._embed_query(query)
+        with tracing.span("retrieval.vector_search", k=candidates):
+            vector_keys = [key for key, _ in self._vector_hits(state, embedding, candidates, nprobe, ef_search)]
+        with tracing.span("retrieval.lexical_search", k=candidates):
+            lexical_keys = [key for key, _ in self._lexical_hits(state, query, candidates)]
+        fused = reciprocal_rank_fusion([vector_keys, lexical_keys])
+        return [self._document(state, key) for key in fused[:k]]
+
+    def search(self, query: str, k: int = 3, embedding=None):
+        """Default retrieval used by the agent tools: hybrid unless HYBRID_SEARCH is off."""
+        if HYBRID_SEARCH:
+            return self.hybrid_search(query, k=k, embedding=embedding)
+        return self.similarity_search(query, k=k, embedding=embedding)
+
+    def search_many(self, queries, k: int = 3, embeddings=None):
+        """``search`` for several queries at once; returns a list of documents per query.
+
+        The queries are embedded in one request and each segment is searched once for all
+        of them, e.g. for the retrieval tool calls an agent makes in a single turn.
+        """
+        state = self._get_state()
+        if embeddings is None:
+            embeddings = self._embed_queries(queries)
+        if not HYBRID_SEARCH:
+            with tracing.span("retrieval.vector_search", k=k, queries=len(queries)):
+                hits = self._vector_hits_many(state, embeddings, k)
+            return [[self._document(state, key) for key, _ in query_hits] for query_hits in hits]
+
+        candidates = max(4 * k, 20)
+        with tracing.span("retrieval.vector_search", k=candidates, queries=len(queries)):
+            hits = self._vector_hits_many(state, embeddings, candidates)
+        results = []
+        for query, query_hits in zip(queries, hits):
+            with tracing.span("retrieval.lexical_search", k=candidates):
+                lexical_keys = [key for key, _ in self._lexical_hits(state, query, candidates)]
+            fused = reciprocal_rank_fusion([[key for key, _ in query_hits], lexical_keys])
+            results.append([self._document(state, key) for key in fused[:k]])
+        return results
+
+    async def asearch_many(self, queries, k: int = 3):
+        """``search_many`` for asyncio callers; embedding and search run in worker threads."""
+        embeddings = await asyncio.to_thread(self._embed_queries, queries)
+        return await asyncio.to_thread(self.search_many, queries, k, embeddings)
+
+    async def asearch(self, query: str, k: int = 3):
+        """``search`` for asyncio callers: the query is embedded with the backend's async API
+        and the index lookup (and any reload) runs in a worker thread."""
+        embedding = await self._aembed_query(query)
+        return await asyncio.to_thread(self.search, query, k, embedding)
+
+
+class IndexPool:
+    """The process-wide retrievers, one per persist directory, within a memory budget.
+
+    When loading an index takes the estimated total (see ``segment_memory_bytes``) past
+    ``max_bytes``, the least recently used other indexes are unloaded and dropped from the
+    pool, so a server can host many matters with bounded memory. A dropped index is
+    loaded again, in a new retriever, the next time it is asked for.
+    """
+
+    def __init__(self, max_bytes: float):
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._retrievers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, persist_dir: str) -> LegalRetriever:
+        key = os.path.abspath(persist_dir)
+        with self._lock:
+            retriever = self._retrievers.get(key)
+            if retriever is None:
+                retriever = self._retrievers[key] = LegalRetriever(persist_dir, on_load=self._loaded)
+            self._retrievers.move_to_end(key)
+            return retriever
+
+    def _loaded(self, retriever):
+        with self._lock:
+            retrievers = list(self._retrievers.items())
+            total = sum(other.memory_bytes() for _, other in retrievers)
+            evicted = []
+            for key, other in retrievers:
+                if total <= self.max_bytes:
+                    break
+                if other is retriever:
+                    continue
+                total -= other.memory_bytes()
+                del self._retrievers[key]
+                evicted.append(other)
+            self.evictions += len(evicted)
+        for other in evicted:
+            other.unload()
+            tracing.count("retrieval.index_evictions")
+
+    def stats(self):
+        with self._lock:
+            retrievers = list(self._retrievers.values())
+        loaded = [retriever for retriever in retrievers if retriever.memory_bytes()]
+        return {
+            "indexes": len(retrievers),
+            "loaded": len(loaded),
+            "memory_mb": round(sum(retriever.memory_bytes() for retriever in loaded) / 2 ** 20, 1),
+            "max_mb": round(self.max_bytes / 2 ** 20, 1),
+            "evictions": self.evictions,
+        }
+
+
+_pool = IndexPool(INDEX_POOL_MAX_MB * 2 ** 20)
+
+
+def get_retriever(persist_dir: str = None) -> LegalRetriever:
+    """Return the shared retriever for a persist directory, creating it on first use.
+
+    Without ``persist_dir`` the index of the current matter is used (see matters.use_matter),
+    or the default store outside any matter.
+    """
+    return _pool.get(persist_dir or current_persist_dir())
+
+
+def index_pool_stats():
+    return _pool.stats()
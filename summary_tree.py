@@ -0,0 +1,325 @@
+"""Map-reduce summaries of indexed documents, for questions about a document as a whole.
+
+Retrieval only ever shows the agent a few chunks, so "summarize this contract" or "list
+its key clauses" used to take many tool calls and still see a fraction of the text. At
+index time each document gets a summary tree instead:
+
+- leaves: runs of consecutive chunks of one section (up to SUMMARY_LEAF_TOKENS),
+  summarized in parallel;
+- sections: the leaf summaries of each top-level section (article, schedule...) reduced
+  to one summary;
+- document: the section summaries reduced to an executive summary.
+
+Trees are saved as ``summaries/<doc_id>.json`` next to the index. Every node is keyed by
+a hash of its input, so re-indexing an amended document only calls the model for the
+leaves whose text changed and the sections and document above them.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import rate_governor
+import tracing
+from config import (
+    AZURE_OPENAI_API_KEY,
+    AZURE_OPENAI_API_VERSION,
+    AZURE_OPENAI_CHAT_DEPLOYMENT,
+    AZURE_OPENAI_ENDPOINT,
+)
+from embedding_pipeline import count_tokens, is_rate_limit_error, retry_after_seconds
+
+# Build a summary tree when a document is indexed
+SUMMARY_TREE = os.environ.get("SUMMARY_TREE", "0").lower() not in ("0", "false", "no")
+# "azure" (the chat deployment) or "extractive" (leading sentences; offline and benchmarks)
+SUMMARY_BACKEND = os.environ.get("SUMMARY_BACKEND", "azure").lower()
+SUMMARY_WORKERS = int(os.environ.get("SUMMARY_WORKERS", "8"))
+SUMMARY_LEAF_TOKENS = int(os.environ.get("SUMMARY_LEAF_TOKENS", "2000"))
+# Most tokens of child summaries reduced in one call; more are reduced in rounds
+SUMMARY_REDUCE_TOKENS = int(os.environ.get("SUMMARY_REDUCE_TOKENS", "6000"))
+# Chunks without a section (the recursive chunker) are grouped into sections of this many pages
+SUMMARY_SECTION_PAGES = 10
+SUMMARIES_DIR = "summaries"
+
+LEAF_PROMPT = (
+    "Summarize this excerpt of a legal document in at most five sentences. Keep the parties, "
+    "obligations, amounts, dates, deadlines and defined terms, with the clause numbers they appear in."
+)
+SECTION_PROMPT = (
+    "These are summaries of consecutive parts of the section '{title}' of a legal document. "
+    "Combine them into one summary of the section of at most eight sentences, keeping clause numbers, "
+    "amounts, dates and who must do what."
+)
+DOCUMENT_PROMPT = (
+    "These are summaries of the sections of the legal document '{name}'. Write an executive summary: "
+    "the parties and purpose, key obligations, payment terms, term and termination, liabilities and "
+    "risks, and governing law. Refer to sections by their titles."
+)
+LEAF_MAX_TOKENS = 250
+SECTION_MAX_TOKENS = 400
+DOCUMENT_MAX_TOKENS = 700
+
+
+class ChatSummarizer:
+    """Summaries from the chat deployment, paced by the chat governor at bulk priority."""
+
+    def __init__(self, max_retries: int = 6, initial_delay: float = 2.0):
+        from openai import AzureOpenAI
+
+        self.client = AzureOpenAI(
+            azure_endpoint=AZURE_OPENAI_ENDPOINT,
+            api_key=AZURE_OPENAI_API_KEY,
+            api_version=AZURE_OPENAI_API_VERSION,
+            http_client=rate_governor.http_client("chat"),
+        )
+        self.governor = rate_governor.get_governor("chat")
+        self.max_retries = max_retries
+        self.initial_delay = initial_delay
+
+    def summarize(self, instruction: str, text: str, max_tokens: int) -> str:
+        reserved = count_tokens(instruction) + count_tokens(text) + max_tokens
+        delay = self.initial_delay
+        for attempt in range(self.max_retries + 1):
+            # Index-time work: interactive consultations go first
+            self.governor.acquire(reserved, rate_governor.BULK)
+            try:
+                response = self.client.chat.completions.create(
+                    model=AZURE_OPENAI_CHAT_DEPLOYMENT,
+                    messages=[{"role": "system", "content": instruction}, {"role": "user", "content": text}],
+                    temperature=0,
+                    max_tokens=max_tokens,
+                )
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                tracing.count("summary.rate_limit_retries")
+                self.governor.back_off(retry_after_seconds(e) or delay)
+                time.sleep(random.uniform(0, 0.5))
+                delay *= 2
+                continue
+            if response.usage is not None:
+                self.governor.give_back(reserved - response.usage.total_tokens)
+            return (response.choices[0].message.content or "").strip()
+
+
+class ExtractiveSummarizer:
+    """Deterministic local stand-in: the leading sentences of the text, up to ``max_tokens``.
+
+    Enough to exercise the tree offline; it does not actually summarize.
+    """
+
+    def summarize(self, instruction: str, text: str, max_tokens: int) -> str:
+        summary, used = [], 0
+        for sentence in re.split(r"(?<=[.;:])\s+", " ".join(text.split())):
+            cost = count_tokens(sentence)
+            if summary and used + cost > max_tokens:
+                break
+            summary.append(sentence)
+            used += cost
+        return " ".join(summary)
+
+
+def get_summarizer():
+    if SUMMARY_BACKEND == "extractive":
+        return ExtractiveSummarizer()
+    return ChatSummarizer()
+
+
+def _key(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+def _section_title(document):
+    metadata = document.metadata
+    if metadata.get("section_path"):
+        return metadata["section_path"][0]
+    first = (metadata.get("page_start", 1) - 1) // SUMMARY_SECTION_PAGES * SUMMARY_SECTION_PAGES + 1
+    return f"Pages {first}-{first + SUMMARY_SECTION_PAGES - 1}"
+
+
+def plan_tree(documents, ids):
+    """Group chunks into sections and leaves, without summaries: ``[{"title", "pages", "leaves"}]``."""
+    sections = []
+    for chunk_id, document in zip(ids, documents):
+        title = _section_title(document)
+        tokens = count_tokens(document.page_content)
+        page_start = document.metadata.get("page_start")
+        page_end = document.metadata.get("page_end", page_start)
+        if not sections or sections[-1]["title"] != title:
+            sections.append({"title": title, "pages": [page_start, page_end], "leaves": []})
+        section = sections[-1]
+        section["pages"][1] = page_end if page_end is not None else section["pages"][1]
+        leaves = section["leaves"]
+        if not leaves or leaves[-1]["tokens"] + tokens > SUMMARY_LEAF_TOKENS:
+            leaves.append({"chunk_ids": [], "texts": [], "tokens": 0})
+        leaves[-1]["chunk_ids"].append(chunk_id)
+        leaves[-1]["texts"].append(document.page_content)
+        leaves[-1]["tokens"] += tokens
+    return sections
+
+
+def _reduce(summarizer, instruction, texts, max_tokens):
+    # Child summaries that don't fit one call are reduced in groups first
+    while len(texts) > 1 and count_tokens("\n\n".join(texts)) > SUMMARY_REDUCE_TOKENS:
+        groups, group, used = [], [], 0
+        for text in texts:
+            cost = count_tokens(text)
+            if group and used + cost > SUMMARY_REDUCE_TOKENS:
+                groups.append(group)
+                group, used = [], 0
+            group.append(text)
+            used += cost
+        groups.append(group)
+        if len(groups) == len(texts):
+            break
+        texts = [summarizer.summarize(instruction, "\n\n".join(group), max_tokens) for group in groups]
+    return summarizer.summarize(instruction, "\n\n".join(texts), max_tokens)
+
+
+def build_summary_tree(documents, ids, name: str, previous=None, summarizer=None, workers: int = SUMMARY_WORKERS,
+                       on_progress=None):
+    """Summarize a document's chunks into a tree; nodes whose input matches ``previous`` are reused.
+
+    ``on_progress(done, total)`` is called as leaves and sections are summarized. Returns
+    the tree (see ``save_summary_tree``) with ``stats`` of calls made and nodes reused.
+    """
+    summarizer = summarizer or get_summarizer()
+    known = {}
+    for section in (previous or {}).get("sections", ()):
+        known[section["key"]] = section["summary"]
+        for leaf in section["leaves"]:
+            known[leaf["key"]] = leaf["summary"]
+    if previous:
+        known[previous["key"]] = previous["summary"]
+
+    sections = plan_tree(documents, ids)
+    leaves = [leaf for section in sections for leaf in section["leaves"]]
+    for leaf in leaves:
+        leaf["key"] = _key("leaf", *leaf["texts"])
+    for section in sections:
+        # A section's summary only depends on its title and its leaves' text
+        section["key"] = _key("section", section["title"], *(leaf["key"] for leaf in section["leaves"]))
+
+    todo_leaves = [leaf for leaf in leaves if leaf["key"] not in known]
+    todo_sections = [section for section in sections if section["key"] not in known]
+    total = len(todo_leaves) + len(todo_sections) + 1
+    done = 0
+
+    def report():
+        if on_progress is not None:
+            on_progress(done, total)
+
+    def summarize_leaf(leaf):
+        return summarizer.summarize(LEAF_PROMPT, "\n\n".join(leaf["texts"]), LEAF_MAX_TOKENS)
+
+    def summarize_section(section):
+        if len(section["leaves"]) == 1:
+            # Nothing to combine
+            return section["leaves"][0]["summary"]
+        return _reduce(
+            summarizer, SECTION_PROMPT.format(title=section["title"]),
+            [leaf["summary"] for leaf in section["leaves"]], SECTION_MAX_TOKENS,
+        )
+
+    for node in leaves + sections:
+        node["summary"] = known.get(node["key"])
+    report()
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="summary")
+    try:
+        # Leaves first: a section is reduced from its leaves' summaries
+        for nodes, summarize in ((todo_leaves, summarize_leaf), (todo_sections, summarize_section)):
+            pending = {executor.submit(summarize, node): node for node in nodes}
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pending.pop(future)["summary"] = future.result()
+                    done += 1
+                    report()
+    finally:
+        # On an error (or a cancelled indexing job) don't start the summaries still queued
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    document_key = _key("document", name, *(section["key"] for section in sections))
+    summary = known.get(document_key)
+    summarized = len(todo_leaves) + len(todo_sections) + (summary is None)
+    if summary is None:
+        summary = _reduce(
+            summarizer, DOCUMENT_PROMPT.format(name=name),
+            [f"{section['title']}: {section['summary']}" for section in sections], DOCUMENT_MAX_TOKENS,
+        )
+    done = total
+    report()
+
+    for leaf in leaves:
+        del leaf["texts"], leaf["tokens"]
+    return {
+        "version": 1,
+        "name": name,
+        "key": document_key,
+        "summary": summary,
+        "sections": sections,
+        "stats": {
+            "leaves": len(leaves),
+            "sections": len(sections),
+            "summarized": summarized,
+            "reused": len(leaves) + len(sections) + 1 - summarized,
+        },
+    }
+
+
+def summary_path(persist_dir: str, doc_id: str) -> str:
+    return os.path.join(persist_dir, SUMMARIES_DIR, f"{doc_id}.json")
+
+
+def save_summary_tree(persist_dir: str, doc_id: str, tree):
+    path = summary_path(persist_dir, doc_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(tree, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_summary_tree(persist_dir: str, doc_id: str):
+    try:
+        with open(summary_path(persist_dir, doc_id), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def remove_summary_tree(persist_dir: str, doc_id: str):
+    try:
+        os.remove(summary_path(persist_dir, doc_id))
+    except FileNotFoundError:
+        pass
+
+
+def has_summary_trees(persist_dir: str) -> bool:
+    """True if any document of an index directory has a saved summary tree."""
+    try:
+        return any(name.endswith(".json") for name in os.listdir(os.path.join(persist_dir, SUMMARIES_DIR)))
+    except FileNotFoundError:
+        return False
+
+
+def load_summary_trees(persist_dir: str):
+    """``{doc_id: tree}`` for every summarized document of an index directory."""
+    trees = {}
+    try:
+        names = sorted(os.listdir(os.path.join(persist_dir, SUMMARIES_DIR)))
+    except FileNotFoundError:
+        return trees
+    for name in names:
+        if name.endswith(".json"):
+            tree = load_summary_tree(persist_dir, name[:-len(".json")])
+            if tree is not None:
+                trees[name[:-len(".json")]] = tree
+    return trees
@@ -1,54 +1,196 @@
+import asyncio
 import os
-from dotenv import load_dotenv
-from langchain_community.vectorstores import FAISS
-from langchain_openai import AzureOpenAIEmbeddings
-from autogen import AssistantAgent, register_function
-
-load_dotenv()
-
-# Load Azure OpenAI credentials and config from environment variables
-AZURE_OPENAI_API_KEY = os.environ.get("AZURE_OPENAI_API_KEY")
-AZURE_OPENAI_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT")
-AZURE_OPENAI_API_VERSION = os.environ.get("AZURE_OPENAI_API_VERSION")
-AZURE_OPENAI_EMBEDDING_DEPLOYMENT = os.environ.get("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
-
-# Define the assistant agent
-legal_assistant = AssistantAgent(
-    name="LegalAssistant",
-    llm_config={
-        "config_list": [
-            {
-                "api_key": AZURE_OPENAI_API_KEY,
-                "base_url": AZURE_OPENAI_ENDPOINT,
-                "api_type": "azure",
-                "api_version": AZURE_OPENAI_API_VERSION,
-                "model": "gpt-4o",  # Replace with your Azure deployment model name
-            }
-        ],
-        "temperature": 0
-    }
-)
+
+import tracing
+from context_builder import CONTEXT_CANDIDATES, build_context
+from embedding_pipeline import count_tokens
+from index_manager import read_manifest
+from legal_facts import FACT_KINDS, FACTS_FILE, FactStore
+from retriever import get_retriever
+from summary_tree import load_summary_trees
+
+NO_NEW_PASSAGES = "No passages beyond those already retrieved for the other queries."
+NO_SUMMARIES = "No precomputed summaries are available; use retrieve_legal_context instead."
+# Tokens of precomputed summaries handed to the agent for a whole-document question
+SUMMARY_CONTEXT_TOKENS = int(os.environ.get("SUMMARY_CONTEXT_TOKENS", "4000"))
+NO_FACTS = "No matching facts were extracted; use retrieve_legal_context instead."
+# Distinct facts listed per lookup
+LEGAL_FACTS_LIMIT = int(os.environ.get("LEGAL_FACTS_LIMIT", "40"))
+FACT_KIND_ALIASES = {
+    "dates": "date", "deadlines": "deadline", "notice": "deadline", "period": "deadline", "amounts": "amount",
+    "money": "amount", "parties": "party", "defined term": "defined_term", "defined terms": "defined_term",
+    "definitions": "defined_term", "terms": "defined_term", "obligations": "obligation",
+}
+
 
 def retrieve_legal_context(query: str) -> str:
-    embeddings = AzureOpenAIEmbeddings(
-        azure_endpoint=AZURE_OPENAI_ENDPOINT,
-        api_key=AZURE_OPENAI_API_KEY,
-        api_version=AZURE_OPENAI_API_VERSION,
-        azure_deployment=AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+    # The shared retriever keeps the index and embeddings client loaded between calls
+    with tracing.span("tool.retrieve_legal_context") as tool_span:
+        docs = get_retriever().search(query, k=CONTEXT_CANDIDATES)
+        context = build_context(docs)
+        tool_span.set(results=len(docs), **context.stats)
+    return context.text
+
+
+async def aretrieve_legal_context(query: str) -> str:
+    """Async variant registered on agents that run on an event loop (see consultation_service)."""
+    with tracing.span("tool.retrieve_legal_context") as tool_span:
+        docs = await get_retriever().asearch(query, k=CONTEXT_CANDIDATES)
+        context = build_context(docs)
+        tool_span.set(results=len(docs), **context.stats)
+    return context.text
+
+
+def _assign_chunks(results):
+    # A chunk found by several queries is kept only for the one that ranks it highest
+    # (the earliest query on a tie), so the agent doesn't read the same passage twice
+    best = {}
+    for query_index, docs in enumerate(results):
+        for rank, doc in enumerate(docs):
+            key = doc.metadata.get("chunk_id") or doc.page_content
+            if key not in best or rank < best[key][0]:
+                best[key] = (rank, query_index)
+    return [
+        [doc for doc in docs if best[doc.metadata.get("chunk_id") or doc.page_content][1] == query_index]
+        for query_index, docs in enumerate(results)
+    ]
+
+
+def _contexts(results, tool_span):
+    contexts = [build_context(docs) for docs in _assign_chunks(results)]
+    tool_span.set(
+        results=sum(len(docs) for docs in results),
+        tokens=sum(context.stats.get("tokens", 0) for context in contexts),
     )
+    return [context.text or NO_NEW_PASSAGES for context in contexts]
+
+
+def retrieve_legal_contexts(queries):
+    """Context for each of ``queries``, from one embedding request and one index search.
+
+    Used for the batch tool and for parallel ``retrieve_legal_context`` calls (see
+    legal_agent); each chunk appears in the context of one query only.
+    """
+    with tracing.span("tool.retrieve_legal_context_batch", queries=len(queries)) as tool_span:
+        return _contexts(get_retriever().search_many(queries, k=CONTEXT_CANDIDATES), tool_span)
+
+
+async def aretrieve_legal_contexts(queries):
+    with tracing.span("tool.retrieve_legal_context_batch", queries=len(queries)) as tool_span:
+        return _contexts(await get_retriever().asearch_many(queries, k=CONTEXT_CANDIDATES), tool_span)
+
+
+def _grouped(queries, contexts):
+    return "\n\n".join(f"## Results for: {query}\n{context}" for query, context in zip(queries, contexts))
+
+
+def _unique(queries):
+    return list(dict.fromkeys(query.strip() for query in queries if query and query.strip()))
+
+
+def retrieve_legal_context_batch(queries: list[str]) -> str:
+    queries = _unique(queries)
+    return _grouped(queries, retrieve_legal_contexts(queries)) if queries else "No queries given."
+
+
+async def aretrieve_legal_context_batch(queries: list[str]) -> str:
+    queries = _unique(queries)
+    return _grouped(queries, await aretrieve_legal_contexts(queries)) if queries else "No queries given."
+
+
+def _pages(pages):
+    first, last = pages
+    if first is None:
+        return ""
+    return f" (p. {first})" if first == last else f" (pp. {first}-{last})"
+
+
+def get_document_summary(document: str = "") -> str:
+    """Precomputed summaries of the indexed documents (or those whose name contains
+    ``document``): each document's executive summary, then its section summaries as far as
+    SUMMARY_CONTEXT_TOKENS allows."""
+    with tracing.span("tool.get_document_summary") as tool_span:
+        persist_dir = get_retriever().persist_dir
+        trees = load_summary_trees(persist_dir)
+        manifest = read_manifest(persist_dir)
+        if manifest is not None:
+            # Only documents still in the index
+            trees = {doc_id: tree for doc_id, tree in trees.items() if doc_id in manifest["documents"]}
+        wanted = document.strip().lower()
+        if wanted:
+            trees = {doc_id: tree for doc_id, tree in trees.items() if wanted in f"{doc_id} {tree['name']}".lower()}
+        if not trees:
+            return NO_SUMMARIES
+
+        parts = {doc_id: [f"# {tree['name']}\n{tree['summary']}"] for doc_id, tree in trees.items()}
+        used = sum(count_tokens(part[0]) for part in parts.values())
+        for doc_id, tree in trees.items():
+            for section in tree["sections"]:
+                text = f"## {section['title']}{_pages(section['pages'])}\n{section['summary']}"
+                cost = count_tokens(text)
+                if used + cost <= SUMMARY_CONTEXT_TOKENS:
+                    parts[doc_id].append(text)
+                    used += cost
+        tool_span.set(documents=len(trees), tokens=used)
+    return "\n\n".join("\n\n".join(part) for part in parts.values())
+
+
+async def aget_document_summary(document: str = "") -> str:
+    return await asyncio.to_thread(get_document_summary, document)
+
+
+def _fact_stores(persist_dir):
+    # Each segment's facts with the chunk IDs removed from it since, or the legacy store's
+    manifest = read_manifest(persist_dir)
+    if manifest is None:
+        return [(persist_dir, set())]
+    tombstones = manifest.get("tombstones", {})
+    segments = sorted({entry["segment"] for entry in manifest["documents"].values()})
+    return [(os.path.join(persist_dir, segment), set(tombstones.get(segment, ()))) for segment in segments]
+
+
+def lookup_legal_facts(kind: str = "", text: str = "") -> str:
+    """Facts extracted from the documents at indexing time: dates, deadlines, amounts,
+    parties, defined terms and (when extracted) obligations, optionally only those of
+    ``kind`` mentioning ``text``. Repeats of a fact are listed once with all their pages."""
+    kind = kind.strip().lower()
+    kind = FACT_KIND_ALIASES.get(kind, kind.replace(" ", "_"))
+    if kind and kind not in FACT_KINDS:
+        return f"Unknown kind '{kind}'; use one of: {', '.join(FACT_KINDS)}."
+    with tracing.span("tool.lookup_legal_facts", kind=kind or None) as tool_span:
+        found = {}
+        for store_dir, removed in _fact_stores(get_retriever().persist_dir):
+            path = os.path.join(store_dir, FACTS_FILE)
+            if not os.path.exists(path):
+                continue
+            store = FactStore(path)
+            try:
+                rows = store.search(kind or None, text.strip() or None, exclude=removed)
+            finally:
+                store.close()
+            for row in rows:
+                key = (row["source"], row["kind"], row["normalized"] or row["value"])
+                found.setdefault(key, {"row": row, "pages": set()})["pages"].add(row["page_start"])
+        tool_span.set(facts=len(found))
+        if not found:
+            return NO_FACTS
+
+        lines = []
+        for (source, fact_kind, normalized), fact in list(found.items())[:LEGAL_FACTS_LIMIT]:
+            pages = sorted(page for page in fact["pages"] if page is not None)
+            where = ", ".join(part for part in (source, "p. " + ", ".join(map(str, pages)) if pages else "") if part)
+            value = fact["row"]["value"]
+            if fact["row"]["normalized"] and fact["row"]["normalized"] != value:
+                value += f" ({fact['row']['normalized']})"
+            lines.append(f"- [{where}] {fact_kind}: {value} — {fact['row']['snippet']}")
+        if len(found) > LEGAL_FACTS_LIMIT:
+            lines.append(f"({len(found) - LEGAL_FACTS_LIMIT} more; narrow the lookup with kind or text.)")
+    return "\n".join(lines)
+
+
+async def alookup_legal_facts(kind: str = "", text: str = "") -> str:
+    return await asyncio.to_thread(lookup_legal_facts, kind, text)
 
-    db = FAISS.load_local("rag_faiss_store", embeddings, allow_dangerous_deserialization=True)
-    docs = db.similarity_search(query, k=3)
-    print(docs)
-    return "\n\n".join([doc.page_content for doc in docs])
-
-# ✅ Register it manually using function call style
-register_function(
-    retrieve_legal_context,
-    caller=legal_assistant,
-    executor=legal_assistant,
-    description="Retrieve relevant legal context from the indexed legal documents based on the query."
-)
 
 # Test the function
 if __name__ == "__main__":
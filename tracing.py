@@ -0,0 +1,259 @@
+"""Lightweight spans and counters for the query and indexing pipelines.
+
+Sinks are chosen with ``TRACE_SINKS`` (comma-separated): ``memory`` (default; keeps recent
+traces for the sidebar), ``log`` (one log line per span), ``jsonl`` (appends to
+``TRACE_JSONL_PATH``) and ``otel`` (re-emits spans through the OpenTelemetry API, if
+installed). ``TRACE_SINKS=none`` disables tracing; ``span()`` then returns a shared no-op
+object, so instrumented code pays only for a function call.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger("lexai.trace")
+
+_current_span = contextvars.ContextVar("lexai_current_span", default=None)
+
+
+class _NoopSpan:
+    trace_id = None
+    span_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, name, value=1):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    def __init__(self, name, attrs):
+        parent = _current_span.get()
+        self.name = name
+        self.attrs = attrs
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.status = "ok"
+        self.start_time = None
+        self.duration_ms = None
+        self._token = None
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.status = "error"
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        for sink in _sinks:
+            try:
+                sink.export(self)
+            except Exception:
+                logger.exception("Trace sink %s failed", type(sink).__name__)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, name, value=1):
+        self.attrs[name] = self.attrs.get(name, 0) + value
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "attrs": self.attrs,
+        }
+
+
+def span(name: str, **attrs):
+    """Time a block of work: ``with span("retrieval.search", k=3) as s: ...; s.set(hits=2)``."""
+    if not _sinks:
+        return NOOP_SPAN
+    return Span(name, attrs)
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def _bump(name, value):
+    with _counters_lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def count(name: str, value=1):
+    """Add to a process-wide counter and to the enclosing span's attributes."""
+    if not _sinks:
+        return
+    _bump(name, value)
+    current_span().add(name, value)
+
+
+def counters():
+    with _counters_lock:
+        return dict(_counters)
+
+
+def record_llm_usage(span_obj, response):
+    """Copy token usage from an OpenAI-style response onto a span and the token counters."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", 0) or 0
+    completion = getattr(usage, "completion_tokens", 0) or 0
+    span_obj.set(prompt_tokens=prompt, completion_tokens=completion, model=getattr(response, "model", None))
+    _bump("llm.prompt_tokens", prompt)
+    _bump("llm.completion_tokens", completion)
+    _bump("llm.calls", 1)
+
+
+def trace_llm_client(agent, summary_prompt: str = None):
+    """Wrap an AutoGen agent's LLM client so every call becomes an ``llm.call`` span with token usage.
+
+    Call this after registering tools: registration rebuilds the agent's client.
+    Calls whose last message is ``summary_prompt`` are tagged as summary calls.
+    """
+    client = getattr(agent, "client", None)
+    if not _sinks or client is None or getattr(client, "_lexai_traced", False):
+        return
+    create = client.create
+
+    def traced_create(**params):
+        messages = params.get("messages") or []
+        last = messages[-1].get("content") if messages and isinstance(messages[-1], dict) else None
+        kind = "summary" if summary_prompt and last == summary_prompt else "turn"
+        with span("llm.call", agent=agent.name, kind=kind, messages=len(messages)) as s:
+            response = create(**params)
+            record_llm_usage(s, response)
+            return response
+
+    client.create = traced_create
+    client._lexai_traced = True
+
+
+# --- sinks ---
+
+class MemorySink:
+    """Keeps the spans of the most recent traces in memory (for the Streamlit sidebar)."""
+
+    def __init__(self, max_traces: int = 200):
+        self.max_traces = max_traces
+        self._traces = OrderedDict()
+        self._lock = threading.Lock()
+
+    def export(self, span_obj):
+        with self._lock:
+            spans = self._traces.setdefault(span_obj.trace_id, [])
+            spans.append(span_obj.to_dict())
+            self._traces.move_to_end(span_obj.trace_id)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+
+    def get_trace(self, trace_id):
+        with self._lock:
+            return list(self._traces.get(trace_id, []))
+
+
+class LogSink:
+    def export(self, span_obj):
+        logger.info(
+            "span %s %.1fms trace=%s %s",
+            span_obj.name, span_obj.duration_ms, span_obj.trace_id, json.dumps(span_obj.attrs, default=str),
+        )
+
+
+class JsonlSink:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span_obj):
+        line = json.dumps(span_obj.to_dict(), default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class OTelSink:
+    """Re-emits finished spans through the OpenTelemetry API (configure its exporter as usual)."""
+
+    def __init__(self):
+        from opentelemetry import trace
+
+        self._tracer = trace.get_tracer("lexai")
+
+    def export(self, span_obj):
+        attributes = {key: value if isinstance(value, (str, bool, int, float)) else str(value)
+                      for key, value in span_obj.attrs.items() if value is not None}
+        attributes.update({"lexai.trace_id": span_obj.trace_id, "lexai.parent_id": span_obj.parent_id or ""})
+        start_ns = int(span_obj.start_time * 1e9)
+        otel_span = self._tracer.start_span(span_obj.name, start_time=start_ns, attributes=attributes)
+        otel_span.end(end_time=start_ns + int(span_obj.duration_ms * 1e6))
+
+
+_sinks = []
+_memory_sink = None
+
+
+def configure(sinks):
+    """Replace the active sinks; pass ``[]`` to disable tracing."""
+    global _sinks, _memory_sink
+    _memory_sink = next((sink for sink in sinks if isinstance(sink, MemorySink)), None)
+    _sinks = list(sinks)
+
+
+def get_trace(trace_id):
+    """Return the recorded spans of a trace (empty unless the memory sink is active)."""
+    if _memory_sink is None or trace_id is None:
+        return []
+    return _memory_sink.get_trace(trace_id)
+
+
+def _sinks_from_env():
+    sinks = []
+    for name in os.environ.get("TRACE_SINKS", "memory").lower().split(","):
+        name = name.strip()
+        if name == "memory":
+            sinks.append(MemorySink())
+        elif name == "log":
+            sinks.append(LogSink())
+        elif name == "jsonl":
+            sinks.append(JsonlSink(os.environ.get("TRACE_JSONL_PATH", "lexai_traces.jsonl")))
+        elif name == "otel":
+            try:
+                sinks.append(OTelSink())
+            except ImportError:
+                logger.warning("TRACE_SINKS includes 'otel' but opentelemetry is not installed")
+    return sinks
+
+
+configure(_sinks_from_env())